@@ -0,0 +1,648 @@
+"""Benchmarks for the DQN training and deployment servers.
+
+Usage:
+    python benchmark.py connection [--steps 2000]
+    python benchmark.py parse [--repeat 20]
+    python benchmark.py train-step [--repeat 20]
+    python benchmark.py compiled [--steps 500]
+    python benchmark.py multi-env [--steps 500]
+    python benchmark.py convergence [--steps 6000]
+    python benchmark.py sampling [--capacity 1000000]
+    python benchmark.py deploy [--requests 5000]
+    python benchmark.py deploy-batch [--frames 200]
+    python benchmark.py numpy-model [--repeat 2000]
+    python benchmark.py deploy-reload [--requests 20000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import gh_stub
+import protocol
+
+HOST = '127.0.0.1'
+
+
+def _run_client(client, steps, input_dim):
+    state = gh_stub.random_state(input_dim)
+    for _ in range(steps):
+        client.step(state, 1.0)
+    client.close()
+
+
+def bench_connection(steps=2000, input_dim=16, state_port=18080,
+                     reward_port=18081):
+    """Environment steps per second: legacy vs. persistent connection.
+
+    The server side does no inference, so only the protocol cost is measured.
+    """
+
+    import training
+
+    modes = [
+        ('legacy',
+         lambda: training.LegacyConnection(HOST, state_port, reward_port),
+         lambda: gh_stub.LegacyStubClient(HOST, state_port, reward_port)),
+        ('persistent',
+         lambda: training.PersistentConnection(HOST, state_port),
+         lambda: gh_stub.PersistentStubClient(HOST, state_port)),
+    ]
+
+    print('connection | steps={} input_dim={}'.format(steps, input_dim))
+    for name, make_server, make_client in modes:
+        server = make_server()
+        client = threading.Thread(
+            target=lambda: _run_client(make_client(), steps, input_dim))
+        client.start()
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            server.recv_state()
+            server.send_action(0)
+            server.recv_reward()
+        elapsed = time.perf_counter() - start
+
+        client.join()
+        server.close()
+        print('  {:<12} {:>10.1f} steps/s  {:>8.1f} us/step'.format(
+            name, steps / elapsed, 1e6 * elapsed / steps))
+
+
+def _best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parse(repeat=20, sizes=(16, 256, 4096, 65536, 100000)):
+    """State decode throughput, text vs. binary, for several INPUT_DIMs."""
+
+    print('parse | best of {}'.format(repeat))
+    print('  {:>8} {:>14} {:>14} {:>14}'.format(
+        'dim', 'text', 'float32', 'float64'))
+    for size in sizes:
+        state = np.random.random(size)
+        payloads = [
+            ' '.join(str(value) for value in state.tolist()).encode(),
+            protocol.encode_state(state, 'float32'),
+            protocol.encode_state(state, 'float64'),
+        ]
+        rates = []
+        for payload in payloads:
+            elapsed = _best_time(lambda: protocol.decode_state(payload), repeat)
+            rates.append('{:.3g} val/s'.format(size / elapsed))
+        print('  {:>8} {:>14} {:>14} {:>14}'.format(size, *rates))
+
+
+def _random_batch(batch_size, input_dim, output_dim):
+    return (np.random.random((batch_size, input_dim)).astype(np.float32),
+            np.random.randint(0, output_dim, batch_size),
+            np.random.random(batch_size).astype(np.float32),
+            np.random.random((batch_size, input_dim)).astype(np.float32),
+            np.zeros(batch_size, dtype=bool))
+
+
+def _train_step_per_row(model, states, actions, rewards, next_states, dones):
+    # Training step as it was written before q_targets(), for comparison
+    import training
+
+    q_s_a   = np.asarray(model.predict_on_batch(states)).tolist()
+    q_s_a_d = np.asarray(model.predict_on_batch(next_states)).tolist()
+    x = np.zeros(shape=(len(states), training.INPUT_DIM))
+    y = np.zeros(shape=(len(states), training.OUTPUT_DIM))
+    for index in range(len(states)):
+        current_q = q_s_a[index]
+        current_q[actions[index]] = training.ALPHA * (
+            rewards[index] + training.GAMMA * np.amax(q_s_a_d[index]))
+        x[index] = states[index]
+        y[index] = current_q
+    model.train_on_batch(x, y)
+
+
+def bench_train_step(repeat=20, batch_sizes=(64, 512, 4096)):
+    """Training step wall time, per-row loop vs. vectorized train_step()."""
+
+    import training
+
+    model = training.build_model()
+    steps = [('per-row', _train_step_per_row),
+             ('vectorized', training.train_step)]
+
+    print('train-step | best of {}'.format(repeat))
+    for batch_size in batch_sizes:
+        batch = _random_batch(batch_size, training.INPUT_DIM,
+                              training.OUTPUT_DIM)
+        for name, step in steps:
+            step(model, *batch) # warmup
+            elapsed = _best_time(lambda: step(model, *batch), repeat)
+            print('  batch={:<6} {:<12} {:>8.2f} ms'.format(
+                batch_size, name, 1e3 * elapsed))
+
+
+def _steps_per_second(func, steps):
+    func() # warmup, traces tf.functions
+    start = time.perf_counter()
+    for _ in range(steps):
+        func()
+    return steps / (time.perf_counter() - start)
+
+
+def bench_compiled(steps=500, batch_size=64):
+    """CPU steps per second of the eager and graph compiled paths."""
+
+    import training
+
+    model = training.build_model()
+    batch = _random_batch(batch_size, training.INPUT_DIM, training.OUTPUT_DIM)
+    batch = batch[:1] + (batch[1].astype(np.int32),) + batch[2:] + \
+        (np.ones(batch_size, dtype=np.float32),)
+    state = batch[0][:1]
+
+    train_steps = [
+        ('eager', lambda: training.train_step(model, *batch[:5])),
+        ('tf.function', lambda f=training.compile_train_step(model): f(*batch)),
+        ('tf.function+xla',
+         lambda f=training.compile_train_step(model, True): f(*batch)),
+    ]
+    acts = [
+        ('eager', lambda: model.predict_on_batch(state)),
+        ('tf.function', lambda f=training.compile_act(model): f(state)),
+        ('tf.function+xla', lambda f=training.compile_act(model, True): f(state)),
+    ]
+
+    print('compiled | steps={} batch={}'.format(steps, batch_size))
+    for label, funcs in [('train step', train_steps), ('act', acts)]:
+        for name, func in funcs:
+            print('  {:<12} {:<16} {:>10.1f} steps/s'.format(
+                label, name, _steps_per_second(func, steps)))
+
+
+def bench_multi_env(steps=500, clients=(1, 2, 4, 8), port=18080):
+    """Throughput of vectorized_server() for several GH stub clients.
+
+    Every client is a separate process running a ToyEnvironment for steps
+    environment steps, like parallel Grasshopper instances would.
+    """
+
+    import training
+
+    training.STATE_PORT      = port
+    training.MODEL_SAVE_FREQ = float('inf')
+    context = multiprocessing.get_context('spawn')
+
+    results = []
+    for num_envs in clients:
+        training.NUM_ENVS   = num_envs
+        training.ITERATIONS = num_envs * steps
+        processes = [context.Process(target=gh_stub.run_toy_client,
+                                     args=(HOST, port, steps))
+                     for _ in range(num_envs)]
+        for process in processes:
+            process.start()
+        served, elapsed = training.vectorized_server()
+        for process in processes:
+            process.join()
+        results.append((num_envs, served / elapsed))
+
+    print('multi-env | steps per client={}'.format(steps))
+    for num_envs, rate in results:
+        print('  clients={:<4} {:>10.1f} steps/s  {:>5.2f}x'.format(
+            num_envs, rate, rate / results[0][1]))
+
+
+def _greedy_success(act, env):
+    """Fraction of start cells from which the greedy policy reaches the goal."""
+
+    successes = 0
+    for start in range(env.input_dim):
+        env.position, env.steps, done = start, 0, start == env.goal
+        while not done:
+            state = np.array([env.state()], dtype=np.float32)
+            _, reward, done = env.step(int(np.argmax(np.asarray(act(state)[1]))))
+        successes += reward > 0 or start == env.goal
+    return successes / env.input_dim
+
+
+def run_toy_training(max_steps, eval_freq=250, seed=0):
+    """Train on a ToyEnvironment in process until the greedy policy solves it.
+
+    Uses the current training module settings (TARGET_NETWORK, ...).
+
+    Returns:
+        steps -- Environment steps until every start cell reaches the goal,
+        None if that did not happen within max_steps.
+    """
+
+    import random
+    import tensorflow as tf
+    import training
+
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+    model   = training.build_model()
+    memory  = training.replay_memory()
+    trainer = training.Trainer(model, memory)
+    act     = training.compiled_act(model)
+    env     = gh_stub.ToyEnvironment(training.INPUT_DIM, max_steps=50)
+
+    training.epsilon = training.INITIAL_EPSILON
+    state = env.reset()
+    for step in range(1, max_steps + 1):
+        q_estimates = np.asarray(act(np.array([state], dtype=np.float32))[1])
+        action, _ = training.e_greedy_policy(q_estimates)
+        next_state, reward, done = env.step(action)
+        memory.append(state, action, reward, next_state, done)
+        state = env.reset() if done else next_state
+
+        trainer.train()
+        training.epsilon = training.FINAL_EPSILON + (1 - training.LAMBDA) * \
+            (training.epsilon - training.FINAL_EPSILON)
+
+        if step % eval_freq == 0 and _greedy_success(act, env) == 1.0:
+            return step
+
+    return None
+
+
+def bench_convergence(steps=6000, seeds=(0, 1, 2)):
+    """Environment steps to solve the ToyEnvironment with target networks
+    and prioritized replay."""
+
+    import training
+
+    training.GAMMA = 0.9 # the toy goal is up to 15 steps away
+    configs = [('no target', False, 100, 0.0, False),
+               ('hard sync K=100', True, 100, 0.0, False),
+               ('hard sync K=500', True, 500, 0.0, False),
+               ('soft tau=0.01', True, 100, 0.01, False),
+               ('prioritized', False, 100, 0.0, True),
+               ('prioritized K=100', True, 100, 0.0, True)]
+
+    print('convergence | max steps={} seeds={}'.format(steps, len(seeds)))
+    for name, target, sync_freq, tau, prioritized in configs:
+        training.TARGET_NETWORK     = target
+        training.TARGET_SYNC_FREQ   = sync_freq
+        training.TARGET_TAU         = tau
+        training.PRIORITIZED_REPLAY = prioritized
+        results = [run_toy_training(steps, seed=seed) for seed in seeds]
+        print('  {:<18} {}'.format(name, ['>{}'.format(steps) if r is None
+                                         else r for r in results]))
+
+
+def bench_sampling(capacity=1000000, batch_sizes=(64, 512, 4096), repeat=50):
+    """Cost of sampling a batch (and updating its priorities) from a full
+    replay memory, uniform vs. prioritized."""
+
+    import replay
+
+    uniform     = replay.ReplayMemory(capacity, 16)
+    prioritized = replay.PrioritizedReplayMemory(capacity, 16)
+    uniform.size = prioritized.size = capacity
+    prioritized.tree.update(np.arange(capacity), np.random.random(capacity))
+
+    # Sampling Frequencies Match priority / total, also when the memory is
+    # partly filled and float rounding overshoots the last priority
+    check = replay.PrioritizedReplayMemory(128, 16)
+    check.size = 100
+    priorities = np.random.random(check.size)
+    priorities[-1] = 1e-3
+    check.tree.update(np.arange(check.size), priorities)
+    draws = 2000
+    counts = np.bincount(np.concatenate(
+        [check.sample_indices(64) for _ in range(draws)]),
+        minlength=check.size)
+    expected = priorities / priorities.sum()
+    frequencies = counts / (64 * draws)
+    tolerance = 5 * np.sqrt(expected * (1 - expected) / (64 * draws))
+    assert len(counts) == check.size and \
+        np.all(np.abs(frequencies - expected) <= tolerance + 1e-4), \
+        'prioritized sampling frequencies differ from priority / total'
+    print('sampling | frequencies match priority / total, max error '
+          '{:.1e}'.format(np.abs(frequencies - expected).max()))
+
+    print('sampling | capacity={} best of {}'.format(capacity, repeat))
+    for batch_size in batch_sizes:
+        td_errors = np.random.random(batch_size)
+        tests = [
+            ('uniform sample', lambda: uniform.sample(batch_size)),
+            ('prioritized sample', lambda: prioritized.batch(
+                prioritized.sample_indices(batch_size))),
+            ('prioritized weights', lambda: prioritized.weights(
+                prioritized.sample_indices(batch_size))),
+            ('priority update', lambda: prioritized.update_priorities(
+                prioritized.sample_indices(batch_size), td_errors)),
+        ]
+        for name, func in tests:
+            elapsed = _best_time(func, repeat)
+            print('  batch={:<6} {:<20} {:>8.1f} us'.format(
+                batch_size, name, 1e6 * elapsed))
+
+
+def _save_untrained_model(directory):
+    import training
+
+    path = os.path.join(directory, 'model.h5')
+    training.build_model().save(path)
+    return path
+
+
+def bench_deploy(requests=5000, port=18082):
+    """Action latency of the persistent deploy server for every predictor,
+    measured by the gh_stub load generator (round trip) and by the server."""
+
+    import deploy
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = _save_untrained_model(directory)
+
+        print('deploy | requests={}'.format(requests))
+        for kind in deploy.PREDICTORS:
+            predict = deploy.load_predictor(model_path, kind)
+            server  = deploy.InferenceServer(predict, HOST, port)
+            thread  = threading.Thread(target=server.serve_forever)
+            thread.start()
+            latencies = gh_stub.run_load_generator(HOST, port, requests)
+            server.shutdown()
+            thread.join()
+            server.close()
+
+            print('  {:<12} round trip p50={:.3f} ms p99={:.3f} ms | '
+                  'server {}'.format(kind, 1e3 * np.percentile(latencies, 50),
+                                     1e3 * np.percentile(latencies, 99),
+                                     server.latency))
+
+
+def _serve_clients(server, clients):
+    """Serve until every client process has finished.
+
+    Returns:
+        elapsed -- Seconds from the first client start to the last exit.
+    """
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    thread.join()
+    server.close()
+
+    return elapsed
+
+
+def bench_deploy_batch(frames=200, agents=(1, 64, 1024), clients=16,
+                       predictor='tf.function', port=18082):
+    """Agents served per second by the deploy server.
+
+    One frame asks for the actions of all agents, either with one request
+    per agent or with a single MSG_STATES request. Micro-batching is then
+    measured with concurrent single-agent clients, each a separate process.
+    """
+
+    import deploy
+
+    with tempfile.TemporaryDirectory() as directory:
+        predict = deploy.load_predictor(_save_untrained_model(directory),
+                                        predictor)
+
+        print('deploy-batch | predictor={} frames={}'.format(predictor, frames))
+        for num_agents in agents:
+            # Per-Agent Requests are Slow, Cap Their Number
+            singles = min(frames * num_agents, 5000)
+            tests = [('per-agent requests', singles, None),
+                     ('batched request', frames, num_agents)]
+            for name, requests, batch in tests:
+                server = deploy.InferenceServer(predict, HOST, port)
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                latencies = gh_stub.run_load_generator(
+                    HOST, port, requests, dtype='float32', agents=batch)
+                server.shutdown()
+                thread.join()
+                server.close()
+
+                served = requests * (batch or 1)
+                print('  agents={:<5} {:<20} {:>10.0f} agents/s  '
+                      'frame {:>8.3f} ms'.format(
+                          num_agents, name, served / sum(latencies),
+                          1e3 * num_agents * sum(latencies) / served))
+
+        context  = multiprocessing.get_context('spawn')
+        requests = frames * 10
+        print('micro-batching | clients={} requests per client={}'.format(
+            clients, requests))
+        for window in [0.0, deploy.BATCH_WINDOW]:
+            server = deploy.InferenceServer(predict, HOST, port,
+                                            batch_window=window)
+            processes = [context.Process(target=gh_stub.run_load_generator,
+                                         args=(HOST, port, requests, 16,
+                                               'float32'))
+                         for _ in range(clients)]
+            elapsed = _serve_clients(server, processes)
+            print('  window={:<8} {:>10.0f} requests/s  {:>6.1f} states per '
+                  'prediction | server {}'.format(
+                      '{:g} ms'.format(1e3 * window),
+                      server.requests / elapsed,
+                      server.rows / max(server.predictions, 1), server.latency))
+
+
+# ru_maxrss survives exec() and would report the parent, VmHWM does not
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import deploy
+deploy.load_predictor(sys.argv[1], sys.argv[2], 1)
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as status:
+    max_rss = [line.split()[1] for line in status if line.startswith('VmHWM')]
+print(elapsed, max_rss[0])
+'''
+
+# Largest |q - q_keras| accepted per export dtype, relative to max |q_keras|
+NUMPY_MODEL_TOLERANCE = {'float32': 1e-5, 'float16': 5e-3, 'int8': 5e-2}
+
+
+def bench_numpy_model(repeat=2000, batch_sizes=(1, 64, 1024)):
+    """NumPy inference engine against Keras: parity of the q-estimates,
+    startup time and peak memory of a fresh deploy process, and latency."""
+
+    import deploy
+    import numpy_model
+    import training
+
+    model  = training.build_model()
+    states = np.random.random((4096, training.INPUT_DIM)).astype(np.float32)
+    q_keras = np.asarray(model.predict_on_batch(states))
+
+    with tempfile.TemporaryDirectory() as directory:
+        h5_path = os.path.join(directory, 'model.h5')
+        model.save(h5_path)
+
+        print('numpy-model | parity on {} states'.format(len(states)))
+        for dtype in numpy_model.DTYPES:
+            path = os.path.join(directory, '{}.npz'.format(dtype))
+            numpy_model.export_model(model, path, dtype)
+            q = numpy_model.NumpyModel.load(path)(states)
+            error = np.abs(q - q_keras).max()
+            print('  {:<8} {:>6} bytes  max |q - q_keras| = {:.2e}  '
+                  'same action {:>6.2f} %'.format(
+                      dtype, os.path.getsize(path), error,
+                      100 * np.mean(q.argmax(1) == q_keras.argmax(1))))
+            tolerance = NUMPY_MODEL_TOLERANCE[dtype] * np.abs(q_keras).max()
+            assert error <= tolerance, \
+                '{} export differs by {:.2e} > {:.2e}'.format(dtype, error, tolerance)
+
+        print('startup | import deploy + load_predictor() in a new process')
+        npz_path = os.path.join(directory, 'float32.npz')
+        for kind, path in [('tf.function', h5_path), ('numpy', npz_path)]:
+            output = subprocess.check_output(
+                [sys.executable, '-c', STARTUP_SCRIPT, path, kind],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL)
+            elapsed, max_rss = output.split()[-2:]
+            print('  {:<12} {:>8.1f} ms  peak rss {:>6.1f} MB'.format(
+                kind, 1e3 * float(elapsed), int(max_rss) / 1024))
+
+        print('latency | best of {}'.format(repeat))
+        predictors = {kind: deploy.load_predictor(h5_path, kind)
+                      for kind in deploy.PREDICTORS if kind != 'eager'}
+        for batch_size in batch_sizes:
+            batch = states[:batch_size]
+            for kind, predict in predictors.items():
+                elapsed = _best_time(lambda: predict(batch), repeat)
+                print('  batch={:<5} {:<12} {:>8.1f} us'.format(
+                    batch_size, kind, 1e6 * elapsed))
+
+
+def bench_deploy_reload(requests=20000, reloads=5, predictor='tf.function',
+                        port=18082):
+    """Round trip latency of the deploy server while the checkpoint watcher
+    swaps in new checkpoints, and the per-model statistics of an A/B split.
+
+    Every request must be answered, a dropped one fails the benchmark.
+    """
+
+    import checkpoint
+    import deploy
+    import training
+
+    with tempfile.TemporaryDirectory() as directory:
+        model = training.build_model()
+        checkpointer = checkpoint.Checkpointer(directory, training.build_model())
+        checkpointer.save(0, model)
+        checkpointer.wait()
+
+        print('deploy-reload | predictor={} requests={}'.format(
+            predictor, requests))
+        for reload in [False, True]:
+            server = deploy.InferenceServer(deploy.load_predictor(
+                os.path.join(directory, '0.h5'), predictor), HOST, port,
+                name='0.h5', candidate_fraction=0.2)
+            server.swap('candidate', 'untrained', deploy.load_predictor(
+                _save_untrained_model(directory), predictor))
+            watcher = deploy.CheckpointWatcher(server, directory, predictor,
+                                               interval=0.05, current=0)
+            thread  = threading.Thread(target=server.serve_forever)
+            thread.start()
+            if reload:
+                watcher.start()
+
+            latencies = []
+            client = threading.Thread(target=lambda: latencies.extend(
+                gh_stub.run_load_generator(HOST, port, requests,
+                                           dtype='float32')))
+            client.start()
+            for i in range(1, reloads + 1 if reload else 1):
+                time.sleep(0.5)
+                model.set_weights([w + 0.01 for w in model.get_weights()])
+                checkpointer.save(i, model)
+            client.join()
+            if reload:
+                watcher.stop()
+            server.shutdown()
+            thread.join()
+            server.close()
+
+            assert len(latencies) == requests
+            print('  {:<10} {:>2} swaps | round trip p50={:.3f} ms '
+                  'p99={:.3f} ms max={:.1f} ms'.format(
+                      'reload' if reload else 'static',
+                      reloads if reload else 0,
+                      1e3 * np.percentile(latencies, 50),
+                      1e3 * np.percentile(latencies, 99), 1e3 * max(latencies)))
+            print('    primary   {}'.format(server.primary))
+            print('    candidate {}'.format(server.candidate))
+        checkpointer.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+    sub = subparsers.add_parser('connection')
+    sub.add_argument('--steps', type=int, default=2000)
+    sub = subparsers.add_parser('parse')
+    sub.add_argument('--repeat', type=int, default=20)
+    sub = subparsers.add_parser('train-step')
+    sub.add_argument('--repeat', type=int, default=20)
+    sub = subparsers.add_parser('compiled')
+    sub.add_argument('--steps', type=int, default=500)
+    sub = subparsers.add_parser('multi-env')
+    sub.add_argument('--steps', type=int, default=500)
+    sub = subparsers.add_parser('convergence')
+    sub.add_argument('--steps', type=int, default=6000)
+    sub = subparsers.add_parser('sampling')
+    sub.add_argument('--capacity', type=int, default=1000000)
+    sub = subparsers.add_parser('deploy')
+    sub.add_argument('--requests', type=int, default=5000)
+    sub = subparsers.add_parser('deploy-batch')
+    sub.add_argument('--frames', type=int, default=200)
+    sub.add_argument('--predictor', default='tf.function')
+    sub = subparsers.add_parser('numpy-model')
+    sub.add_argument('--repeat', type=int, default=2000)
+    sub = subparsers.add_parser('deploy-reload')
+    sub.add_argument('--requests', type=int, default=20000)
+    sub.add_argument('--predictor', default='tf.function')
+    args = parser.parse_args()
+
+    if args.benchmark == 'connection':
+        bench_connection(args.steps)
+    elif args.benchmark == 'parse':
+        bench_parse(args.repeat)
+    elif args.benchmark == 'train-step':
+        bench_train_step(args.repeat)
+    elif args.benchmark == 'compiled':
+        bench_compiled(args.steps)
+    elif args.benchmark == 'multi-env':
+        bench_multi_env(args.steps)
+    elif args.benchmark == 'convergence':
+        bench_convergence(args.steps)
+    elif args.benchmark == 'sampling':
+        bench_sampling(args.capacity)
+    elif args.benchmark == 'deploy':
+        bench_deploy(args.requests)
+    elif args.benchmark == 'deploy-batch':
+        bench_deploy_batch(args.frames, predictor=args.predictor)
+    elif args.benchmark == 'numpy-model':
+        bench_numpy_model(args.repeat)
+    elif args.benchmark == 'deploy-reload':
+        bench_deploy_reload(args.requests, predictor=args.predictor)
+    else:
+        parser.print_help()
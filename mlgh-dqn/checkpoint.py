@@ -0,0 +1,172 @@
+"""Checkpoints written from a background thread.
+
+The training loop only takes an in-memory snapshot (model weights and,
+optionally, the replay memory and epsilon); a worker thread writes it to
+disk. Every file is first written under a temporary name and then renamed,
+so a crash never leaves a partially written checkpoint behind.
+
+Files in the checkpoint directory:
+
+    <iteration>.h5 -- Full model, the last `keep` written by the run are
+                      kept. Other numbered files are never removed.
+    best.h5        -- Model with the highest metric seen so far.
+    best.npz       -- Metric and iteration of best.h5, a new run only
+                      replaces best.h5 with a better model.
+    state.npz      -- Replay memory, epsilon and iteration of the last
+                      state checkpoint, used to resume training.
+"""
+
+import os
+import queue
+import re
+import shutil
+import threading
+
+import numpy as np
+
+CHECKPOINT_NAME = r'^(\d+){}$'
+
+
+def checkpoints(directory, extension='.h5'):
+    """Return the iterations of all numbered checkpoints, sorted."""
+
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(CHECKPOINT_NAME.format(re.escape(extension)))
+    names   = (pattern.match(name) for name in os.listdir(directory))
+
+    return sorted(int(match.group(1)) for match in names if match)
+
+
+def replace_atomic(write, path):
+    """Call write(tmp_path) and rename the result to path.
+
+    Arguments:
+        write -- Function writing a file to the path it is given.
+        path -- Final path, its extension is kept for the temporary file.
+    """
+
+    root, ext = os.path.splitext(path)
+    tmp_path  = '{}.tmp{}'.format(root, ext)
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def best_metric(directory):
+    """Return the metric recorded for best.h5 in directory, or None."""
+
+    path = os.path.join(directory, 'best.npz')
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return float(data['metric'])
+
+
+class Checkpointer(object):
+    """Write model and training state snapshots in the background.
+
+    Arguments:
+        directory -- Directory the checkpoints are written to.
+        model -- A tf.keras.model() with the architecture of the trained
+        model. It only receives snapshots, never pass the trained model.
+        keep -- Number of numbered model checkpoints to keep. Only the
+        ones written by this Checkpointer (or the run it resumes, see
+        load_state()) are removed.
+    """
+
+    def __init__(self, directory, model, keep=5):
+        self.directory = directory
+        self.model     = model
+        self.keep      = keep
+        self.saved     = [] # iterations written by this run, oldest first
+        self.best      = best_metric(directory) # best metric so far
+        self.error     = None
+        self.queue     = queue.Queue(maxsize=1) # bounds snapshots in memory
+        self.thread    = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def save(self, iteration, model, state=None, metric=None):
+        """Snapshot model (and state) and queue them for writing.
+
+        Only blocks if the previous checkpoint is still being written.
+
+        Arguments:
+            iteration -- Number used as checkpoint name.
+            model -- The trained tf.keras.model().
+            state -- Optional dict of np.array() objects and scalars, see
+            np.savez(). Copy anything that changes after this call.
+            metric -- Optional score, the model with the highest one is
+            also kept as best.h5.
+        """
+
+        if self.error is not None:
+            raise self.error
+        self.queue.put((iteration, model.get_weights(), state, metric))
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.__write(*item)
+            except Exception as e:
+                print('\n  -- CHECKPOINT FAILED ({}) --'.format(e))
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def __write(self, iteration, weights, state, metric):
+        os.makedirs(self.directory, exist_ok=True)
+        self.model.set_weights(weights)
+
+        path = os.path.join(self.directory, '{}.h5'.format(iteration))
+        replace_atomic(self.model.save, path)
+        self.saved.append(iteration)
+
+        if metric is not None and (self.best is None or metric > self.best):
+            self.best = metric
+            best_path = os.path.join(self.directory, 'best.h5')
+            replace_atomic(lambda tmp: shutil.copyfile(path, tmp), best_path)
+            best_info = {'metric': metric, 'iteration': iteration}
+            replace_atomic(lambda tmp: np.savez(tmp, **best_info),
+                           os.path.join(self.directory, 'best.npz'))
+
+        # Retention: Keep the Last Checkpoints (best.h5 is a separate copy)
+        while len(self.saved) > self.keep:
+            old = os.path.join(self.directory, '{}.h5'.format(self.saved.pop(0)))
+            if os.path.exists(old):
+                os.remove(old)
+
+        if state is not None:
+            state = dict(state, iteration=iteration,
+                         best=np.nan if self.best is None else self.best,
+                         checkpoints=np.array(self.saved, dtype=np.int64))
+            state_path = os.path.join(self.directory, 'state.npz')
+            replace_atomic(lambda tmp: np.savez(tmp, **state), state_path)
+
+    def wait(self):
+        """Block until all queued checkpoints are written."""
+
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def load_state(self):
+        """Return the last saved training state as a dict, or None."""
+
+        path = os.path.join(self.directory, 'state.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            state = {key: data[key] for key in data.files}
+        if not np.isnan(state['best']) and self.best is None:
+            self.best = float(state['best'])
+        if 'checkpoints' in state:
+            # Resume Retention of the Checkpoints of the Resumed Run
+            self.saved = [int(iteration) for iteration in state['checkpoints']
+                          if iteration not in self.saved] + self.saved
+
+        return state
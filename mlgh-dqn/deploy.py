@@ -1,8 +1,18 @@
-import tensorflow as tf
 import numpy as np
 import socket
+import logging
+import logging.handlers
+import queue
+import selectors
+import threading
+import time
 import os
 
+import checkpoint
+import protocol
+import numpy_model
+from metrics import LatencyStats
+
 ### Parameters from GH
 INPUT_DIM  = 16
 
@@ -10,16 +20,165 @@ INPUT_DIM  = 16
 TIMEOUT         = 10
 MODEL_SAVE_PATH = 'D:\\DRL\\models' # CHANGE THIS TO WHERE MODELS WERE SAVED
 MODEL_NAME      = '10000.h5'        # CHANGE THIS TO THE NAME OF THE MODEL
+                                    # (.npz exported by numpy_model.py)
+
+### Inference Server
+HOST            = '127.0.0.1'
+PORT            = 8082
+CONNECTION_MODE = 'legacy'      # 'legacy' (deploy.gh) or 'persistent'
+PREDICTOR       = 'tf.function' # 'eager', 'tf.function', 'tflite' or 'numpy'
+WARMUP_STEPS    = 20
+LOG_LEVEL       = logging.INFO  # logging.DEBUG prints every state and action
+STATS_FREQ      = 1000          # requests between latency reports
+BATCH_WINDOW    = 0.0005        # seconds to wait for requests of other clients
+MAX_BATCH       = 1024          # states coalesced into one prediction at most
+
+### Model Updates (persistent mode)
+WATCH_CHECKPOINTS  = False     # serve the newest checkpoint in MODEL_SAVE_PATH
+WATCH_INTERVAL     = 5.0       # seconds between checks for new checkpoints
+WATCH_ROLE         = 'primary' # model replaced by new checkpoints, or 'candidate'
+CANDIDATE_NAME     = None      # model answering CANDIDATE_FRACTION of requests
+CANDIDATE_FRACTION = 0.1
+
+logger = logging.getLogger('deploy')
+
+def setup_logging(level=LOG_LEVEL):
+    """Log through a queue so formatting and printing happen in a separate
+    thread, off the request path.
+
+    Returns:
+        listener -- The started logging.handlers.QueueListener().
+    """
+
+    log_queue = queue.Queue()
+    listener  = logging.handlers.QueueListener(
+        log_queue, logging.StreamHandler())
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+
+    return listener
+
+def eager_predictor(model):
+    return lambda states: np.asarray(model.predict_on_batch(states))
+
+def compiled_predictor(model):
+    """Predict with a graph compiled function of fixed input signature."""
+
+    import tensorflow as tf
+
+    @tf.function(input_signature=[
+        tf.TensorSpec(shape=(None, INPUT_DIM), dtype=tf.float32)])
+    def predict(states):
+        return model(states, training=False)
+
+    return lambda states: predict(states).numpy()
+
+def tflite_predictor(model):
+    """Convert model to TensorFlow Lite and predict with its interpreter.
+
+    Micro-batching produces varying batch sizes. Batches are padded to the
+    next power of two and one interpreter is kept per padded size, instead
+    of resizing and reallocating a single one. Larger batches, such as a
+    single MSG_STATES request, are split into chunks of MAX_BATCH states,
+    so at most log2(MAX_BATCH) + 1 interpreters are created.
+    """
+
+    import tensorflow as tf
+
+    converter    = tf.lite.TFLiteConverter.from_keras_model(model)
+    content      = converter.convert()
+    interpreters = {}
+
+    def interpreter_for(batch_size):
+        interpreter = tf.lite.Interpreter(model_content=content)
+        index = interpreter.get_input_details()[0]['index']
+        interpreter.resize_tensor_input(index, [batch_size, INPUT_DIM])
+        interpreter.allocate_tensors()
+        return (interpreter, index,
+                interpreter.get_output_details()[0]['index'])
+
+    def predict(states):
+        if len(states) > MAX_BATCH:
+            return np.concatenate([predict(states[start:start + MAX_BATCH])
+                                   for start in range(0, len(states),
+                                                      MAX_BATCH)])
+        count      = len(states)
+        batch_size = 1 << (count - 1).bit_length()
+        if batch_size not in interpreters:
+            interpreters[batch_size] = interpreter_for(batch_size)
+        interpreter, input_index, output_index = interpreters[batch_size]
+        if batch_size != count:
+            padded = np.zeros((batch_size, INPUT_DIM), dtype=np.float32)
+            padded[:count] = states
+            states = padded
+        interpreter.set_tensor(input_index, states)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)[:count]
+
+    return predict
+
+def numpy_predictor(model):
+    """Predict with NumPy alone, see numpy_model.py."""
+
+    if not isinstance(model, numpy_model.NumpyModel):
+        model = numpy_model.NumpyModel.from_keras(model)
+    return model
+
+PREDICTORS = {'eager': eager_predictor,
+              'tf.function': compiled_predictor,
+              'tflite': tflite_predictor,
+              'numpy': numpy_predictor}
+
+def load_predictor(model_path, kind=PREDICTOR, warmup_steps=WARMUP_STEPS):
+    """Load a model and return a warmed up predictor.
+
+    TensorFlow is only imported to load .h5 models, the 'numpy' predictor
+    serves a .npz export without it.
+
+    Arguments:
+        model_path -- Path to a model saved by training.py, or to its .npz
+        export for the 'numpy' predictor.
+        kind -- One of PREDICTORS.
+
+    Returns:
+        predict -- A function mapping a float32 np.array() of states with
+        shape (batch, INPUT_DIM) to a np.array() of q-estimates.
+    """
+
+    if model_path.endswith('.npz'):
+        if kind != 'numpy':
+            raise ValueError('.npz models need the numpy predictor, not {!r}'
+                             .format(kind))
+        model = numpy_model.NumpyModel.load(model_path)
+    else:
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path, compile=False)
+    predict = PREDICTORS[kind](model)
+
+    # Trace and Allocate Before the First Request
+    dummy = np.zeros((1, INPUT_DIM), dtype=np.float32)
+    for _ in range(warmup_steps):
+        predict(dummy)
+
+    return predict
+
+def select_action(predict, state_in):
+    q_estimates = predict(np.asarray([state_in], dtype=np.float32))
+    return int(np.argmax(q_estimates[0])), q_estimates
 
 def recv_from_gh_client(socket):
     socket.listen()
     conn, _ = socket.accept()
     with conn:
-        return_byt = conn.recv(65536)
-    return_str = return_byt.decode()
-    return_lst = [float(value) for value in return_str.split()]
+        return_byt = protocol.recv_message(conn, 65536)
+    return_arr, _ = protocol.decode_state(return_byt)
+    if len(return_arr) != INPUT_DIM:
+        raise ValueError('received {} values from GH client, expected {}'
+                         .format(len(return_arr), INPUT_DIM))
 
-    return return_lst
+    return return_arr
 
 def send_to_gh_client(socket, message):
     message_byt = str(message).encode()
@@ -28,47 +187,384 @@ def send_to_gh_client(socket, message):
     with conn:
         conn.send(message_byt)
 
-def deploy():
+class ServedModel(object):
+    """A predictor with the latency and action counts of its requests."""
 
-    # Load Model
-    model_path = os.path.join(MODEL_SAVE_PATH, MODEL_NAME)
-    model      = tf.keras.models.load_model(model_path)
-    print('Model Loaded.')
+    def __init__(self, name, predict):
+        self.name     = name
+        self.predict  = predict
+        self.latency  = LatencyStats()
+        self.requests = 0
+        self.actions  = None # states answered with every action
+
+    def count(self, q_estimates, actions):
+        counts = np.bincount(actions, minlength=q_estimates.shape[1])
+        if self.actions is None:
+            self.actions = counts
+        else:
+            self.actions += counts
+
+    def __str__(self):
+        share = [] if self.actions is None else \
+            self.actions / max(self.actions.sum(), 1)
+        return '{} | {} requests | {} | actions {}'.format(
+            self.name, self.requests, self.latency,
+            ' '.join('{:.0%}'.format(p) for p in share))
+
+class InferenceServer(object):
+    """Serve actions over persistent framed connections, see protocol.py.
+
+    Clients connect once and then send requests on the same connection: a
+    MSG_STATE is answered with a MSG_ACTION, a MSG_STATES matrix holding the
+    states of several agents with a MSG_ACTIONS of one action per agent.
+
+    All clients are served from one selector loop. Requests arriving within
+    batch_window of the oldest unanswered one are coalesced into a single
+    prediction of up to max_batch states (micro-batching). The window is cut
+    short once every connected client waits for an answer, so a single
+    client is never delayed. Server time, from a complete request read to
+    its answer sent, is recorded in latency.
+
+    A candidate model can answer a random candidate_fraction of the
+    requests (A/B testing), latency and actions are counted per model.
+    swap() replaces either model between two predictions, requests already
+    read are answered by the model in place when they are predicted.
+
+    Arguments:
+        predict -- A predictor returned by load_predictor().
+        timeout -- Socket timeout for sending answers. Reads never block,
+        the bytes of every client are buffered until a message is complete,
+        so a slow client does not stall the others.
+        batch_window -- Seconds to wait for more requests, 0 only batches
+        requests that are already waiting.
+        max_batch -- Number of states after which no more requests are
+        waited for.
+        name -- Name of the primary model in the printed statistics.
+        candidate_fraction -- Share of requests answered by the candidate.
+    """
+
+    class Request(object):
+
+        def __init__(self, conn, states, batched, received):
+            self.conn     = conn
+            self.states   = states
+            self.batched  = batched # answer with MSG_ACTIONS
+            self.received = received
+
+    def __init__(self, predict, host=HOST, port=PORT, timeout=None,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                 name='primary', candidate_fraction=CANDIDATE_FRACTION):
+        self.primary      = ServedModel(name, predict)
+        self.candidate    = None # set with swap()
+        self.fraction     = candidate_fraction
+        self.timeout      = timeout
+        self.batch_window = batch_window
+        self.max_batch    = max_batch
+        self.listener     = protocol.listen(host, port)
+        self.selector     = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.latency      = LatencyStats()
+        self.clients      = 0
+        self.buffers      = {} # received bytes of incomplete messages
+        self.pending      = [] # requests waiting for an answer
+        self.pending_rows = 0
+        self.requests     = 0
+        self.predictions  = 0
+        self.rows         = 0 # states predicted in total
+        self.running      = False
+
+    def __accept(self):
+        conn = protocol.accept(self.listener, timeout=self.timeout)
+        self.selector.register(conn.conn, selectors.EVENT_READ, conn)
+        self.buffers[conn] = bytearray()
+        self.clients += 1
+        logger.info('client connected (%d connected)', self.clients)
+
+    def __drop(self, conn):
+        if conn.conn.fileno() < 0:
+            return # already dropped
+        self.selector.unregister(conn.conn)
+        conn.close()
+        del self.buffers[conn]
+        self.clients -= 1
+        logger.info('client disconnected (%d connected)', self.clients)
 
-    # Define Socket
-    HOST = '127.0.0.1'
+    def __read(self, conn):
+        try:
+            data = conn.conn.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self.__drop(conn)
+            return
+
+        buffer = self.buffers[conn]
+        buffer += data
+        while conn.conn.fileno() >= 0: # until dropped by __handle()
+            message = conn.framing.parse(buffer)
+            if message is None:
+                break
+            msg_type, payload, size = message
+            del buffer[:size]
+            self.__handle(conn, msg_type, payload)
+
+    def __handle(self, conn, msg_type, payload):
+        received = time.perf_counter()
+
+        if msg_type == protocol.MSG_STATE:
+            state, _ = protocol.decode_state(payload)
+            states, batched = state[np.newaxis], False
+        elif msg_type == protocol.MSG_STATES:
+            states, _ = protocol.decode_states(payload)
+            batched = True
+        else:
+            logger.warning('unexpected message type %d, closing connection',
+                           msg_type)
+            self.__drop(conn)
+            return
+
+        self.pending.append(self.Request(conn, states, batched, received))
+        self.pending_rows += len(states)
+
+    def __poll(self, timeout):
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                self.__accept()
+            else:
+                self.__read(key.data)
+
+    def __collect(self, timeout):
+        """Wait up to timeout for a request, then for the batch window."""
+
+        self.__poll(timeout)
+        if not self.pending:
+            return
+        self.__poll(0)
+
+        # Micro-Batching: Wait for Other Clients Until the Window Closes
+        deadline = self.pending[0].received + self.batch_window
+        while (self.pending_rows < self.max_batch and
+               len(self.pending) < self.clients):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self.__poll(remaining)
+
+    def swap(self, role, name, predict):
+        """Replace the 'primary' or 'candidate' model, thread-safe.
+
+        Statistics restart with the new model.
+        """
+
+        if role not in ('primary', 'candidate'):
+            raise ValueError('unknown model role {!r}'.format(role))
+        setattr(self, role, ServedModel(name, predict))
+        logger.info('%s model: %s', role, name)
+
+    def __answer(self):
+        """Answer all pending requests, one prediction per model."""
+
+        requests, self.pending, self.pending_rows = self.pending, [], 0
+        primary, candidate = self.primary, self.candidate
+
+        if candidate is None or self.fraction <= 0:
+            self.__answer_with(primary, requests)
+            return
+        routed = np.random.random(len(requests)) < self.fraction
+        for model, route in [(primary, False), (candidate, True)]:
+            group = [request for request, to_candidate in zip(requests, routed)
+                     if to_candidate == route]
+            if group:
+                self.__answer_with(model, group)
+
+    def __answer_with(self, model, requests):
+        if len(requests) == 1:
+            states = requests[0].states
+        else:
+            states = np.concatenate([request.states for request in requests])
+        q_estimates = model.predict(np.asarray(states, dtype=np.float32))
+        actions = np.argmax(q_estimates, axis=1)
+        model.count(q_estimates, actions)
+        model.requests += len(requests)
+        self.predictions += 1
+        self.rows += len(states)
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        start = 0
+        for request in requests:
+            stop = start + len(request.states)
+            try:
+                if request.batched:
+                    request.conn.send_actions(actions[start:stop])
+                else:
+                    request.conn.send_action(int(actions[start]))
+            except OSError:
+                self.__drop(request.conn)
+            elapsed = time.perf_counter() - request.received
+            self.latency.add(elapsed)
+            model.latency.add(elapsed)
+
+            if debug:
+                logger.debug('request %d | states = %s | q-estimates = %s '
+                             '| actions = %s', self.requests, request.states,
+                             q_estimates[start:stop], actions[start:stop])
+            start = stop
+            self.requests += 1
+            if self.requests % STATS_FREQ == 0:
+                logger.info('%d requests | %.1f states per prediction | '
+                            'server time %s', self.requests,
+                            self.rows / self.predictions, self.latency)
+                if self.candidate is not None:
+                    logger.info('  primary   %s', self.primary)
+                    logger.info('  candidate %s', self.candidate)
+
+    def serve(self, timeout=None):
+        """Answer the requests arriving within timeout (None blocks).
+
+        Returns:
+            answered -- Number of requests answered.
+        """
+
+        self.__collect(timeout)
+        answered = len(self.pending)
+        if answered:
+            self.__answer()
+
+        return answered
+
+    def serve_forever(self, poll_interval=0.1):
+        """Serve until shutdown() is called from another thread."""
+
+        self.running = True
+        while self.running:
+            self.serve(poll_interval)
+
+    def shutdown(self):
+        self.running = False
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is not self.listener:
+                self.__drop(key.data)
+        self.selector.close()
+        self.listener.close()
+
+class CheckpointWatcher(threading.Thread):
+    """Swap the newest checkpoint of a directory into a running server.
+
+    Checkpoints are written under a temporary name and renamed (see
+    checkpoint.py), so every file found is complete. A new checkpoint is
+    loaded and warmed up in this thread and only then swapped in, the
+    server keeps answering with the old model meanwhile.
+
+    Arguments:
+        server -- A running InferenceServer().
+        directory -- Checkpoint directory of training.py.
+        kind -- Predictor of the loaded models. The numbered .h5 checkpoints
+        are watched for every kind, 'numpy' converts them on load.
+        role -- Model replaced by new checkpoints, see InferenceServer.swap().
+        current -- Iteration of the model the server started with.
+    """
+
+    def __init__(self, server, directory, kind=PREDICTOR, role=WATCH_ROLE,
+                 interval=WATCH_INTERVAL, current=None):
+        super(CheckpointWatcher, self).__init__(daemon=True)
+        self.server    = server
+        self.directory = directory
+        self.kind      = kind
+        self.role      = role
+        self.interval  = interval
+        self.current   = current
+        self.stopped   = threading.Event()
+
+    def poll(self):
+        """Swap in the newest checkpoint if it changed.
+
+        Returns:
+            swapped -- Whether a new model was swapped in.
+        """
+
+        saved = checkpoint.checkpoints(self.directory)
+        if not saved or saved[-1] == self.current:
+            return False
+        name = '{}.h5'.format(saved[-1])
+        try:
+            predict = load_predictor(os.path.join(self.directory, name),
+                                     self.kind)
+        except Exception as e:
+            # Removed by checkpoint retention meanwhile, retry next poll
+            logger.warning('could not load %s (%s)', name, e)
+            return False
+        self.server.swap(self.role, name, predict)
+        self.current = saved[-1]
+
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def deploy_legacy(predict):
+    """Serve deploy.gh: a new connection for every state and action."""
 
     i = 0
     while True:
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((HOST, 8082))
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((HOST, PORT))
             s.settimeout(TIMEOUT)
 
             if i == 0:
-                print('\nStart Loop in GH Client...\n')
+                logger.info('Start Loop in GH Client...')
 
             # Read Current State from GH Client
             state_in = recv_from_gh_client(s)
 
             if i == 0:
-                print('\n  ... connected.')
+                logger.info('  ... connected.')
 
             # Select Action
-            q_estimates = model.predict_on_batch(np.array([state_in]))
-            action      = int(np.argmax(q_estimates))
-
-            # Print
-            print('\n  ITERATION: {}'.format(i))
-            print('  state       = {}'.format(state_in))
-            print('  q-estimates = {}'.format(q_estimates))
-            print('  action      = {}'.format(action))
+            action, q_estimates = select_action(predict, state_in)
 
             # Send Action to GH Client
             send_to_gh_client(s, action)
 
+            logger.debug('ITERATION: %d | state = %s | q-estimates = %s '
+                         '| action = %d', i, state_in, q_estimates, action)
+
         i += 1
 
+def deploy():
+
+    listener = setup_logging()
+
+    # Load Model
+    model_path = os.path.join(MODEL_SAVE_PATH, MODEL_NAME)
+    predict    = load_predictor(model_path, PREDICTOR)
+    logger.info('Model Loaded (%s predictor).', PREDICTOR)
+
+    try:
+        if CONNECTION_MODE == 'persistent':
+            server = InferenceServer(predict, name=MODEL_NAME)
+            if CANDIDATE_NAME is not None:
+                server.swap('candidate', CANDIDATE_NAME, load_predictor(
+                    os.path.join(MODEL_SAVE_PATH, CANDIDATE_NAME), PREDICTOR))
+            if WATCH_CHECKPOINTS:
+                current = os.path.splitext(MODEL_NAME)[0]
+                CheckpointWatcher(server, MODEL_SAVE_PATH, PREDICTOR, current=
+                                  int(current) if current.isdigit() else None
+                                  ).start()
+            server.serve_forever()
+        else:
+            deploy_legacy(predict)
+    finally:
+        listener.stop()
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,194 @@
+"""Local stand-in for the Grasshopper clients of training.gh and deploy.gh.
+
+The stub clients speak the same socket protocols as the GH_CPython
+components, so the servers can be driven (and benchmarked) without Rhino.
+"""
+
+import random
+import socket
+import time
+
+import protocol
+
+
+def random_state(input_dim):
+    """Return a random state vector as a list of floats."""
+
+    return [random.random() for _ in range(input_dim)]
+
+
+class ToyEnvironment(object):
+    """A walk on a line of input_dim cells standing in for a GH definition.
+
+    The state is the one-hot position of the agent. Actions move it left (0),
+    keep it (1) or move it right (2). Reaching the goal cell gives a reward
+    of 1 and ends the episode, every other step costs 0.05.
+    """
+
+    def __init__(self, input_dim=16, goal=None, max_steps=100):
+        self.input_dim = input_dim
+        self.goal      = input_dim - 1 if goal is None else goal
+        self.max_steps = max_steps
+        self.reset()
+
+    def state(self):
+        state = [0.0] * self.input_dim
+        state[self.position] = 1.0
+        return state
+
+    def reset(self):
+        self.position = random.randrange(self.input_dim)
+        self.steps    = 0
+        return self.state()
+
+    def step(self, action):
+        """Apply an action.
+
+        Returns:
+            state, reward, done -- The next state, the reward for the action
+            and whether the episode has ended.
+        """
+
+        move = int(action) - 1
+        self.position = min(max(self.position + move, 0), self.input_dim - 1)
+        self.steps += 1
+        if self.position == self.goal:
+            return self.state(), 1.0, True
+
+        return self.state(), -0.05, self.steps >= self.max_steps
+
+
+def run_toy_client(host, port, steps, input_dim=16, dtype=None):
+    """Drive a server with a ToyEnvironment over a persistent connection.
+
+    Episodes restart in place, the connection stays open for all steps.
+
+    Returns:
+        episodes -- Number of finished episodes.
+    """
+
+    env = ToyEnvironment(input_dim)
+    client = PersistentStubClient(host, port, dtype=dtype)
+    state, episodes = env.reset(), 0
+    for _ in range(steps):
+        client.conn.send_state(state, dtype, client.steps)
+        client.steps += 1
+        state, reward, done = env.step(client.conn.recv_action())
+        client.conn.send_reward(reward, done)
+        if done:
+            state = env.reset()
+            episodes += 1
+    client.close()
+
+    return episodes
+
+
+def run_load_generator(host, port, requests, input_dim=16, dtype=None,
+                       agents=None):
+    """Send states to a deploy server one after another over one connection.
+
+    Arguments:
+        agents -- If given, every request carries the states of this many
+        agents (MSG_STATES) instead of a single state.
+
+    Returns:
+        latencies -- The round trip time of every request in seconds.
+    """
+
+    client = PersistentStubClient(host, port, dtype=dtype)
+    if agents is None:
+        state = random_state(input_dim)
+        step  = lambda: client.step(state, None)
+    else:
+        states = [random_state(input_dim) for _ in range(agents)]
+        step   = lambda: client.step_batch(states)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - start)
+    client.close()
+
+    return latencies
+
+
+def connect_retry(host, port, timeout=10.0):
+    """Connect, retrying while the server has not bound the port yet."""
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection((host, port), timeout)
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.0001)
+
+
+class LegacyStubClient(object):
+    """Mimics the GH components of training.gh: one connection per message."""
+
+    def __init__(self, host='127.0.0.1', state_port=8080, reward_port=8081,
+                 dtype=None):
+        self.host        = host
+        self.state_port  = state_port
+        self.reward_port = reward_port
+        self.dtype       = dtype # None sends text, else binary states
+
+    def send_state(self, state):
+        if self.dtype is None:
+            data = ' '.join(str(value) for value in state).encode()
+        else:
+            data = protocol.encode_state(state, self.dtype)
+        with connect_retry(self.host, self.state_port) as s:
+            s.sendall(data)
+
+    def recv_action(self):
+        with connect_retry(self.host, self.state_port) as s:
+            return int(s.recv(1024).decode())
+
+    def send_reward(self, reward):
+        with connect_retry(self.host, self.reward_port) as s:
+            s.send(str(reward).encode())
+
+    def step(self, state, reward):
+        self.send_state(state)
+        action = self.recv_action()
+        if reward is not None:
+            self.send_reward(reward)
+
+        return action
+
+    def close(self):
+        pass
+
+
+class PersistentStubClient(object):
+    """One framed connection per episode, see protocol.py."""
+
+    def __init__(self, host='127.0.0.1', port=8080, framing=None, dtype=None):
+        conn = connect_retry(host, port)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn  = protocol.FramedConnection(conn, framing)
+        self.dtype = dtype
+        self.steps = 0
+
+    def step(self, state, reward):
+        self.conn.send_state(state, self.dtype, self.steps)
+        self.steps += 1
+        action = self.conn.recv_action()
+        if reward is not None:
+            self.conn.send_reward(reward)
+
+        return action
+
+    def step_batch(self, states):
+        """Request the actions of several agents sharing this connection."""
+
+        self.conn.send_states(states, self.dtype, self.steps)
+        self.steps += 1
+
+        return self.conn.recv_actions()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,24 @@
+"""Lightweight metrics printed by the training and deployment servers."""
+
+import collections
+
+import numpy as np
+
+
+class LatencyStats(object):
+    """Rolling window of latencies for the printed metrics."""
+
+    def __init__(self, window=1000):
+        self.samples = collections.deque(maxlen=window)
+        self.count   = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, q):
+        return np.percentile(self.samples, q) if self.samples else 0.0
+
+    def __str__(self):
+        return 'p50={:.3f} ms p99={:.3f} ms'.format(
+            1e3 * self.percentile(50), 1e3 * self.percentile(99))
@@ -0,0 +1,156 @@
+"""TensorFlow-free inference for the dense networks built by training.py.
+
+A trained model is exported once to a .npz file holding the kernel, bias
+and activation of every Dense layer. NumpyModel loads that file and runs
+the forward pass with NumPy alone, so deploy.py can serve a model without
+importing TensorFlow.
+
+Kernels can be stored quantized to shrink the file:
+
+    float32 -- Exact weights.
+    float16 -- Half precision, relative error around 1e-3.
+    int8    -- Symmetric per-output-unit scales, kernel = int8 * scale.
+
+NumPy has no fast float16 or int8 matrix products, so quantized kernels are
+dequantized to float32 when loaded and the forward pass always runs on the
+float32 BLAS path.
+
+Usage (exporting needs TensorFlow, loading does not):
+    python numpy_model.py 10000.h5 [10000.npz] [--dtype int8]
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from checkpoint import replace_atomic
+
+ACTIVATIONS = ('linear', 'relu')
+DTYPES      = ('float32', 'float16', 'int8')
+
+
+def quantize(kernel, dtype):
+    """Quantize a kernel for export.
+
+    Returns:
+        kernel, scale -- The stored kernel and the float32 scale of every
+        output unit (ones unless dtype is int8).
+    """
+
+    kernel = np.asarray(kernel, dtype=np.float32)
+    scale  = np.ones(kernel.shape[1], dtype=np.float32)
+    if dtype == 'int8':
+        scale  = np.abs(kernel).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        kernel = np.round(kernel / scale).astype(np.int8)
+    else:
+        kernel = kernel.astype(dtype)
+
+    return kernel, scale.astype(np.float32)
+
+
+def dense_layers(model):
+    """Yield kernel, bias and activation of the Dense layers of a model."""
+
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue # input layer
+        activation = layer.get_config().get('activation')
+        if len(weights) != 2 or activation not in ACTIVATIONS:
+            raise ValueError('cannot export layer {} ({}, activation {})'.format(
+                layer.name, type(layer).__name__, activation))
+        yield weights[0], weights[1], activation
+
+
+def export_model(model, path, dtype='float32'):
+    """Write the Dense layers of a tf.keras.model() to a .npz file.
+
+    Arguments:
+        model -- A model of Dense layers with 'relu' or 'linear' activations.
+        path -- Target path, written atomically.
+        dtype -- Storage dtype of the kernels, one of DTYPES.
+    """
+
+    if dtype not in DTYPES:
+        raise ValueError('dtype must be one of {}, not {!r}'.format(DTYPES, dtype))
+
+    arrays, activations = {}, []
+    for i, (kernel, bias, activation) in enumerate(dense_layers(model)):
+        arrays['kernel_{}'.format(i)], arrays['scale_{}'.format(i)] = \
+            quantize(kernel, dtype)
+        arrays['bias_{}'.format(i)] = bias.astype(np.float32)
+        activations.append(activation)
+    arrays['activations'] = np.array(activations)
+
+    # np.savez() appends .npz to file names without it, so the temporary
+    # file is written through a file object to keep its exact name
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+    replace_atomic(write, path)
+
+
+class NumpyModel(object):
+    """Forward pass of an exported dense network.
+
+    Calling the model maps states of shape (batch, input_dim) to q-estimates
+    of shape (batch, output_dim), like model.predict_on_batch().
+
+    Arguments:
+        kernels, biases -- float32 np.array() objects of every layer.
+        activations -- 'relu' or 'linear' for every layer.
+    """
+
+    def __init__(self, kernels, biases, activations):
+        self.layers = [(np.ascontiguousarray(kernel, dtype=np.float32),
+                        np.asarray(bias, dtype=np.float32),
+                        activation == 'relu')
+                       for kernel, bias, activation
+                       in zip(kernels, biases, activations)]
+        self.input_dim  = self.layers[0][0].shape[0]
+        self.output_dim = self.layers[-1][0].shape[1]
+
+    @classmethod
+    def from_keras(cls, model):
+        return cls(*zip(*dense_layers(model)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            activations = [str(a) for a in data['activations']]
+            kernels = [data['kernel_{}'.format(i)].astype(np.float32) *
+                       data['scale_{}'.format(i)]
+                       for i in range(len(activations))]
+            biases  = [data['bias_{}'.format(i)]
+                       for i in range(len(activations))]
+
+        return cls(kernels, biases, activations)
+
+    def __call__(self, states):
+        x = np.asarray(states, dtype=np.float32)
+        for kernel, bias, relu in self.layers:
+            x = np.dot(x, kernel)
+            x += bias
+            if relu:
+                np.maximum(x, 0, out=x)
+
+        return x
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export a trained model for '
+                                     'TensorFlow-free deployment.')
+    parser.add_argument('model', help='model saved by training.py (.h5)')
+    parser.add_argument('output', nargs='?', help='defaults to model with .npz')
+    parser.add_argument('--dtype', choices=DTYPES, default='float32')
+    args = parser.parse_args()
+
+    import tensorflow as tf
+
+    output = args.output or os.path.splitext(args.model)[0] + '.npz'
+    export_model(tf.keras.models.load_model(args.model, compile=False), output,
+                 args.dtype)
+    print('Exported {} ({} kernels) to {}.'.format(args.model, args.dtype, output))
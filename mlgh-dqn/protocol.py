@@ -0,0 +1,370 @@
+"""Socket protocol between the Grasshopper clients and the DQN servers.
+
+The original GH components open a new connection for every message. This
+module implements a persistent alternative: the client connects once per
+episode and states, actions and rewards are exchanged as length-prefixed
+frames over that single connection.
+
+Every frame is a fixed size header followed by the payload:
+
+    | message type (uint8) | payload length (uint32, big-endian) | payload |
+
+States can be sent either as whitespace separated text (what the GH files
+in this repo send) or in a binary format, see encode_state(). The format
+is detected from the data itself, so both server modes accept both.
+"""
+
+import array
+import socket
+import struct
+import sys
+
+import numpy as np
+
+### Message Types
+MSG_STATE   = 1
+MSG_ACTION  = 2
+MSG_REWARD  = 3
+MSG_STATES  = 4 # states of several agents, answered with MSG_ACTIONS
+MSG_ACTIONS = 5
+
+
+### Binary State Format
+STATE_MAGIC  = b'\x93GHS'
+STATE_HEADER = struct.Struct('<cIQ') # dtype code, value count, step id
+STATE_DTYPES = {b'f': np.dtype('<f4'), b'd': np.dtype('<f8')}
+BATCH_MAGIC  = b'\x93GHM'
+BATCH_HEADER = struct.Struct('<cIIQ') # dtype code, rows, columns, step id
+ACTION_DTYPE = np.dtype('<i4')
+
+
+class ConnectionClosed(Exception):
+    """Raised when the peer closes the connection in the middle of a read."""
+
+
+def recv_exact(conn, size):
+    """Read exactly size bytes from a connected socket.
+
+    Arguments:
+        conn -- A connected socket.socket() object (or any object with a
+        compatible recv_into() method).
+        size -- Number of bytes to read.
+
+    Returns:
+        data -- A bytearray of length size.
+    """
+
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionClosed(
+                'connection closed after {} of {} bytes'.format(received, size))
+        received += count
+
+    return data
+
+
+def recv_message(conn, bufsize=65536):
+    """Read one unframed message, as sent by the original GH components.
+
+    Text is what a single recv() returns, like the GH clients expect, which
+    keep their socket open after sending. A binary state declares its size,
+    the rest of it is read if the first recv() returned less.
+    """
+
+    data = conn.recv(bufsize)
+    header = len(STATE_MAGIC) + STATE_HEADER.size
+    if data[:len(STATE_MAGIC)] == STATE_MAGIC and len(data) >= header:
+        code, count, _ = STATE_HEADER.unpack_from(data, len(STATE_MAGIC))
+        dtype = STATE_DTYPES.get(code)
+        if dtype is not None and len(data) < header + count * dtype.itemsize:
+            data += recv_exact(conn, header + count * dtype.itemsize - len(data))
+
+    return bytes(data)
+
+
+def encode_state(state, dtype='float32', step=0):
+    """Encode a state in the binary format.
+
+    The payload is the header followed by the raw little-endian values:
+
+        | magic | dtype ('f' or 'd') | value count (uint32) | step (uint64) |
+
+    Arguments:
+        state -- A sequence of floats or a np.array().
+        dtype -- 'float32' or 'float64'.
+        step -- Step id sent along with the state.
+
+    Returns:
+        data -- The encoded state as bytes.
+    """
+
+    code = b'f' if np.dtype(dtype) == np.float32 else b'd'
+    if isinstance(state, np.ndarray):
+        values = np.ascontiguousarray(state, STATE_DTYPES[code]).tobytes()
+    else:
+        # array.array keeps GH_CPython clients free of a numpy dependency
+        values = array.array(code.decode(), state)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        values = values.tobytes()
+    count = len(values) // STATE_DTYPES[code].itemsize
+
+    return STATE_MAGIC + STATE_HEADER.pack(code, count, step) + values
+
+
+def decode_state(data):
+    """Decode a binary or text state.
+
+    Binary states are read with np.frombuffer() without copying or parsing
+    individual values. Anything without the binary magic is parsed as
+    whitespace separated text.
+
+    Returns:
+        state, step -- A np.array() of floats and the step id (None for
+        text states).
+    """
+
+    if bytes(data[:len(STATE_MAGIC)]) == STATE_MAGIC:
+        offset = len(STATE_MAGIC)
+        code, count, step = STATE_HEADER.unpack_from(data, offset)
+        offset += STATE_HEADER.size
+        dtype = STATE_DTYPES.get(code)
+        if dtype is None:
+            raise ValueError('unknown state dtype: {!r}'.format(code))
+        if len(data) - offset != count * dtype.itemsize:
+            raise ValueError('state declares {} values, received {} bytes'
+                             .format(count, len(data) - offset))
+        return np.frombuffer(data, dtype, count, offset), step
+
+    return np.array(bytes(data).decode().split(), dtype=np.float64), None
+
+
+def encode_states(states, dtype='float32', step=0):
+    """Encode the states of several agents in the binary batch format.
+
+        | magic | dtype ('f' or 'd') | rows (uint32) | columns (uint32) |
+        | step (uint64) | rows * columns little-endian values |
+
+    Arguments:
+        states -- A 2d np.array() or a list of equally long state lists.
+    """
+
+    code   = b'f' if np.dtype(dtype) == np.float32 else b'd'
+    states = np.ascontiguousarray(states, STATE_DTYPES[code])
+    rows, columns = states.shape
+
+    return BATCH_MAGIC + BATCH_HEADER.pack(code, rows, columns, step) + \
+        states.tobytes()
+
+
+def decode_states(data):
+    """Decode a batch of states, binary or text with one state per line.
+
+    Returns:
+        states, step -- A 2d np.array() and the step id (None for text).
+    """
+
+    if bytes(data[:len(BATCH_MAGIC)]) == BATCH_MAGIC:
+        offset = len(BATCH_MAGIC)
+        code, rows, columns, step = BATCH_HEADER.unpack_from(data, offset)
+        offset += BATCH_HEADER.size
+        dtype = STATE_DTYPES.get(code)
+        if dtype is None:
+            raise ValueError('unknown state dtype: {!r}'.format(code))
+        if len(data) - offset != rows * columns * dtype.itemsize:
+            raise ValueError('batch declares {}x{} values, received {} bytes'
+                             .format(rows, columns, len(data) - offset))
+        states = np.frombuffer(data, dtype, rows * columns, offset)
+        return states.reshape(rows, columns), step
+
+    lines = bytes(data).decode().splitlines()
+    return np.array([line.split() for line in lines if line.strip()],
+                    dtype=np.float64), None
+
+
+def decode_reward(payload):
+    """Parse a reward payload.
+
+    Returns:
+        reward, done -- The reward as float and the episode done flag.
+    """
+
+    values = bytes(payload).decode().split()
+
+    return float(values[0]), len(values) > 1 and values[1] == '1'
+
+
+class LengthPrefixedFraming(object):
+    """Frames messages with a type byte and a big-endian uint32 length."""
+
+    header = struct.Struct('!BI')
+
+    def encode(self, msg_type, payload):
+        """Return the bytes to send for one message."""
+
+        return self.header.pack(msg_type, len(payload)) + bytes(payload)
+
+    def read(self, conn):
+        """Block until one complete message is read from conn.
+
+        Returns:
+            msg_type, payload -- The message type and its payload bytes.
+        """
+
+        msg_type, length = self.header.unpack(recv_exact(conn, self.header.size))
+        payload = recv_exact(conn, length) if length else bytearray()
+
+        return msg_type, payload
+
+    def parse(self, buffer):
+        """Parse one message from the start of buffer without blocking.
+
+        Returns:
+            message -- (msg_type, payload, size), size being the bytes the
+            message takes in buffer, or None if it is not complete yet.
+        """
+
+        if len(buffer) < self.header.size:
+            return None
+        msg_type, length = self.header.unpack_from(buffer)
+        size = self.header.size + length
+        if len(buffer) < size:
+            return None
+
+        return msg_type, bytes(buffer[self.header.size:size]), size
+
+
+class FramedConnection(object):
+    """A long-lived connection exchanging framed messages.
+
+    Arguments:
+        conn -- A connected socket.socket() object. Anything with sendall()
+        and recv_into(), e.g. one end of socket.socketpair(), works as well.
+        framing -- Object implementing encode(), read() and parse(), defaults
+        to LengthPrefixedFraming().
+    """
+
+    def __init__(self, conn, framing=None):
+        self.conn    = conn
+        self.framing = framing if framing is not None else LengthPrefixedFraming()
+        self.step    = None  # step id of the last binary state received
+        self.done    = False # done flag of the last reward received
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, msg_type, payload):
+        self.conn.sendall(self.framing.encode(msg_type, payload))
+
+    def recv(self, expected_type=None):
+        """Receive one message, optionally checking its type."""
+
+        msg_type, payload = self.framing.read(self.conn)
+        if expected_type is not None and msg_type != expected_type:
+            raise ValueError('expected message type {}, received {}'.format(
+                expected_type, msg_type))
+
+        return msg_type, payload
+
+    def send_state(self, state, dtype=None, step=0):
+        """Send a state, as text unless dtype ('float32'/'float64') is set."""
+
+        if dtype is None:
+            payload = ' '.join(str(float(value)) for value in state).encode()
+        else:
+            payload = encode_state(state, dtype, step)
+        self.send(MSG_STATE, payload)
+
+    def recv_state(self):
+        _, payload = self.recv(MSG_STATE)
+        state, self.step = decode_state(payload)
+        return state
+
+    def send_action(self, action):
+        self.send(MSG_ACTION, str(int(action)).encode())
+
+    def recv_action(self):
+        _, payload = self.recv(MSG_ACTION)
+        return int(payload.decode())
+
+    def send_states(self, states, dtype=None, step=0):
+        """Send the states of several agents, see encode_states()."""
+
+        if dtype is None:
+            payload = '\n'.join(' '.join(str(float(value)) for value in state)
+                                for state in states).encode()
+        else:
+            payload = encode_states(states, dtype, step)
+        self.send(MSG_STATES, payload)
+
+    def recv_states(self):
+        _, payload = self.recv(MSG_STATES)
+        states, self.step = decode_states(payload)
+        return states
+
+    def send_actions(self, actions):
+        self.send(MSG_ACTIONS, np.asarray(actions, ACTION_DTYPE).tobytes())
+
+    def recv_actions(self):
+        _, payload = self.recv(MSG_ACTIONS)
+        return np.frombuffer(payload, ACTION_DTYPE)
+
+    def send_reward(self, reward, done=False):
+        """Send a reward, done marks the last step of an episode."""
+
+        payload = str(float(reward)) + (' 1' if done else '')
+        self.send(MSG_REWARD, payload.encode())
+
+    def recv_reward(self):
+        _, payload = self.recv(MSG_REWARD)
+        reward, self.done = decode_reward(payload)
+        return reward
+
+    def close(self):
+        self.conn.close()
+
+
+def listen(host, port, timeout=None):
+    """Bind and listen once; accept() can then be called for every episode.
+
+    Returns:
+        listener -- A listening socket.socket() object.
+    """
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.settimeout(timeout)
+    listener.listen()
+
+    return listener
+
+
+def accept(listener, framing=None, timeout=None):
+    """Accept the next client on a listening socket as a FramedConnection."""
+
+    conn, _ = listener.accept()
+    conn.settimeout(timeout)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return FramedConnection(conn, framing)
+
+
+def connect(host, port, framing=None, timeout=None):
+    """Client side: open one connection for a whole episode.
+
+    This is what a GH_CPython component (or a local stand-in client) uses in
+    place of connecting for every message.
+    """
+
+    conn = socket.create_connection((host, port), timeout)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return FramedConnection(conn, framing)
@@ -0,0 +1,233 @@
+"""Replay memory for Deep Q-Learning backed by preallocated NumPy arrays."""
+
+import numpy as np
+
+
+class ReplayMemory(object):
+    """Circular buffer of (state, action, reward, next_state, done) transitions.
+
+    Transitions are written in place at the current index, so adding one is
+    O(1) once the memory is full, and batches are gathered from the arrays
+    with fancy indexing without creating a Python object per transition.
+    Every transition gets a unique id in ids, so caches indexed like the
+    memory can tell when a slot has been overwritten.
+
+    Arguments:
+        capacity -- Maximum number of transitions, older ones are overwritten.
+        input_dim -- Length of a state vector.
+        dtype -- dtype used to store states and rewards.
+    """
+
+    def __init__(self, capacity, input_dim, dtype=np.float32):
+        self.capacity    = int(capacity)
+        self.states      = np.zeros((self.capacity, input_dim), dtype=dtype)
+        self.actions     = np.zeros(self.capacity, dtype=np.int32)
+        self.rewards     = np.zeros(self.capacity, dtype=dtype)
+        self.next_states = np.zeros((self.capacity, input_dim), dtype=dtype)
+        self.dones       = np.zeros(self.capacity, dtype=bool)
+        self.ids         = np.full(self.capacity, -1, dtype=np.int64)
+        self.index       = 0 # position of the next write
+        self.size        = 0
+        self.count       = 0 # transitions ever added, source of the ids
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state, done=False):
+        """Store a transition, overwriting the oldest one when full.
+
+        Returns:
+            index -- The position the transition was written to.
+        """
+
+        index = self.index
+        self.states[index]      = state
+        self.actions[index]     = action
+        self.rewards[index]     = reward
+        self.next_states[index] = next_state
+        self.dones[index]       = done
+        self.ids[index]         = self.count
+        self.count += 1
+        self.index = (index + 1) % self.capacity
+        self.size  = min(self.size + 1, self.capacity)
+
+        return index
+
+    def state_dict(self):
+        """Copy the stored transitions into a dict of arrays for np.savez()."""
+
+        state = dict(index=self.index, size=self.size, count=self.count)
+        for name in ['states', 'actions', 'rewards', 'next_states', 'dones',
+                     'ids']:
+            state['memory_' + name] = getattr(self, name)[:self.size].copy()
+
+        return state
+
+    def load_state_dict(self, state):
+        """Restore transitions saved with state_dict()."""
+
+        self.size  = min(int(state['size']), self.capacity)
+        self.index = int(state['index']) % self.capacity
+        self.count = int(state['count'])
+        for name in ['states', 'actions', 'rewards', 'next_states', 'dones',
+                     'ids']:
+            getattr(self, name)[:self.size] = state['memory_' + name][:self.size]
+
+    def sample_indices(self, batch_size):
+        """Draw batch_size uniform random indices of stored transitions."""
+
+        return np.random.randint(0, self.size, size=batch_size)
+
+    def sample(self, batch_size):
+        """Sample a batch of transitions uniformly, with replacement.
+
+        Returns:
+            states, actions, rewards, next_states, dones -- Contiguous
+            np.array() objects with batch_size rows each.
+        """
+
+        return self.batch(self.sample_indices(batch_size))
+
+    def batch(self, indices):
+        """Gather the transitions at indices, see sample()."""
+
+        return (self.states[indices], self.actions[indices],
+                self.rewards[indices], self.next_states[indices],
+                self.dones[indices])
+
+
+class SumTree(object):
+    """Binary tree of priorities where every node holds the sum of its children.
+
+    The tree is stored in one array: node i has the children 2i and 2i+1,
+    the root is node 1 and leaf j is node size + j. Updates and prefix-sum
+    searches handle whole batches with one array operation per tree level,
+    so both cost O(batch * log n).
+
+    Arguments:
+        capacity -- Number of leaves, rounded up to a power of two.
+    """
+
+    def __init__(self, capacity):
+        self.depth = max(1, int(np.ceil(np.log2(capacity))))
+        self.size  = 1 << self.depth
+        self.tree  = np.zeros(2 * self.size, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        """Set the priorities of the leaves at indices."""
+
+        nodes = np.asarray(indices, dtype=np.int64) + self.size
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            # Parents of sorted nodes stay sorted, drop neighbouring duplicates
+            nodes = nodes // 2
+            nodes = nodes[np.concatenate(([True], nodes[1:] != nodes[:-1]))]
+
+    def find(self, values):
+        """Return the leaves where the cumulative priority reaches values."""
+
+        values = np.array(values, dtype=np.float64)
+        nodes  = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left     = 2 * nodes
+            go_right = values > self.tree[left]
+            values  -= self.tree[left] * go_right
+            nodes    = left + go_right
+
+        return nodes - self.size
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """Replay memory sampling transitions proportional to their TD error.
+
+    Transition i is sampled with probability p_i^alpha / sum_k p_k^alpha,
+    with p_i = |TD error| + eps. New transitions get the highest priority
+    seen so far, so each is replayed at least about once. The bias is
+    corrected by importance-sampling weights (N * P(i))^-beta, normalised
+    by their batch maximum, with beta annealed towards 1.
+
+    Arguments:
+        alpha -- How strongly priorities skew sampling, 0 is uniform.
+        beta -- Initial importance-sampling exponent.
+        beta_increment -- Added to beta at every weights() call, i.e. once
+        per training batch.
+        eps -- Added to |TD error| so no transition has zero probability.
+    """
+
+    def __init__(self, capacity, input_dim, dtype=np.float32, alpha=0.6,
+                 beta=0.4, beta_increment=0.0001, eps=0.01):
+        super(PrioritizedReplayMemory, self).__init__(capacity, input_dim, dtype)
+        self.tree           = SumTree(self.capacity)
+        self.alpha          = alpha
+        self.beta           = beta
+        self.beta_increment = beta_increment
+        self.eps            = eps
+        self.max_priority   = 1.0
+
+    def append(self, state, action, reward, next_state, done=False):
+        index = super(PrioritizedReplayMemory, self).append(
+            state, action, reward, next_state, done)
+        self.tree.update([index], self.max_priority)
+
+        return index
+
+    def state_dict(self):
+        state = super(PrioritizedReplayMemory, self).state_dict()
+        state['memory_priorities'] = \
+            self.tree.tree[self.tree.size:self.tree.size + self.size].copy()
+        state['memory_max_priority'] = self.max_priority
+        state['memory_beta'] = self.beta
+
+        return state
+
+    def load_state_dict(self, state):
+        super(PrioritizedReplayMemory, self).load_state_dict(state)
+        if 'memory_priorities' in state:
+            self.tree.update(np.arange(self.size),
+                             state['memory_priorities'][:self.size])
+            self.max_priority = float(state['memory_max_priority'])
+            self.beta = float(state['memory_beta'])
+        else:
+            # Resuming from a uniform memory, start at equal priorities
+            self.tree.update(np.arange(self.size), self.max_priority)
+
+    def sample_indices(self, batch_size):
+        """Stratified sampling: one index from each of batch_size equal
+        segments of the total priority. Draws that float rounding carries
+        onto a leaf without priority are drawn again in their segment."""
+
+        total   = self.tree.total()
+        segment = total / batch_size
+        indices = np.empty(batch_size, dtype=np.int64)
+        strata  = np.arange(batch_size)
+        while len(strata):
+            values = (strata + np.random.random(len(strata))) * segment
+            # Values Rounded Up to the Total are Searched Just Below It
+            found  = self.tree.find(np.minimum(values, total * (1 - 1e-12)))
+            indices[strata] = found
+            # Redraw Where Rounding Still Reached a Leaf Without Priority
+            strata = strata[(found >= self.size) |
+                            (self.tree.tree[found + self.tree.size] <= 0)]
+
+        return indices
+
+    def weights(self, indices):
+        """Importance-sampling weights of the sampled indices."""
+
+        probabilities = self.tree.tree[indices + self.tree.size] / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        return (weights / weights.max()).astype(np.float32)
+
+    def update_priorities(self, indices, td_errors):
+        """Set the priorities of sampled transitions from their TD errors."""
+
+        priorities = (np.abs(td_errors) + self.eps) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
@@ -2,8 +2,16 @@ import tensorflow as tf
 import numpy as np
 import random
 import socket
+import selectors
+import threading
+import time
 import os
 
+import checkpoint
+import protocol
+import replay
+from metrics import LatencyStats
+
 ### Parameters from GH
 INPUT_DIM  = 16
 OUTPUT_DIM = 3
@@ -16,14 +24,49 @@ INITIAL_EPSILON = 0.8
 FINAL_EPSILON   = 0.05
 MAX_MEMORY      = 10000
 BATCH_SIZE      = 64
-memory          = []
+memory          = None # replay memory, created by the servers
 epsilon         = INITIAL_EPSILON
+TF_FUNCTION     = True  # graph compiled train step and action selection
+JIT_COMPILE     = False # additionally compile them with XLA
+
+### Prioritized Replay
+PRIORITIZED_REPLAY = False # sample transitions by TD error with a sum-tree
+PER_ALPHA          = 0.6   # priority exponent, 0 is uniform sampling
+PER_BETA           = 0.4   # initial importance-sampling exponent, annealed to 1
+
+### Target Network
+TARGET_NETWORK   = False # compute targets with a periodically synced copy
+TARGET_SYNC_FREQ = 100   # training steps between hard syncs
+TARGET_TAU       = 0.0   # > 0 uses Polyak soft updates at this rate instead
+
+### Asynchronous Learner
+ASYNC_LEARNER   = False # train in a background thread, see Learner
+PUBLISH_FREQ    = 50    # learner updates between weight publishes to the actor
 
 ### Training
 ITERATIONS      = 2000
 TIMEOUT         = 10
 MODEL_SAVE_FREQ = 50
 MODEL_SAVE_PATH = 'D:\\DRL\\models' # CHANGE THIS TO WHERE MODELS WERE SAVED
+KEEP_CHECKPOINTS = 5     # most recent model checkpoints kept, besides best.h5
+STATE_SAVE_FREQ  = 500   # iterations between replay memory/epsilon checkpoints
+RESUME           = False # continue from state.npz in MODEL_SAVE_PATH
+
+### Connection
+HOST            = '127.0.0.1'
+STATE_PORT      = 8080
+REWARD_PORT     = 8081
+CONNECTION_MODE = 'legacy' # 'legacy' (GH files in this repo) or 'persistent'
+NUM_ENVS        = 1        # > 1 serves several persistent GH clients at once
+
+def replay_memory():
+    """Create an empty replay memory as configured above."""
+
+    if PRIORITIZED_REPLAY:
+        return replay.PrioritizedReplayMemory(
+            MAX_MEMORY, INPUT_DIM, alpha=PER_ALPHA, beta=PER_BETA)
+    else:
+        return replay.ReplayMemory(MAX_MEMORY, INPUT_DIM)
 
 def build_model():
     """Build and compile neural network model.
@@ -45,6 +88,287 @@ def build_model():
 
     return model
 
+def q_targets(q_values, next_q_values, actions, rewards, dones=None):
+    """Compute the Q-learning targets of a batch with array operations.
+
+    The target of the taken action is ALPHA * (reward + GAMMA * max Q(s')),
+    with max Q(s') masked to zero for terminal transitions. The targets of
+    all other actions are the current estimates, so they produce no loss.
+
+    Arguments:
+        q_values -- A np.array() of shape (batch, OUTPUT_DIM), Q(s).
+        next_q_values -- A np.array() of shape (batch, OUTPUT_DIM), Q(s').
+        actions -- Integer np.array() of the actions taken.
+        rewards -- np.array() of the rewards received.
+        dones -- Optional boolean np.array() marking terminal transitions.
+
+    Returns:
+        targets -- A np.array() of shape (batch, OUTPUT_DIM).
+    """
+
+    max_next_q = np.amax(next_q_values, axis=1)
+    if dones is not None:
+        max_next_q = np.where(dones, 0.0, max_next_q)
+
+    targets = np.array(q_values, copy=True)
+    targets[np.arange(len(actions)), actions] = \
+        ALPHA * (rewards + GAMMA * max_next_q)
+
+    return targets
+
+def train_step(model, states, actions, rewards, next_states, dones=None,
+               next_q_values=None, weights=None):
+    """Run one Deep Q-Learning update on a batch of transitions.
+
+    States and next states go through the model in a single forward pass.
+    If next_q_values are given (by a TargetNetwork), only the states are.
+    weights are per-transition loss weights, e.g. importance-sampling
+    weights of prioritized replay.
+
+    Returns:
+        loss, td_errors -- The training loss reported by train_on_batch()
+        and the TD error of every transition.
+    """
+
+    if next_q_values is None:
+        batch_size = len(states)
+        q_values   = np.asarray(model.predict_on_batch(
+            np.concatenate([states, next_states])))
+        q_values, next_q_values = q_values[:batch_size], q_values[batch_size:]
+    else:
+        q_values = np.asarray(model.predict_on_batch(states))
+    targets   = q_targets(q_values, next_q_values, actions, rewards, dones)
+    rows      = np.arange(len(actions))
+    td_errors = targets[rows, actions] - q_values[rows, actions]
+    loss      = model.train_on_batch(states, targets, sample_weight=weights)
+
+    return loss, td_errors
+
+def state_signature(target=False):
+    """TensorSpecs of a batch of transitions, fixed to avoid retracing.
+
+    With target set, next states are replaced by their Q-values.
+    """
+
+    next_dim = OUTPUT_DIM if target else INPUT_DIM
+
+    return [
+        tf.TensorSpec(shape=(None, INPUT_DIM), dtype=tf.float32), # states
+        tf.TensorSpec(shape=(None,), dtype=tf.int32),             # actions
+        tf.TensorSpec(shape=(None,), dtype=tf.float32),           # rewards
+        tf.TensorSpec(shape=(None, next_dim), dtype=tf.float32),  # next_states
+        tf.TensorSpec(shape=(None,), dtype=tf.bool),              # dones
+        tf.TensorSpec(shape=(None,), dtype=tf.float32),           # weights
+    ]
+
+def compile_train_step(model, jit_compile=False, target=False):
+    """Build a graph compiled equivalent of train_step() for model.
+
+    Q-targets, loss and the gradient update run in one traced call. The
+    loss is the mean squared error over all outputs, as compiled in
+    build_model(), so both paths train identically.
+
+    Arguments:
+        model -- A compiled tf.keras.model() object.
+        jit_compile -- Compile the graph with XLA.
+        target -- Take next-state Q-values from a TargetNetwork in place of
+        the next states.
+
+    Returns:
+        step -- A tf.function taking (states, actions, rewards, next_states,
+        dones, weights), with next_q_values in place of next_states if
+        target is set, and returning (loss, td_errors). weights scale the
+        loss per transition, pass ones for uniform replay.
+    """
+
+    optimizer = model.optimizer
+
+    @tf.function(input_signature=state_signature(target),
+                 jit_compile=jit_compile)
+    def step(states, actions, rewards, next_states, dones, weights):
+        if target:
+            q_values      = model(states, training=False)
+            next_q_values = next_states
+        else:
+            batch_size    = tf.shape(states)[0]
+            q_values      = model(tf.concat([states, next_states], axis=0),
+                                  training=False)
+            next_q_values = q_values[batch_size:]
+            q_values      = q_values[:batch_size]
+        max_next_q = tf.reduce_max(next_q_values, axis=1)
+        max_next_q = tf.where(dones, tf.zeros_like(max_next_q), max_next_q)
+
+        # Replace the Q-Value of the Taken Action by its Target
+        mask    = tf.one_hot(actions, OUTPUT_DIM, dtype=q_values.dtype)
+        update  = ALPHA * (rewards + GAMMA * max_next_q)
+        targets = q_values * (1.0 - mask) + mask * tf.expand_dims(update, axis=1)
+        td_errors = update - tf.reduce_sum(q_values * mask, axis=1)
+
+        with tf.GradientTape() as tape:
+            predictions = model(states, training=True)
+            loss = tf.reduce_mean(tf.expand_dims(weights, axis=1) *
+                                  tf.square(targets - predictions))
+        gradients = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+
+        return loss, td_errors
+
+    return step
+
+def compile_act(model, jit_compile=False):
+    """Build a graph compiled greedy action selection for model.
+
+    Returns:
+        act -- A tf.function taking a (batch, INPUT_DIM) float32 batch of
+        states and returning (actions, q_estimates).
+    """
+
+    @tf.function(input_signature=[state_signature()[0]],
+                 jit_compile=jit_compile)
+    def act(states):
+        q_estimates = model(states, training=False)
+        return tf.argmax(q_estimates, axis=1, output_type=tf.int32), q_estimates
+
+    return act
+
+def compiled_step(model, target=False):
+    """Return the training step used by Trainer, see compile_train_step()."""
+
+    if TF_FUNCTION:
+        return compile_train_step(model, JIT_COMPILE, target)
+    elif target:
+        return lambda states, actions, rewards, next_q_values, dones, weights: \
+            train_step(model, states, actions, rewards, None, dones,
+                       next_q_values, weights)
+    else:
+        return lambda states, actions, rewards, next_states, dones, weights: \
+            train_step(model, states, actions, rewards, next_states, dones,
+                       None, weights)
+
+def compiled_act(model):
+    """Return the action selection used by the servers, see compile_act()."""
+
+    if TF_FUNCTION:
+        return compile_act(model, JIT_COMPILE)
+    else:
+        return lambda states: (None, model.predict_on_batch(states))
+
+class TargetNetwork(object):
+    """Frozen copy of the model providing the next-state Q-values.
+
+    With hard syncs the target network only changes every sync_freq
+    training steps, so the Q-values of a transition's next state are
+    cached by replay index and reused until the next sync or until the
+    slot is overwritten. Soft (Polyak) updates change the network every
+    step and are computed without the cache.
+
+    Arguments:
+        model -- The trained model, its weights initialise the copy.
+        memory -- The replay.ReplayMemory() transitions are sampled from.
+        sync_freq -- Training steps between hard syncs, defaults to
+        TARGET_SYNC_FREQ.
+        tau -- Soft update rate, 0 for hard syncs, defaults to TARGET_TAU.
+    """
+
+    def __init__(self, model, memory, sync_freq=None, tau=None):
+        self.model = build_model()
+        self.model.set_weights(model.get_weights())
+        self.memory    = memory
+        self.sync_freq = TARGET_SYNC_FREQ if sync_freq is None else sync_freq
+        self.tau       = TARGET_TAU if tau is None else tau
+        self.updates   = 0
+        self.cache     = np.zeros((memory.capacity, OUTPUT_DIM), np.float32)
+        self.cache_ids = np.full(memory.capacity, -1, dtype=np.int64)
+        self.cache_hits, self.cache_misses = 0, 0
+
+    def next_q_values(self, indices):
+        """Return Q(s') of the transitions at the replay indices."""
+
+        if self.tau > 0:
+            return np.asarray(self.model.predict_on_batch(
+                self.memory.next_states[indices]), dtype=np.float32)
+
+        # Compute Only Next States not Cached since the Last Sync
+        missing = np.unique(
+            indices[self.cache_ids[indices] != self.memory.ids[indices]])
+        if len(missing):
+            self.cache[missing] = np.asarray(self.model.predict_on_batch(
+                self.memory.next_states[missing]))
+            self.cache_ids[missing] = self.memory.ids[missing]
+        self.cache_misses += len(missing)
+        self.cache_hits   += len(indices) - len(missing)
+
+        return self.cache[indices]
+
+    def update(self, model):
+        """Call after every training step of model."""
+
+        self.updates += 1
+        if self.tau > 0:
+            self.model.set_weights([
+                self.tau * w + (1.0 - self.tau) * t for w, t in
+                zip(model.get_weights(), self.model.get_weights())])
+        elif self.updates % self.sync_freq == 0:
+            self.model.set_weights(model.get_weights())
+            self.cache_ids[:] = -1
+
+class Trainer(object):
+    """Sample replay memory and train model on it.
+
+    With a replay.PrioritizedReplayMemory() the loss is weighted by the
+    importance-sampling weights and the priorities of the sampled
+    transitions are updated from their TD errors.
+
+    Arguments:
+        model -- The compiled tf.keras.model() object to train.
+        memory -- A replay.ReplayMemory() object.
+        lock -- Lock held while reading memory, when it is written to from
+        another thread.
+        target -- Use a TargetNetwork, defaults to TARGET_NETWORK.
+    """
+
+    def __init__(self, model, memory, lock=None, target=None):
+        target = TARGET_NETWORK if target is None else target
+        self.model   = model
+        self.memory  = memory
+        self.lock    = lock or threading.Lock()
+        self.target  = TargetNetwork(model, memory) if target else None
+        self.step    = compiled_step(model, target)
+        self.updates = 0
+        self.prioritized = isinstance(memory, replay.PrioritizedReplayMemory)
+
+    def train(self, batch_size=BATCH_SIZE):
+        """Run one training step.
+
+        Returns:
+            loss -- The training loss, None if memory is still empty.
+        """
+
+        with self.lock:
+            batch_size = min(batch_size, len(self.memory))
+            if batch_size == 0:
+                return None
+            indices = self.memory.sample_indices(batch_size)
+            states, actions, rewards, next_states, dones = \
+                self.memory.batch(indices)
+            if self.target:
+                next_states = self.target.next_q_values(indices)
+            if self.prioritized:
+                weights = self.memory.weights(indices)
+            else:
+                weights = np.ones(batch_size, dtype=np.float32)
+
+        loss, td_errors = self.step(states, actions, rewards, next_states,
+                                    dones, weights)
+        if self.prioritized:
+            with self.lock:
+                self.memory.update_priorities(indices, np.asarray(td_errors))
+        self.updates += 1
+        if self.target:
+            self.target.update(self.model)
+
+        return loss
+
 def e_greedy_policy(q_estimates):
     """Determines whether an action is decided through the neural network or
     the epsilon greedy policy.
@@ -63,11 +387,119 @@ def e_greedy_policy(q_estimates):
     else:
         return int(np.argmax(q_estimates)), False
 
-def recv_from_gh_client(socket):
+class Learner(threading.Thread):
+    """Background thread training on replay memory while the actor serves GH.
+
+    The learner trains its own copy of the model continuously and publishes
+    its weights every publish_freq updates. The actor picks them up with
+    sync() between environment steps, so inference never waits on training.
+
+    Arguments:
+        model -- The actor model; its weights initialise the learner model.
+        memory -- A replay.ReplayMemory() shared with the actor. Use add()
+        to append to it while the learner is running.
+        publish_freq -- Updates between weight publishes.
+    """
+
+    def __init__(self, model, memory, publish_freq=PUBLISH_FREQ):
+        super(Learner, self).__init__(daemon=True)
+        self.model = build_model()
+        self.model.set_weights(model.get_weights())
+        self.memory       = memory
+        self.publish_freq = publish_freq
+        self.lock         = threading.Lock() # guards memory
+        self.trainer      = Trainer(self.model, memory, self.lock)
+        self.stopped      = threading.Event()
+        self.updates      = 0
+        self.started      = None
+        self.__published  = (0, None) # (version, weights)
+        self.__synced     = 0
+
+    def add(self, *transition):
+        with self.lock:
+            self.memory.append(*transition)
+
+    def run(self):
+        self.started = time.perf_counter()
+        while not self.stopped.is_set():
+            if self.trainer.train() is None:
+                time.sleep(0.001)
+                continue
+
+            self.updates += 1
+            if self.updates % self.publish_freq == 0:
+                self.__published = (self.updates, self.model.get_weights())
+
+    def sync(self, model):
+        """Copy the latest published weights to model, if there are new ones.
+
+        Returns:
+            synced -- True if the weights were updated.
+        """
+
+        version, weights = self.__published
+        if version == self.__synced:
+            return False
+        model.set_weights(weights)
+        self.__synced = version
+        return True
+
+    def updates_per_second(self):
+        if not self.started:
+            return 0.0
+        return self.updates / (time.perf_counter() - self.started)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def training_state(model, memory, lock=None):
+    """Snapshot everything needed to resume training, see resume().
+
+    Arguments:
+        lock -- Lock guarding memory, if it is used by another thread.
+
+    Returns:
+        state -- A dict of np.array() objects and scalars for a Checkpointer.
+    """
+
+    with lock or threading.Lock():
+        state = memory.state_dict()
+    state['epsilon'] = epsilon
+    for index, weights in enumerate(model.get_weights()):
+        state['weights_{}'.format(index)] = weights
+
+    return state
+
+def resume(checkpointer, model, memory):
+    """Restore model weights, replay memory and epsilon of the last state
+    checkpoint.
+
+    Returns:
+        iteration -- The iteration to continue from, 0 if there is none.
+    """
+
+    global epsilon
+
+    state = checkpointer.load_state()
+    if state is None:
+        print('No checkpoint to resume from in {}.'.format(MODEL_SAVE_PATH))
+        return 0
+
+    model.set_weights([state['weights_{}'.format(index)]
+                       for index in range(len(model.get_weights()))])
+    memory.load_state_dict(state)
+    epsilon = float(state['epsilon'])
+    print('Resumed from iteration {}.'.format(int(state['iteration'])))
+
+    return int(state['iteration'])
+
+def recv_from_gh_client(socket, size=None):
     """Connect, receive, and decode data received from socket to a list.
 
     Arguments:
         socket -- A socket.socket() object to receive data.
+        size -- The number of values expected, None to accept any.
 
     Returns:
         return_lst -- A list of floats sent from Grasshopper.
@@ -76,11 +508,13 @@ def recv_from_gh_client(socket):
     socket.listen()
     conn, _ = socket.accept()
     with conn:
-        return_byt = conn.recv(1024)
-    return_str = return_byt.decode()
-    return_lst = [float(value) for value in return_str.split()]
+        return_byt = protocol.recv_message(conn, 65536)
+    return_arr, _ = protocol.decode_state(return_byt)
+    if size is not None and len(return_arr) != size:
+        raise ValueError('received {} values from GH client, expected {}'
+                         .format(len(return_arr), size))
 
-    return return_lst
+    return return_arr
 
 def send_to_gh_client(socket, message):
     """Connect, encode, and send message through socket.
@@ -96,15 +530,280 @@ def send_to_gh_client(socket, message):
     with conn:
         conn.send(message_byt)
 
+class LegacyConnection(object):
+    """Exchange with the GH client as done by training.gh.
+
+    Every message is sent over a new connection: the state port is bound
+    for the state read and the action send, the reward port for the reward.
+    """
+
+    def __init__(self, host=HOST, state_port=STATE_PORT,
+                 reward_port=REWARD_PORT, timeout=TIMEOUT):
+        self.host        = host
+        self.state_port  = state_port
+        self.reward_port = reward_port
+        self.timeout     = timeout
+        self.new_episode = False # episodes are not delimited in this mode
+        self.__socket    = None
+
+    def __bind(self, port):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self.host, port))
+        s.settimeout(self.timeout)
+        return s
+
+    def recv_state(self):
+        self.__socket = self.__bind(self.state_port)
+        return recv_from_gh_client(self.__socket, INPUT_DIM)
+
+    def send_action(self, action):
+        with self.__socket as s:
+            send_to_gh_client(s, action)
+        self.__socket = None
+
+    def recv_reward(self):
+        """Returns reward, done: done if the client sends '<reward> 1'."""
+
+        with self.__bind(self.reward_port) as s:
+            values = recv_from_gh_client(s)
+        return values[0], bool(len(values) > 1 and values[1] == 1)
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+
+class PersistentConnection(object):
+    """Exchange with the GH client over one framed connection per episode.
+
+    The server binds once. A client connects at the start of an episode and
+    sends state and reward messages, receiving an action in between, until
+    it disconnects; the next state is then read from the next client.
+
+    Arguments:
+        framing -- Framing passed on to protocol.FramedConnection.
+    """
+
+    def __init__(self, host=HOST, port=STATE_PORT, timeout=TIMEOUT,
+                 framing=None):
+        self.timeout     = timeout
+        self.framing     = framing
+        self.listener    = protocol.listen(host, port, timeout)
+        self.conn        = None
+        self.new_episode = False # the last state is the first of a client
+
+    def recv_state(self):
+        self.new_episode = False
+        while True:
+            if self.conn is None:
+                self.conn = protocol.accept(self.listener, self.framing,
+                                            self.timeout)
+                self.new_episode = True
+            try:
+                return self.conn.recv_state()
+            except protocol.ConnectionClosed:
+                # Episode Finished, Wait for Next Client
+                self.conn.close()
+                self.conn = None
+
+    def send_action(self, action):
+        self.conn.send_action(action)
+
+    def recv_reward(self):
+        """Returns reward, done: the done flag sent along with the reward."""
+
+        reward = self.conn.recv_reward()
+        return reward, self.conn.done
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.listener.close()
+
+
+class MultiEnvConnection(object):
+    """Serve several persistent GH clients on one port with a selector.
+
+    Every client runs its own episodes with the protocol of
+    PersistentConnection. recv_states() collects the states of all clients
+    waiting for an action, so they can be answered with one batched
+    prediction. Transitions are assembled per client as soon as the state
+    following a reward arrives, or with the reward if it ends the episode.
+    Reads never block: every client's bytes are buffered until a message is
+    complete, so a slow client does not stall the others.
+
+    Arguments:
+        max_envs -- Maximum number of concurrent clients, others are refused.
+    """
+
+    class Env(object):
+
+        def __init__(self, conn):
+            self.conn   = conn
+            self.state  = None
+            self.action = None
+            self.reward = None
+            self.done   = False
+            self.buffer = bytearray() # received bytes of incomplete messages
+
+    def __init__(self, host=HOST, port=STATE_PORT, max_envs=NUM_ENVS,
+                 timeout=TIMEOUT, framing=None):
+        self.max_envs    = max_envs
+        self.timeout     = timeout
+        self.framing     = framing
+        self.listener    = protocol.listen(host, port)
+        self.selector    = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.envs        = 0
+        self.waiting     = [] # envs waiting for an action
+        self.transitions = []
+
+    def __accept(self):
+        conn = protocol.accept(self.listener, self.framing, self.timeout)
+        if self.envs >= self.max_envs:
+            conn.close()
+            return
+        self.selector.register(conn.conn, selectors.EVENT_READ, self.Env(conn))
+        self.envs += 1
+
+    def __drop(self, env):
+        if env.conn.conn.fileno() < 0:
+            return # already dropped
+        self.selector.unregister(env.conn.conn)
+        env.conn.close()
+        self.envs -= 1
+        if env in self.waiting:
+            self.waiting.remove(env)
+
+    def __read(self, env):
+        try:
+            data = env.conn.conn.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            # Episode Finished, Client Disconnected
+            self.__drop(env)
+            return
+
+        env.buffer += data
+        while True:
+            message = env.conn.framing.parse(env.buffer)
+            if message is None:
+                break
+            msg_type, payload, size = message
+            del env.buffer[:size]
+            self.__handle(env, msg_type, payload)
+
+    def __handle(self, env, msg_type, payload):
+        if msg_type == protocol.MSG_STATE:
+            state, _ = protocol.decode_state(payload)
+            if env.reward is not None:
+                self.transitions.append(
+                    (env.state, env.action, env.reward, state, env.done))
+            env.state, env.reward = state, None
+            self.waiting.append(env)
+
+        elif msg_type == protocol.MSG_REWARD:
+            env.reward, env.done = protocol.decode_reward(payload)
+            if env.done:
+                # Terminal Transition, its Next State is Masked in the Target
+                self.transitions.append(
+                    (env.state, env.action, env.reward, env.state, True))
+                env.reward = None
+
+    def __poll(self, timeout):
+        events = self.selector.select(timeout)
+        for key, _ in events:
+            if key.fileobj is self.listener:
+                self.__accept()
+            else:
+                self.__read(key.data)
+        return events
+
+    def recv_states(self):
+        """Block until at least one client waits for an action.
+
+        Returns:
+            envs, states -- The waiting clients and their states stacked to
+            a (len(envs), INPUT_DIM) np.array().
+        """
+
+        while not self.waiting:
+            if not self.__poll(self.timeout):
+                raise socket.timeout('no state received from any GH client')
+        # Batch States of All Clients Ready Right Now
+        self.__poll(0)
+
+        envs, self.waiting = self.waiting, []
+        return envs, np.array([env.state for env in envs], dtype=np.float32)
+
+    def send_actions(self, envs, actions):
+        for env, action in zip(envs, actions):
+            env.action = action
+            try:
+                env.conn.send_action(action)
+            except OSError:
+                # Client Died, the Other Clients Keep Running
+                self.__drop(env)
+
+    def pop_transitions(self):
+        """Return and clear the completed (s, a, r, s', done) transitions."""
+
+        transitions, self.transitions = self.transitions, []
+        return transitions
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is not self.listener:
+                self.__drop(key.data)
+        self.selector.close()
+        self.listener.close()
+
+
+def gh_connection(mode=None):
+    """Create the connection to the GH client for CONNECTION_MODE."""
+
+    mode = mode or CONNECTION_MODE
+    if mode == 'legacy':
+        return LegacyConnection(HOST, STATE_PORT, REWARD_PORT, TIMEOUT)
+    elif mode == 'persistent':
+        return PersistentConnection(HOST, STATE_PORT, TIMEOUT)
+    else:
+        raise ValueError('unknown connection mode: {}'.format(mode))
+
+
 def server():
     """Initalise model and run the main loop for Deep Q-Learning."""
 
+    global memory
+    memory = replay_memory()
+
     # Initialise Model
     model = build_model()
     print('Model Initialised.')
 
-    # Define Socket
-    HOST = '127.0.0.1'
+    # Checkpoints Written in the Background
+    checkpointer = checkpoint.Checkpointer(MODEL_SAVE_PATH, build_model(),
+                                           KEEP_CHECKPOINTS)
+    start = resume(checkpointer, model, memory) if RESUME else 0
+
+    # Graph Compiled Training Step and Action Selection
+    act     = compiled_act(model)
+    trainer = None if ASYNC_LEARNER else Trainer(model, memory)
+
+    # Background Learner
+    learner = None
+    if ASYNC_LEARNER:
+        learner = Learner(model, memory)
+        learner.start()
+
+    # Connection to GH Client
+    connection = gh_connection()
+    latency    = LatencyStats()
+    rewards    = []
 
     # Variables for Memeory Sample
     prev_state  = []
@@ -113,35 +812,34 @@ def server():
     reset_state = []
 
     # Training Loop
-    for i in range(ITERATIONS):
+    for i in range(start, ITERATIONS):
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((HOST, 8080))
-            s.settimeout(TIMEOUT)
+        if i == start:
+            print('\nStart Loop in GH Client...\n')
 
-            if i == 0:
-                print('\nStart Loop in GH Client...\n')
+        # Read Current State from GH Client
+        state_in = connection.recv_state()
+        received = time.perf_counter()
 
-            # Read Current State from GH Client
-            state_in = recv_from_gh_client(s)
+        # No Transition Across Episodes
+        if connection.new_episode:
+            prev_state = []
 
-            # Storing Reset State
-            if i == 0:
-                reset_state = state_in
-
-            # Select Action
-            q_estimates = model.predict_on_batch(np.array([state_in]))
-            action, random_act = e_greedy_policy(q_estimates)
-            send_to_gh_client(s, action)
+        # Storing Reset State
+        if i == 0:
+            reset_state = state_in
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((HOST, 8081))
-            s.settimeout(TIMEOUT)
+        # Select Action
+        _, q_estimates = act(np.array([state_in], dtype=np.float32))
+        q_estimates = np.asarray(q_estimates)
+        action, random_act = e_greedy_policy(q_estimates)
+        connection.send_action(action)
+        latency.add(time.perf_counter() - received)
 
-            # Recieve Reward from Client
-            reward = recv_from_gh_client(s)[0]
+        # Recieve Reward from Client
+        reward, done = connection.recv_reward()
 
-        if i == 0:
+        if i == start:
             print('\n  ... connected.')
 
         else:
@@ -153,64 +851,163 @@ def server():
                 print('  action      = {} (epsilon)'.format(action))
             else:
                 print('  action      = {}'.format(action))
-            print('  reward      = {}'.format(reward))
+            print('  reward      = {}{}'.format(reward,
+                                                ' (done)' if done else ''))
+            print('  latency     = {}'.format(latency))
+            rewards.append(reward)
+
+            if learner:
+                # Store Memory Sample, Training Runs in the Learner Thread
+                if len(prev_state):
+                    learner.add(prev_state, action, reward, state_in, done)
+                learner.sync(model)
+                print('  learner     = {} updates ({:.1f}/s)'.format(
+                    learner.updates, learner.updates_per_second()))
 
-            # Store Memory Sample
-            memory_sample = [prev_state, action, reward, state_in]
-            memory.append(memory_sample)
+            else:
+                # Store Memory Sample
+                if len(prev_state):
+                    memory.append(prev_state, action, reward, state_in, done)
 
-            # Pop Excess Memory
-            if len(memory) > MAX_MEMORY:
-                memory.pop(0)
+                # Train Model on Batch Sampled from Memory
+                trainer.train()
 
-            # Sample Batch from Memory
-            if BATCH_SIZE > len(memory):
-                batch = random.sample(memory, len(memory))
-            else:
-                batch = random.sample(memory, BATCH_SIZE)
+            # Decay Epsilon
+            global epsilon
+            epsilon = FINAL_EPSILON + (1 - LAMBDA) * (epsilon - FINAL_EPSILON)
+            print('  epsilon     = {:0.3}'.format(epsilon))
 
-            # Training Input and Target Arrays for Batch
-            states      = np.array([sample[0] for sample in batch])
-            next_states = np.array([sample[3] for sample in batch])
+        # Update Previous State, Reset at the End of an Episode
+        prev_state = [] if done else state_in
+
+        # Save Model (and Training State) in the Background
+        if i % MODEL_SAVE_FREQ == 0 and i > start:
+            state = None
+            if i % STATE_SAVE_FREQ == 0:
+                state = training_state(model, memory,
+                                       learner.lock if learner else None)
+            checkpointer.save(i, model, state, metric=np.mean(rewards))
+            rewards = []
+            print('\n  -- MODEL SAVED ({}.h5) --'.format(i))
 
-            # Predict Q-Values for Batch
-            q_s_a   = model.predict_on_batch(states).numpy().tolist()
-            q_s_a_d = model.predict_on_batch(next_states).numpy().tolist()
+    connection.close()
+    if learner:
+        learner.stop()
+    checkpointer.close()
 
-            # Set up Arrays for Training
-            x = np.zeros(shape=(len(batch), INPUT_DIM))
-            y = np.zeros(shape=(len(batch), OUTPUT_DIM))
 
-            for index, sample in enumerate(batch):
+def vectorized_server():
+    """Run Deep Q-Learning with NUM_ENVS GH clients connected in parallel.
 
-                # Unpack Samples in Batch
-                st_in, actn, rwrd, nxt_st = sample[0], sample[1], sample[2], sample[3]
-                current_q = q_s_a[index]
+    The states of all clients waiting for an action are answered with one
+    batched prediction and their transitions feed one replay memory. The
+    model is trained once per batch (or continuously with ASYNC_LEARNER).
+    ITERATIONS counts environment steps over all clients.
 
-                # Apply Discount Coefficient (Gamma)
-                current_q[actn] = ALPHA * (rwrd + GAMMA * np.amax(q_s_a_d[index]))
+    Returns:
+        steps, elapsed -- The number of environment steps served after the
+        first batch (which traces the compiled functions) and the seconds
+        it took.
+    """
 
-                x[index] = st_in
-                y[index] = current_q
+    global epsilon, memory
+    memory = replay_memory()
 
-            # Train Model
-            model.train_on_batch(x, y)
+    # Initialise Model
+    model = build_model()
+    print('Model Initialised.')
 
-            # Decay Epsilon
-            global epsilon
+    # Checkpoints Written in the Background
+    checkpointer = checkpoint.Checkpointer(MODEL_SAVE_PATH, build_model(),
+                                           KEEP_CHECKPOINTS)
+    steps = resume(checkpointer, model, memory) if RESUME else 0
+
+    # Graph Compiled Training Step and Action Selection
+    act     = compiled_act(model)
+    trainer = None if ASYNC_LEARNER else Trainer(model, memory)
+
+    # Background Learner
+    learner = None
+    if ASYNC_LEARNER:
+        learner = Learner(model, memory)
+        learner.start()
+
+    # Connection to GH Clients
+    connection = MultiEnvConnection(HOST, STATE_PORT, NUM_ENVS, TIMEOUT)
+    latency    = LatencyStats()
+    rewards    = []
+    print('\nStart Loop in {} GH Clients...\n'.format(NUM_ENVS))
+
+    # Timed from the First Batch on, Nothing to Time when Resuming a Finished
+    # Run
+    rounds = 0
+    start, first_steps = time.perf_counter(), steps
+    while steps < ITERATIONS:
+
+        # Read States from All Waiting GH Clients
+        envs, states = connection.recv_states()
+        received = time.perf_counter()
+
+        # Select Actions in One Batch
+        _, q_estimates = act(states)
+        actions = [e_greedy_policy(q)[0] for q in np.asarray(q_estimates)]
+        connection.send_actions(envs, actions)
+        latency.add(time.perf_counter() - received)
+
+        # Store Memory Samples
+        for transition in connection.pop_transitions():
+            rewards.append(transition[2])
+            if learner:
+                learner.add(*transition)
+            else:
+                memory.append(*transition)
             epsilon = FINAL_EPSILON + (1 - LAMBDA) * (epsilon - FINAL_EPSILON)
-            print('  epsilon     = {:0.3}'.format(epsilon))
 
-        # Update Previous State
-        prev_state = state_in
-
-        # Save Model
-        if i % MODEL_SAVE_FREQ == 0 and i > 0:
-            model.save(os.path.join(MODEL_SAVE_PATH, '{}.h5'.format(i)))
-            print('\n  -- MODEL SAVED ({}.h5) --'.format(i))
+        # Train Model
+        if learner:
+            learner.sync(model)
+        else:
+            trainer.train()
+
+        steps  += len(envs)
+        rounds += 1
+        if rounds == 1:
+            start, first_steps = time.perf_counter(), steps
+
+        # Print
+        if rounds % 100 == 0:
+            print('  STEPS: {:<8} clients = {}  batch = {:<4} latency = {}  '
+                  'epsilon = {:0.3}'.format(steps, connection.envs, len(envs),
+                                            latency, epsilon))
+
+        # Save Model (and Training State) in the Background
+        if rounds % MODEL_SAVE_FREQ == 0:
+            state = None
+            if rounds % STATE_SAVE_FREQ == 0:
+                state = training_state(model, memory,
+                                       learner.lock if learner else None)
+            checkpointer.save(steps, model, state,
+                              metric=np.mean(rewards) if rewards else None)
+            rewards = []
+            print('\n  -- MODEL SAVED ({}.h5) --'.format(steps))
+
+    elapsed = time.perf_counter() - start
+    print('\n  {} steps in {:.1f} s ({:.1f} steps/s)'.format(
+        steps - first_steps, elapsed,
+        (steps - first_steps) / elapsed if elapsed > 0 else 0.0))
+
+    connection.close()
+    if learner:
+        learner.stop()
+    checkpointer.close()
+
+    return steps - first_steps, elapsed
 
 
 if __name__ == '__main__':
 
     # Training
-    server()
+    if NUM_ENVS > 1:
+        vectorized_server()
+    else:
+        server()
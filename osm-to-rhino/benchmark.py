@@ -0,0 +1,1097 @@
+"""Benchmarks for osmlib outside of Rhino (CPython).
+
+The .osm files are synthetic cities written by write_synthetic_osm(), so
+no download is needed. Generated files are cached in the system temp
+directory.
+
+Usage:
+    python benchmark.py parse [--sizes 100 500 2000]
+    python benchmark.py nodes [--nodes 1000000]
+    python benchmark.py pbf [--sizes 100] [--workers 1 2 4]
+    python benchmark.py select [--size 100] [--fraction 0.01]
+    python benchmark.py relations [--relations 25000 50000 100000]
+    python benchmark.py project [--nodes 10000000] [--size 20]
+    python benchmark.py projections [--nodes 2000000]
+    python benchmark.py units [--values 1000000]
+    python benchmark.py index [--ways 1000000]
+    python benchmark.py geometry [--size 100]
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import random
+import re
+import struct
+import tempfile
+import time
+import tracemalloc
+import zlib
+from array import array
+
+import osmlib
+
+BYTES_PER_BUILDING = 560 # rough size of a building in the synthetic xml
+HEIGHTS = ['3', '10', '10 m', '12.5', '12.5 m', "12'6\"", '25', '7,5', '4 m',
+           '30 ft', '100', '6']
+LEVELS  = ['1', '2', '3', '4', '5', '8', '12']
+
+
+def write_synthetic_osm(path, megabytes, seed=0):
+    """Write a city-like .osm file of roughly the given size.
+
+    Buildings are closed 4-node ways on a grid with height or levels tags,
+    every 10th has a courtyard and is written as a multipolygon relation of
+    its outer and inner way. Every grid row has a residential highway, every
+    20th node carries a tag.
+
+    Returns:
+        path -- The written file.
+    """
+
+    rng = random.Random(seed)
+    buildings = max(1, int(megabytes * 1e6 / BYTES_PER_BUILDING))
+    width = 200 # buildings per grid row
+    rows = (buildings + width - 1) // width
+    courtyards = range(0, buildings, 10)
+    lat0, lon0, step, size = 47.36, 8.53, 0.0002, 0.00012
+
+    def corners(lat, lon, d):
+        return [(lat, lon), (lat, lon + d), (lat + d, lon + d), (lat + d, lon)]
+
+    def node(out, node_id, lat, lon, tagged=False):
+        if tagged:
+            out.write('  <node id="{}" lat="{:.7f}" lon="{:.7f}" version="1">\n'
+                      '    <tag k="amenity" v="bench"/>\n  </node>\n'
+                      .format(node_id, lat, lon))
+        else:
+            out.write('  <node id="{}" lat="{:.7f}" lon="{:.7f}" version="1"/>\n'
+                      .format(node_id, lat, lon))
+
+    def way(out, way_id, refs, tags):
+        out.write('  <way id="{}" version="1">\n'.format(way_id))
+        for ref in refs:
+            out.write('    <nd ref="{}"/>\n'.format(ref))
+        for k, v in tags:
+            out.write('    <tag k="{}" v="{}"/>\n'.format(k, v.replace('"', '&quot;')))
+        out.write('  </way>\n')
+
+    def origin(b):
+        return lat0 + (b // width) * step, lon0 + (b % width) * step
+
+    inner_node0 = 4 * buildings + 1
+    highway_node0 = inner_node0 + 4 * len(courtyards)
+    inner_way0 = buildings + 1
+    highway_way0 = inner_way0 + len(courtyards)
+
+    with open(path, 'w') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<osm version="0.6" generator="benchmark.py">\n')
+        out.write(' <bounds minlat="{:.7f}" minlon="{:.7f}" maxlat="{:.7f}" '
+                  'maxlon="{:.7f}"/>\n'.format(
+                      lat0, lon0, lat0 + rows * step, lon0 + width * step))
+
+        # nodes
+        for b in range(buildings):
+            for i, (lat, lon) in enumerate(corners(*origin(b), d=size)):
+                node_id = 4 * b + i + 1
+                node(out, node_id, lat, lon, node_id % 20 == 0)
+        for c, b in enumerate(courtyards):
+            lat, lon = origin(b)
+            for i, (lat, lon) in enumerate(corners(lat + size / 3, lon + size / 3,
+                                                   size / 3)):
+                node(out, inner_node0 + 4 * c + i, lat, lon)
+        for r in range(rows):
+            lat = lat0 + r * step - step / 4
+            node(out, highway_node0 + 2 * r, lat, lon0)
+            node(out, highway_node0 + 2 * r + 1, lat, lon0 + width * step)
+
+        # ways
+        for b in range(buildings):
+            refs = [4 * b + 1, 4 * b + 2, 4 * b + 3, 4 * b + 4, 4 * b + 1]
+            tags = [] if b % 10 == 0 else [('building', 'yes')]
+            if rng.random() < 0.5:
+                tags.append(('height', rng.choice(HEIGHTS)))
+            else:
+                tags.append(('building:levels', rng.choice(LEVELS)))
+            way(out, b + 1, refs, tags)
+        for c, b in enumerate(courtyards):
+            n = inner_node0 + 4 * c
+            way(out, inner_way0 + c, [n, n + 1, n + 2, n + 3, n], [])
+        for r in range(rows):
+            way(out, highway_way0 + r, [highway_node0 + 2 * r,
+                highway_node0 + 2 * r + 1], [('highway', 'residential')])
+
+        # relations
+        for c, b in enumerate(courtyards):
+            out.write('  <relation id="{}" version="1">\n'
+                      '    <member type="way" ref="{}" role="outer"/>\n'
+                      '    <member type="way" ref="{}" role="inner"/>\n'
+                      '    <tag k="type" v="multipolygon"/>\n'
+                      '    <tag k="building" v="yes"/>\n'
+                      '  </relation>\n'.format(c + 1, b + 1, inner_way0 + c))
+        out.write('</osm>\n')
+
+    return path
+
+
+def write_relation_osm(path, relations, seed=0):
+    """Write an .osm file of nested relations.
+
+    Nine of ten relations are multipolygons of one 4-node way. Every 10th
+    is a site of five nearby multipolygons, shared with neighbouring sites,
+    every 100th a group of the nine sites before it. Every 1000th site also
+    contains the next group, a loop of relations.
+
+    Returns:
+        path -- The written file.
+    """
+
+    rng = random.Random(seed)
+    with open(path, 'w') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<osm version="0.6" generator="benchmark.py">\n')
+        for n in range(1, 4 * relations + 1):
+            out.write('  <node id="{}" lat="{:.7f}" lon="{:.7f}"/>\n'.format(
+                n, 47 + n * 1e-6, 8 + (n % 4) * 1e-5))
+        for r in range(1, relations + 1):
+            refs = [4 * r - 3, 4 * r - 2, 4 * r - 1, 4 * r, 4 * r - 3]
+            out.write('  <way id="{}">\n{}  </way>\n'.format(r, ''.join(
+                '    <nd ref="{}"/>\n'.format(ref) for ref in refs)))
+        for r in range(1, relations + 1):
+            if r % 10:
+                members = [('way', r, 'outer')]
+                tags = [('type', 'multipolygon'), ('building', 'yes')]
+            elif r % 100:
+                nearby = [m for m in range(max(1, r - 50), min(relations, r + 50))
+                          if m % 10]
+                members = [('relation', m, '') for m in rng.sample(nearby, 5)]
+                if r % 1000 == 10 and r + 90 <= relations:
+                    members.append(('relation', r + 90, 'group'))
+                tags = [('type', 'site')]
+            else:
+                members = [('relation', r - 10 * i, 'site') for i in range(1, 10)]
+                tags = [('type', 'group')]
+            out.write('  <relation id="{}">\n{}{}  </relation>\n'.format(
+                r, ''.join('    <member type="{}" ref="{}" role="{}"/>\n'
+                           .format(*m) for m in members),
+                ''.join('    <tag k="{}" v="{}"/>\n'.format(*t) for t in tags)))
+        out.write('</osm>\n')
+
+    return path
+
+
+def synthetic_osm(megabytes):
+    """Return the path of a cached synthetic file of the given size."""
+
+    path = os.path.join(tempfile.gettempdir(),
+                        'osmlib-synthetic-{}mb.osm'.format(megabytes))
+    if not os.path.exists(path):
+        write_synthetic_osm(path + '.tmp', megabytes)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def _varint(value):
+    value &= (1 << 64) - 1 # negative int64 as two's complement
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _message(fields):
+    """Encode [(field number, int or bytes)] as a protobuf message."""
+
+    out = []
+    for number, value in fields:
+        if isinstance(value, bytes):
+            out.append(_varint(number << 3 | 2) + _varint(len(value)) + value)
+        else:
+            out.append(_varint(number << 3) + _varint(value))
+    return b''.join(out)
+
+
+def _packed(values, delta=False, signed=False):
+    out, previous = [], 0
+    for value in values:
+        if delta:
+            value, previous = value - previous, value
+        if signed:
+            value = 2 * value if value >= 0 else -2 * value - 1
+        out.append(_varint(value))
+    return b''.join(out)
+
+
+def write_pbf(osm, path, block_size=8000):
+    """Write the entities of a parsed OsmXmlFileParser as .osm.pbf.
+
+    Blocks hold block_size entities of one kind, nodes are dense, blobs are
+    zlib compressed. Only the version attribute is written.
+
+    Returns:
+        path -- The written file.
+    """
+
+    def write_blob(out, blob_type, data):
+        blob = _message([(2, len(data)), (3, zlib.compress(data))])
+        header = _message([(1, blob_type.encode()), (3, len(blob))])
+        out.write(struct.pack('!I', len(header)) + header + blob)
+
+    def write_block(out, strings, group):
+        table = _message([(1, string.encode('utf-8')) for string in strings])
+        write_blob(out, 'OSMData', _message([(1, table), (2, group)]))
+
+    def chunks(items):
+        items = iter(items)
+        while True:
+            chunk = [item for _, item in zip(range(block_size), items)]
+            if not chunk:
+                return
+            yield chunk
+
+    def string_table():
+        strings = {'': 0}
+        return strings, lambda s: strings.setdefault(s, len(strings))
+
+    def info(attributes):
+        version = attributes.version if attributes else None
+        return [(4, _message([(1, int(version))]))] if version else []
+
+    def tags(entity, index):
+        return [(2, _packed(index(k) for k in entity.tags)),
+                (3, _packed(index(v) for v in entity.tags.values()))]
+
+    b = osm.bounds
+    header = _message([(1, _message([
+        (1, 2 * int(round(float(b.minlon) * 1e9))),
+        (2, 2 * int(round(float(b.maxlon) * 1e9))),
+        (3, 2 * int(round(float(b.maxlat) * 1e9))),
+        (4, 2 * int(round(float(b.minlat) * 1e9)))])),
+        (4, b'OsmSchema-V0.6'), (4, b'DenseNodes')])
+
+    with open(path, 'wb') as out:
+        write_blob(out, 'OSMHeader', header)
+
+        for chunk in chunks(osm.nodes.iteritems()):
+            strings, index = string_table()
+            keys_vals = []
+            for _, node in chunk:
+                for k, v in node.tags.items():
+                    keys_vals += [index(k), index(v)]
+                keys_vals.append(0)
+            dense = [(1, _packed([i for i, _ in chunk], True, True)),
+                     (8, _packed([int(round(n.latitude * 1e7)) for _, n in chunk],
+                                 True, True)),
+                     (9, _packed([int(round(n.longitude * 1e7)) for _, n in chunk],
+                                 True, True)),
+                     (10, _packed(keys_vals))]
+            if all(n.attributes and n.attributes.version for _, n in chunk):
+                dense.append((5, _message([(1, _packed(
+                    int(n.attributes.version) for _, n in chunk))])))
+            write_block(out, strings, _message([(2, _message(dense))]))
+
+        for chunk in chunks(osm.ways.items()):
+            strings, index = string_table()
+            ways = [(3, _message([(1, way_id)] + tags(way, index) + info(
+                way.attributes) + [(8, _packed(way.node_refs, True, True))]))
+                for way_id, way in chunk]
+            write_block(out, strings, _message(ways))
+
+        types = {'node': 0, 'way': 1, 'relation': 2}
+        for chunk in chunks(osm.relations.items()):
+            strings, index = string_table()
+            relations = [(4, _message(
+                [(1, relation_id)] + tags(relation, index) +
+                info(relation.attributes) +
+                [(8, _packed(index(m.role) for m in relation.members)),
+                 (9, _packed([m.ref_id for m in relation.members], True, True)),
+                 (10, _packed(types[m.typ] for m in relation.members))]))
+                for relation_id, relation in chunk]
+            write_block(out, strings, _message(relations))
+
+    return path
+
+
+def synthetic_pbf(megabytes):
+    """Return the path of the synthetic file of this size as .osm.pbf."""
+
+    path = synthetic_osm(megabytes)[:-len('.osm')] + '.osm.pbf'
+    if not os.path.exists(path):
+        osm = osmlib.OsmXmlFileParser(synthetic_osm(megabytes), {
+            'load_additional_attr': True, 'load_version_attr': True},
+            backend='expat')
+        write_pbf(osm, path + '.tmp')
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def _peak_memory():
+    """Peak resident memory of this process in MB (Linux)."""
+
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM'):
+                return int(line.split()[1]) / 1024.0
+    return float('nan')
+
+
+def _parse_in_child(path, options, backend, workers, results):
+    start = time.perf_counter()
+    osm = osmlib.OsmXmlFileParser(path, options, backend=backend,
+                                  workers=workers)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, len(osm.nodes), len(osm.ways), len(osm.relations),
+                 _peak_memory()))
+
+
+def _run_in_child(target, *args):
+    """Run target(*args, queue) in a fresh process, return what it puts."""
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=target, args=args + (results,))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def bench_parse(sizes=(100,), backend='expat'):
+    """Parse throughput in MB/s and peak memory, retaining all entities and
+    none of them (which shows the parser's own memory overhead)."""
+
+    keep_nothing = {'load_nodes': False, 'load_ways': False,
+                    'load_relations': False}
+
+    print('parse | backend={}'.format(backend))
+    for megabytes in sizes:
+        path = synthetic_osm(megabytes)
+        file_mb = os.path.getsize(path) / 1e6
+        for name, options in [('all', {}), ('nothing', keep_nothing)]:
+            elapsed, nodes, ways, relations, peak = _run_in_child(
+                _parse_in_child, path, options, backend, None)
+            print('  {:>7.0f} MB  retain {:<8} {:>6.1f} MB/s  peak rss '
+                  '{:>7.1f} MB | nodes {} ways {} relations {}'.format(
+                      file_mb, name, file_mb / elapsed, peak, nodes, ways,
+                      relations))
+
+
+def _entities(osm):
+    """Comparable contents of a parsed file."""
+
+    def attributes(a):
+        return a and (a.visible, a.version, a.changeset, a.timestamp, a.user,
+                      a.uid)
+
+    b = osm.bounds
+    return ((float(b.minlat), float(b.minlon), float(b.maxlat), float(b.maxlon)),
+            [(i, n.latitude, n.longitude, n.tags, attributes(n.attributes))
+             for i, n in osm.nodes.iteritems()],
+            sorted((i, list(w.node_refs), w.tags, attributes(w.attributes))
+                   for i, w in osm.ways.items()),
+            sorted((i, [(m.typ, m.ref_id, m.role) for m in r.members], r.tags,
+                    attributes(r.attributes)) for i, r in osm.relations.items()))
+
+
+def bench_pbf(sizes=(100,), workers=(1, 2, 4)):
+    """Parity of the pbf and the xml backend, and pbf parse speed by workers.
+
+    Throughput is given in MB of the equivalent .osm xml per second, the
+    .pbf itself is several times smaller.
+    """
+
+    print('pbf | {} cores'.format(multiprocessing.cpu_count()))
+    for megabytes in sizes:
+        xml, pbf = synthetic_osm(megabytes), synthetic_pbf(megabytes)
+        xml_mb = os.path.getsize(xml) / 1e6
+
+        if megabytes <= 100:
+            for options in [{}, {'load_additional_attr': True,
+                                 'load_version_attr': True},
+                            {'load_way_subtree': False, 'load_nodes': False}]:
+                same = (_entities(osmlib.OsmXmlFileParser(xml, options,
+                                                          backend='expat')) ==
+                        _entities(osmlib.OsmXmlFileParser(pbf, options)))
+                print('  {:>7.0f} MB  parity with xml {} {}'.format(
+                    xml_mb, options or 'default options', same))
+
+        elapsed = _run_in_child(_parse_in_child, xml, {}, 'expat', None)[0]
+        print('  {:>7.0f} MB  xml (expat)       {:>6.1f} MB/s'.format(
+            xml_mb, xml_mb / elapsed))
+        for n in workers:
+            elapsed, nodes, ways, relations, peak = _run_in_child(
+                _parse_in_child, pbf, {}, 'pbf', n)
+            print('  {:>7.0f} MB  pbf workers={:<4} {:>6.1f} MB/s  peak rss '
+                  '{:>7.1f} MB | {:.1f} MB pbf, nodes {} ways {} relations {}'
+                  .format(xml_mb, n, xml_mb / elapsed, peak,
+                          os.path.getsize(pbf) / 1e6, nodes, ways, relations))
+
+
+def _expected_selection(osm, bbox, tag_filter):
+    """Ids a bbox and {key: True} tag filter retain, from a full load."""
+
+    minlat, minlon, maxlat, maxlon = bbox
+    inside = set(i for i, n in osm.nodes.iteritems()
+                 if minlat <= n.latitude <= maxlat and
+                 minlon <= n.longitude <= maxlon)
+    matches = lambda tags: any(k in tags for k in tag_filter)
+    ways_inside = set(i for i, w in osm.ways.items()
+                      if any(ref in inside for ref in w.node_refs))
+    ways = set(i for i in ways_inside if matches(osm.ways[i].tags))
+    relations = set(i for i, r in osm.relations.items() if matches(r.tags) and
+                    any(m.ref_id in (inside if m.typ == 'node' else ways_inside)
+                        for m in r.members))
+    for i in relations:
+        ways.update(m.ref_id for m in osm.relations[i].members if m.typ == 'way')
+    nodes = set(i for i in inside if matches(osm.nodes[i].tags))
+    for i in ways:
+        nodes.update(osm.ways[i].node_refs)
+    return nodes, ways, relations
+
+
+def bench_select(megabytes=100, fraction=0.01):
+    """Load a bbox of fraction of the area with a building and highway tag
+    filter, compared to loading the whole file. The selection is made
+    after a single pass, or with 'selection_passes' over the file.
+
+    Parity is checked against the selection computed from a full load.
+    """
+
+    for path in [synthetic_osm(megabytes), synthetic_pbf(megabytes)]:
+        full = osmlib.OsmXmlFileParser(path, backend=None if path.endswith(
+            '.pbf') else 'expat')
+        b = full.bounds
+        side = fraction ** 0.5 / 2 # bbox around the centre
+        lat, lon = (b.minlat + b.maxlat) / 2, (b.minlon + b.maxlon) / 2
+        dlat, dlon = side * (b.maxlat - b.minlat), side * (b.maxlon - b.minlon)
+        bbox = (lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        options = {'bbox': bbox, 'tag_filter': {'building': True,
+                                                'highway': True}}
+        backend = 'pbf' if path.endswith('.pbf') else 'expat'
+
+        passes = dict(options, selection_passes=True)
+        expected = _expected_selection(full, bbox, options['tag_filter'])
+        same = True
+        for opts in [options, passes]:
+            selected = osmlib.OsmXmlFileParser(path, opts, backend=backend)
+            same = same and expected == (set(selected.nodes.keys()),
+                                         set(selected.ways),
+                                         set(selected.relations))
+        del full, selected
+
+        print('select | {}, {:.0%} of the area, parity {}'.format(
+            os.path.basename(path), fraction, same))
+        for name, opts in [('whole file', {}), ('selection', options),
+                           ('passes', passes)]:
+            elapsed, nodes, ways, relations, peak = _run_in_child(
+                _parse_in_child, path, opts, backend, None)
+            print('  {:<11} {:>6.2f} s  peak rss {:>7.1f} MB | nodes {} ways '
+                  '{} relations {}'.format(name, elapsed, peak, nodes, ways,
+                                           relations))
+
+
+def bench_relations(sizes=(25000, 50000, 100000)):
+    """OsmObjects relation resolution time by number of nested relations.
+
+    Also timed without the cyclic garbage collector, whose passes over the
+    growing heap are the superlinear part.
+    """
+
+    print('relations | OsmObjects')
+    for relations in sizes:
+        path = os.path.join(tempfile.gettempdir(),
+                            'osmlib-relations-{}.osm'.format(relations))
+        if not os.path.exists(path):
+            write_relation_osm(path + '.tmp', relations)
+            os.rename(path + '.tmp', path)
+        times = []
+        for collect in [True, False]:
+            osm = osmlib.OsmXmlFileParser(path, backend='expat')
+            if not collect:
+                gc.disable()
+            start = time.perf_counter()
+            objects = osmlib.OsmObjects(osm)
+            times.append(time.perf_counter() - start)
+            gc.enable()
+        print('  {:>7} relations {:>7.2f} s  {:>5.1f} us/relation, without gc '
+              '{:>5.1f} us/relation | top-level relations {} ways {}'.format(
+                  relations, times[0], 1e6 * times[0] / relations,
+                  1e6 * times[1] / relations, len(objects.relations),
+                  len(objects.ways)))
+
+
+def bench_project(count=10000000, megabytes=20):
+    """Mercator projection of count random nodes: the scalar path, the
+    batch path with numpy and its pure python fallback. Then the points of
+    all ways of a synthetic city, reprojected per node reference as before
+    and gathered from the nodes projected once. Differences and round trip
+    errors beyond their tolerance fail the benchmark."""
+
+    rng = random.Random(0)
+    lats = array('d', (rng.uniform(-85, 85) for _ in range(count)))
+    lons = array('d', (rng.uniform(-180, 180) for _ in range(count)))
+    mercator = osmlib.Mercator
+
+    def scalar():
+        project = mercator.degreesToMeter
+        return [project(lat, lon) for lat, lon in zip(lats, lons)]
+
+    def fallback():
+        numpy, osmlib.numpy = osmlib.numpy, None
+        try:
+            return mercator.degreesToMeterArrays(lats, lons)
+        finally:
+            osmlib.numpy = numpy
+
+    print('project | {} nodes'.format(count))
+    results = {}
+    for name, project in [('scalar', scalar), ('batch, fallback', fallback),
+                          ('batch, numpy', lambda: mercator.degreesToMeterArrays(
+                              lats, lons))]:
+        if name == 'batch, numpy' and osmlib.numpy is None:
+            continue
+        start = time.perf_counter()
+        results[name] = project()
+        elapsed = time.perf_counter() - start
+        print('  {:<16} {:>7.3f} s  {:>6.1f} M nodes/s'.format(
+            name, elapsed, count / elapsed / 1e6))
+    xs, ys = results.pop('batch, numpy', results['batch, fallback'])
+    points = results.pop('scalar')
+    difference = max(max(abs(x - p[0]), abs(y - p[1]))
+                     for x, y, p in zip(xs, ys, points))
+    print('  max difference to scalar {:.1e} m'.format(difference))
+    assert difference < 1e-6, 'batch projection differs from the scalar one'
+    start = time.perf_counter()
+    lats2, lons2 = mercator.meterToDegreesArrays(xs, ys)
+    elapsed = time.perf_counter() - start
+    error = max(max(abs(a - b) for a, b in zip(lats, lats2)),
+                max(abs(a - b) for a, b in zip(lons, lons2)))
+    print('  inverse batch    {:>7.3f} s  max round trip error {:.1e} deg'.format(
+        elapsed, error))
+    assert error < 1e-9, 'Mercator round trip error {:.1e} deg'.format(error)
+    del results, points, xs, ys, lats2, lons2
+
+    osm = osmlib.OsmXmlFileParser(synthetic_osm(megabytes), backend='expat')
+    ways = list(osm.ways)
+    start = time.perf_counter()
+    per_reference = []
+    for way_id in ways:
+        coordinates = []
+        for node_id in osm.ways[way_id].node_refs:
+            location = osm.nodes.location(node_id)
+            if location:
+                coordinates.append(mercator.degreesToMeter(*location))
+        per_reference.append(coordinates)
+    elapsed = time.perf_counter() - start
+    print('way points | {} ways, {} MB synthetic city'.format(len(ways),
+                                                             megabytes))
+    print('  projected per reference   {:>7.3f} s'.format(elapsed))
+    start = time.perf_counter()
+    geometry = osmlib.OsmGeometry.__new__(osmlib.OsmGeometry)
+    geometry.osmxml = osm
+    _, latitudes, longitudes = osm.nodes.arrays()
+    geometry.xs, geometry.ys = mercator.degreesToMeterArrays(latitudes,
+                                                             longitudes)
+    gathered = [geometry.getWayCoordinates(way_id) for way_id in ways]
+    elapsed = time.perf_counter() - start
+    difference = max(abs(a - b) for c1, c2 in zip(per_reference, gathered)
+                     for p1, p2 in zip(c1, c2) for a, b in zip(p1, p2))
+    print('  projected once, gathered  {:>7.3f} s  max difference {:.1e} m'
+          .format(elapsed, difference))
+    assert difference < 1e-6 and \
+        [len(c) for c in per_reference] == [len(c) for c in gathered], \
+        'gathered way points differ from the ones projected per reference'
+
+
+def bench_projections(count=2000000):
+    """Throughput and accuracy of Mercator, LocalMercator and
+    TransverseMercator on count nodes of a city sized area.
+
+    LocalMercator is compared to Mercator, TransverseMercator.utm() to the
+    published UTM coordinates of the CN Tower (zone 17, 630084 E 4833438 N).
+    These comparisons and the round trips fail the benchmark beyond their
+    tolerances.
+    float32 resolution is the spacing of single precision values at the
+    largest coordinate, which display meshes use.
+    """
+
+    rng = random.Random(0)
+    lats = array('d', (rng.uniform(47.3, 47.45) for _ in range(count)))
+    lons = array('d', (rng.uniform(8.45, 8.65) for _ in range(count)))
+    bounds = osmlib.OsmXmlFileParser.Bounds(47.3, 8.45, 47.45, 8.65)
+    mercator = osmlib.Mercator
+    xm, ym = mercator.degreesToMeterArrays(lats, lons)
+
+    print('projections | {} nodes'.format(count))
+    for name, projection in [
+            ('Mercator', mercator),
+            ('LocalMercator', osmlib.LocalMercator.fromBounds(bounds)),
+            ('TransverseMercator', osmlib.TransverseMercator.fromBounds(bounds)),
+            ('UTM zone 32', osmlib.TransverseMercator.utm(32))]:
+        start = time.perf_counter()
+        xs, ys = projection.degreesToMeterArrays(lats, lons)
+        elapsed = time.perf_counter() - start
+        lats2, lons2 = projection.meterToDegreesArrays(xs, ys)
+        largest = max(max(map(abs, xs)), max(map(abs, ys)))
+        error = max(max(abs(a - b) for a, b in zip(lats, lats2)),
+                    max(abs(a - b) for a, b in zip(lons, lons2)))
+        print('  {:<19} {:>6.1f} M nodes/s  round trip {:.1e} deg  largest '
+              'coordinate {:>10.1f} m, float32 resolution {:.1e} m'.format(
+                  name, count / elapsed / 1e6, error,
+                  largest, osmlib.numpy.spacing(osmlib.numpy.float32(largest))
+                  if osmlib.numpy else float('nan')))
+        # 1e-7 deg is about 1 cm, the series of TransverseMercator are exact
+        # to well below that within a zone
+        assert error < 1e-7, '{} round trip error {:.1e} deg'.format(name,
+                                                                     error)
+        if name == 'LocalMercator':
+            difference = max(
+                max(abs(x + projection.x0 - x0) for x, x0 in zip(xs, xm)),
+                max(abs(y + projection.y0 - y0) for y, y0 in zip(ys, ym)))
+            print('    parity with Mercator + origin {:.1e} m'.format(
+                difference))
+            assert difference < 1e-6, 'LocalMercator differs from Mercator'
+
+    cn_tower = osmlib.TransverseMercator.utm(17).degreesToMeter(43.642567,
+                                                                -79.387139)
+    print('  CN Tower UTM 17 {:.1f} E {:.1f} N, published 630084 E 4833438 N'
+          .format(*cn_tower))
+    # the published coordinates are rounded to metres
+    assert abs(cn_tower[0] - 630084) < 1 and abs(cn_tower[1] - 4833438) < 1, \
+        'CN Tower is {:.1f} E {:.1f} N in UTM zone 17'.format(*cn_tower)
+
+
+class LegacyOsmUnit(object):
+    """OsmGeometry.OsmUnit as it was before unitToMeter, for comparison."""
+
+
+    units = {'m': 1, 'km': 1000, 'mi': 1609.344, 'nmi': 1852,
+                    'feet': 0.3048, 'inch': 0.0254}
+
+
+    def __init__(self, txt):
+        self.txt = str(txt)
+
+
+    def regex_match(self, regex):
+        match = re.search(regex, self.txt)
+        return match.groups() if match else None
+
+
+    def unit_prefix(self):
+        if "'" in self.txt and '"' in self.txt:
+            return 'feet'
+        elif "'" in self.txt:
+            return 'feet'
+        elif '"' in self.txt:
+            return 'inch'
+        else:
+            match = self.regex_match(r'([A-Za-z]{1,3})')
+            if match and match[0] in self.units:
+                key = match[0]
+                value = self.units[key]
+                return key
+        return ''
+
+
+    def unit_conversion(self, value, unit):
+        if unit in self.units:
+            fac = self.units[unit]
+            value_meter = value * fac
+            return value_meter
+        else:
+            # 'unit not definded'
+            return value
+
+
+    def txt_2_float(self, unit):
+        if unit == 'feet' or unit ==  'inches':
+            match = self.regex_match(r'(\d{0,})\'?\"?(\d{0,})')
+
+            if match[0] and match[1]:
+                ft = float(match[0])
+                inches = float(match[1])
+                ft = ft + inches * 1.0 / 12.0
+                return ft
+
+            elif match[0]:
+                ft = float(match[0])
+                return ft
+
+            elif match[1]:
+                inches = float(match[1])
+                ft = inches * 1.0 / 12.0
+                return ft
+
+            else:
+                return 0.0
+
+        else:
+            chars = re.findall(r'[A-Za-z]', self.txt)
+            chars.extend(["'", "''", '"', ' '])
+            for c in chars:
+                self.txt = self.txt.replace(c, '')
+            self.txt = self.txt.replace(',', '.')
+
+            try:
+                return float(self.txt)
+            except:
+                return 0.0
+
+
+    def get(self):
+        unit = self.unit_prefix() # feet, inch, m, ...
+        value = self.txt_2_float(unit)
+        value_meter = self.unit_conversion(value, unit)
+        return value_meter
+
+
+def height_corpus(count, seed=0):
+    """Height and level tag values like in a city: few distinct strings,
+    mostly plain meters and levels, some with units, feet and typos."""
+
+    rng = random.Random(seed)
+    vocabulary = ([str(h) for h in range(2, 120)] +
+                  ['{} m'.format(h) for h in range(2, 60)] +
+                  ['{}.5'.format(h) for h in range(2, 40)] +
+                  ['{},5'.format(h) for h in range(2, 20)] +
+                  ["{}'".format(f) for f in range(10, 200, 5)] +
+                  ["{}'{}\"".format(f, i) for f in range(10, 60, 5)
+                   for i in range(0, 12, 3)] +
+                  ['{} ft'.format(f) for f in range(10, 200, 10)] +
+                  ['approx. 10', '10-12', 'ca 15 m', '~20', ''])
+    # Zipf-like: low ranks dominate
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    return rng.choices(vocabulary, weights, k=count), len(vocabulary)
+
+
+def bench_units(count=1000000):
+    """Tag value to meter conversion: OsmUnit as before, the compiled
+    parser alone and memoized, on a realistic corpus."""
+
+    corpus, distinct = height_corpus(count)
+    print('units | {} values, {} distinct'.format(count, distinct))
+    results = []
+    for name, convert in [('OsmUnit before', lambda t: LegacyOsmUnit(t).get()),
+                          ('parseUnit', osmlib.parseUnit),
+                          ('unitToMeter', osmlib.unitToMeter)]:
+        start = time.perf_counter()
+        results.append([convert(value) for value in corpus])
+        elapsed = time.perf_counter() - start
+        print('  {:<15} {:>7.3f} s  {:>6.2f} us/value'.format(
+            name, elapsed, 1e6 * elapsed / count))
+    print('  parity with OsmUnit before: {}'.format(
+        results[0] == results[1] == results[2]))
+
+
+class IndexedWay(object):
+    """A way with tags and projected points, standing in for an OsmGeometry
+    way in the index benchmark."""
+
+    def __init__(self, tags, points):
+        self.tags = tags
+        self.points = points
+
+
+def synthetic_ways(count, extent=30000.0, roads=0.1, seed=0):
+    """Buildings as closed rectangles and roads as polylines scattered over
+    extent x extent meters, with their bounding boxes."""
+
+    rng = random.Random(seed)
+    ways, boxes = [], []
+    for _ in range(count):
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+        if rng.random() < roads:
+            points = [(x, y)]
+            for _ in range(rng.randint(2, 7)):
+                x += rng.uniform(-80, 80)
+                y += rng.uniform(-80, 80)
+                points.append((x, y))
+            way = IndexedWay({'highway': 'residential'}, points)
+        else:
+            w, h = rng.uniform(8, 40), rng.uniform(8, 40)
+            points = [(x, y), (x + w, y), (x + w, y + h), (x, y + h), (x, y)]
+            way = IndexedWay({'building': 'yes'}, points)
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        ways.append(way)
+        boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    return ways, boxes
+
+
+def _scan_box(ways, boxes, box):
+    return [way for way, b in zip(ways, boxes) if b[0] <= box[2] and
+            b[2] >= box[0] and b[1] <= box[3] and b[3] >= box[1]]
+
+
+def _scan_nearest(ways, x, y, k, where):
+    distances = [(osmlib.distanceToPolylines(x, y, [way.points]), i)
+                 for i, way in enumerate(ways) if where(way)]
+    return [ways[i] for _, i in sorted(distances)[:k]]
+
+
+def bench_index(count=1000000, queries=1000, scans=5, extent=30000.0):
+    """Query latency of SpatialIndex vs. a linear scan over the ways:
+    parcel and district boxes, points in buildings, the nearest road.
+
+    Checks first that only closed geometry contains a point."""
+
+    # only closed geometry contains points: a road through a box doesn't, a
+    # ring split over two ways of a relation does
+    geometry = {'road': [[(0.0, 0.0), (10.0, 10.0)]],
+                'building': [[(0.0, 0.0), (4.0, 0.0), (4.0, 10.0), (0.0, 10.0),
+                              (0.0, 0.0)]],
+                'relation': [[(20.0, 0.0), (30.0, 0.0), (30.0, 10.0)],
+                             [(30.0, 10.0), (20.0, 10.0), (20.0, 0.0)]]}
+    small = osmlib.SpatialIndex(
+        list(geometry), [(0, 0, 10, 10), (0, 0, 4, 10), (20, 0, 30, 10)],
+        geometry.get)
+    assert small.atPoint(1.0, 5.0) == ['building'], small.atPoint(1.0, 5.0)
+    assert small.atPoint(8.0, 5.0) == [], small.atPoint(8.0, 5.0)
+    assert small.atPoint(25.0, 5.0) == ['relation'], small.atPoint(25.0, 5.0)
+    assert small.nearest(8.0, 5.0)[0][1] == 'road', small.nearest(8.0, 5.0)
+
+    ways, boxes = synthetic_ways(count, extent)
+    start = time.perf_counter()
+    index = osmlib.SpatialIndex(ways, boxes, lambda way: [way.points])
+    built = time.perf_counter() - start
+    print('index | {} ways over {:.0f} km2, built in {:.2f} s'.format(
+        count, extent * extent / 1e6, built))
+
+    rng = random.Random(1)
+    def box(size):
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+        return (x, y, x + size, y + size)
+    parcels = [box(100.0) for _ in range(queries)]
+    districts = [box(1000.0) for _ in range(queries)]
+    points = [(rng.uniform(0, extent), rng.uniform(0, extent))
+              for _ in range(queries)]
+    is_road = lambda way: 'highway' in way.tags
+
+    cases = [
+        ('box 100 m', lambda q: index.inBox(*q),
+         lambda q: _scan_box(ways, boxes, q), parcels),
+        ('box 1 km', lambda q: index.inBox(*q),
+         lambda q: _scan_box(ways, boxes, q), districts),
+        ('point in building', lambda q: index.atPoint(*q),
+         lambda q: [w for w in _scan_box(ways, boxes, q + q)
+                    if osmlib.closedPolylines([w.points]) and
+                    osmlib.pointInPolylines(q[0], q[1], [w.points])],
+         points),
+        ('nearest road', lambda q: [w for _, w in index.nearest(*q, k=1,
+                                                               where=is_road)],
+         lambda q: _scan_nearest(ways, q[0], q[1], 1, is_road), points),
+        ('10 nearest', lambda q: [w for _, w in index.nearest(*q, k=10)],
+         lambda q: _scan_nearest(ways, q[0], q[1], 10, lambda w: True),
+         points)]
+    for name, query, scan, arguments in cases:
+        start = time.perf_counter()
+        found = [query(q) for q in arguments]
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = [scan(q) for q in arguments[:scans]]
+        scanned = time.perf_counter() - start
+        same = all(sorted(map(id, a)) == sorted(map(id, b))
+                   for a, b in zip(found, expected))
+        print('  {:<18} {:>9.1f} us/query  {:>7.1f} found | scan {:>9.1f} '
+              'us/query  parity {}'.format(
+                  name, 1e6 * elapsed / len(arguments),
+                  sum(map(len, found)) / float(len(found)),
+                  1e6 * scanned / scans, same))
+
+    start = time.perf_counter()
+    index.inBoxes(parcels)
+    elapsed = time.perf_counter() - start
+    print('  inBoxes {} parcels {:>7.3f} s'.format(len(parcels), elapsed))
+
+
+def bench_geometry(megabytes=100):
+    """The pure-data phase of OsmGeometry (classification, heights, way
+    coordinates, ring closure) against the per-way NodeStore lookups the
+    Rhino phase did before."""
+
+    osmxml = osmlib.OsmXmlFileParser(synthetic_osm(megabytes), {})
+    osmobj = osmlib.OsmObjects(osmxml)
+    xs, ys = osmlib.Mercator.degreesToMeterArrays(*osmxml.nodes.arrays()[1:])
+    ways = len(osmobj.ways) + sum(len(r.ways) for r in osmobj.relations)
+    print('geometry | {} MB, {} ways'.format(megabytes, ways))
+
+    def before():
+        # what OsmGeometry and getExtrusions did way by way
+        index = osmxml.nodes.index
+        results = []
+        for way, relation, _ in entries:
+            tags = way.tags
+            geom_attr = osmlib.geometryAttributes(tags)
+            if relation is not None:
+                geom_attr = osmlib.geometryAttributes(relation.tags)
+                geom_attr.update(osmlib.geometryAttributes(tags))
+            coordinates = []
+            for node_id in way.node_refs:
+                i = index(node_id)
+                if i >= 0:
+                    coordinates.append((xs[i], ys[i]))
+            results.append((geom_attr, osmlib.geometryHeights(geom_attr),
+                            coordinates))
+        return results
+
+    entries = osmlib.prepareGeometry(osmxml, osmobj, xs, ys)
+    start = time.perf_counter()
+    expected = before()
+    serial = time.perf_counter() - start
+    print('  {:<12} {:>7.3f} s  {:>6.1f} us/way'.format(
+        'before', serial, 1e6 * serial / ways))
+
+    start = time.perf_counter()
+    with osmlib.frozenGc(): # like OsmGeometry
+        data = [d for _, _, d in osmlib.prepareGeometry(osmxml, osmobj, xs, ys)]
+    elapsed = time.perf_counter() - start
+    same = [(a, h, list(zip(c[0::2], c[1::2])))
+            for _, a, h, c, _ in data] == expected
+    print('  {:<12} {:>7.3f} s  {:>6.1f} us/way  x{:.1f}  parity {}'.format(
+        'prepared', elapsed, 1e6 * elapsed / ways, serial / elapsed, same))
+    assert same, 'prepareGeometry differs from the per-way lookups'
+
+
+class DictNode(object):
+    """A node as osmlib stored it before NodeStore, for comparison."""
+
+    def __init__(self, latitude, longitude, attributes, tags):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.attributes = attributes
+        self.tags = tags
+
+
+def _traced_bytes(build):
+    """Bytes still allocated by the object build() returns."""
+
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def bench_nodes(count=1000000, lookups=200000, tagged=0.05, megabytes=5):
+    """Bytes per node and lookup speed: dict of Node objects vs. NodeStore.
+
+    A fraction tagged of the nodes carries one tag, like POIs in a city.
+    Then the memory of parsing a synthetic city and of OsmObjects, which
+    must not materialize more than its output nodes.
+    """
+
+    rng = random.Random(0)
+    ids = [rng.randrange(1, 1 << 33) for _ in range(count)]
+    ids.sort()
+    coordinates = [(47 + rng.random(), 8 + rng.random()) for _ in range(count)]
+    has_tag = [rng.random() < tagged for _ in range(count)]
+
+    def build_dict():
+        nodes = {}
+        for node_id, (lat, lon), tag in zip(ids, coordinates, has_tag):
+            nodes[node_id] = DictNode(lat, lon, None,
+                                      {'amenity': 'bench'} if tag else {})
+        return nodes
+
+    def build_store():
+        nodes = osmlib.OsmXmlFileParser.NodeStore()
+        for node_id, (lat, lon), tag in zip(ids, coordinates, has_tag):
+            nodes.add(node_id, lat, lon, None,
+                      {'amenity': 'bench'} if tag else {})
+        return nodes
+
+    queries = [rng.choice(ids) for _ in range(lookups)]
+    print('nodes | {} nodes, {:.0%} tagged'.format(count, tagged))
+    for name, build, lookup in [
+            ('dict of Node', build_dict, lambda nodes, i: nodes.get(i).latitude),
+            ('NodeStore', build_store, lambda nodes, i: nodes.location(i)[0])]:
+        size, nodes = _traced_bytes(build)
+        for _ in range(2): # the first pass warms up caches
+            start = time.perf_counter()
+            for node_id in queries:
+                lookup(nodes, node_id)
+            elapsed = time.perf_counter() - start
+        print('  {:<14} {:>7.1f} bytes/node  lookup {:>6.2f} us'.format(
+            name, size / count, 1e6 * elapsed / lookups))
+        if name == 'dict of Node':
+            dict_size = size / count
+        del nodes
+
+    path = synthetic_osm(megabytes)
+    tracemalloc.start()
+    osm = osmlib.OsmXmlFileParser(path, backend='expat')
+    parsed, _ = tracemalloc.get_traced_memory()
+    objects = osmlib.OsmObjects(osm)
+    total, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(osm.nodes)
+    output = set(node.id for node in objects.nodes)
+    output.update(node.id for r in objects.relations for node in r.nodes)
+    print('  {} MB city, {} nodes: parsed {:.1f} MB, with OsmObjects {:.1f} '
+          'MB, {:.1f} bytes/node, {} Node objects for {} output nodes'.format(
+              megabytes, count, parsed / 1e6, total / 1e6,
+              (total - parsed) / count, len(osm.nodes.objects), len(output)))
+    assert len(osm.nodes.objects) == len(output), \
+        'OsmObjects created Node objects of nodes it does not output'
+    assert (total - parsed) / count < dict_size, \
+        'OsmObjects takes more memory per node than a dict of Node objects'
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+    sub = subparsers.add_parser('parse')
+    sub.add_argument('--sizes', type=int, nargs='+', default=[100])
+    sub.add_argument('--backend', default='expat')
+    sub = subparsers.add_parser('nodes')
+    sub.add_argument('--nodes', type=int, default=1000000)
+    sub.add_argument('--size', type=int, default=5)
+    sub = subparsers.add_parser('pbf')
+    sub.add_argument('--sizes', type=int, nargs='+', default=[100])
+    sub.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    sub = subparsers.add_parser('select')
+    sub.add_argument('--size', type=int, default=100)
+    sub.add_argument('--fraction', type=float, default=0.01)
+    sub = subparsers.add_parser('relations')
+    sub.add_argument('--relations', type=int, nargs='+',
+                     default=[25000, 50000, 100000])
+    sub = subparsers.add_parser('project')
+    sub.add_argument('--nodes', type=int, default=10000000)
+    sub.add_argument('--size', type=int, default=20)
+    sub = subparsers.add_parser('projections')
+    sub.add_argument('--nodes', type=int, default=2000000)
+    sub = subparsers.add_parser('units')
+    sub.add_argument('--values', type=int, default=1000000)
+    sub = subparsers.add_parser('geometry')
+    sub.add_argument('--size', type=int, default=100)
+    sub = subparsers.add_parser('index')
+    sub.add_argument('--ways', type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.benchmark == 'parse':
+        bench_parse(args.sizes, args.backend)
+    elif args.benchmark == 'nodes':
+        bench_nodes(args.nodes, megabytes=args.size)
+    elif args.benchmark == 'pbf':
+        bench_pbf(args.sizes, args.workers)
+    elif args.benchmark == 'select':
+        bench_select(args.size, args.fraction)
+    elif args.benchmark == 'relations':
+        bench_relations(args.relations)
+    elif args.benchmark == 'project':
+        bench_project(args.nodes, args.size)
+    elif args.benchmark == 'projections':
+        bench_projections(args.nodes)
+    elif args.benchmark == 'units':
+        bench_units(args.values)
+    elif args.benchmark == 'geometry':
+        bench_geometry(args.size)
+    elif args.benchmark == 'index':
+        bench_index(args.ways)
+    else:
+        parser.print_help()
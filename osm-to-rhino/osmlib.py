@@ -1,28 +1,152 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=E1101
 
-import clr
-clr.AddReferenceByPartialName('System.Xml')
-clr.AddReferenceByPartialName('System.IO')
-clr.AddReferenceByPartialName('RhinoPythonHost')
-clr.AddReferenceByPartialName('Grasshopper')
-from System.Xml import XmlReader, XmlNodeType
-from System.IO import File
+import gc
+import os
 import re
 import math
-import Grasshopper
-import Rhino
-import RhinoPython.Host as _rhinopythonhost
-import scriptcontext
+import struct
+import time
+import heapq
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain
+
+# .NET and Rhino are only available inside Rhino (IronPython). Outside of it,
+# e.g. for batch pre-processing with CPython, OsmXmlFileParser falls back to
+# its pure-Python backend and everything Rhino specific is unavailable.
+try:
+    import clr
+    clr.AddReferenceByPartialName('System.Xml')
+    clr.AddReferenceByPartialName('System.IO')
+    from System.Xml import XmlReader, XmlReaderSettings, XmlNodeType
+    from System.IO import File
+except ImportError:
+    XmlReader = None
+
+try:
+    clr.AddReferenceByPartialName('RhinoPythonHost')
+    clr.AddReferenceByPartialName('Grasshopper')
+    import Grasshopper
+    import Rhino
+    import RhinoPython.Host as _rhinopythonhost
+    import scriptcontext
+except (ImportError, NameError, IOError):
+    Grasshopper = Rhino = _rhinopythonhost = scriptcontext = None
+
+# numpy vectorizes bulk work where available (CPython), IronPython has none
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# dict.iteritems on IronPython 2.7, dict.items on CPython 3
+iteritems = getattr(dict, 'iteritems', dict.items)
+
+# osm ids exceed 32 bit; without 64 bit integer arrays (CPython 2) doubles
+# store them exactly up to 2**53
+try:
+    array('q')
+    ID_TYPECODE = 'q'
+except ValueError:
+    ID_TYPECODE = 'd'
+
+
+def pointInPolygon(lat, lon, polygon):
+    # even-odd rule, polygon is a list of (lat, lon)
+    inside = False
+    lat1, lon1 = polygon[-1]
+    for lat2, lon2 in polygon:
+        if (lat1 > lat) != (lat2 > lat):
+            if lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                inside = not inside
+        lat1, lon1 = lat2, lon2
+    return inside
+
+
+def pointInPolylines(x, y, polylines):
+    # even-odd rule over the edges of all polylines [[(x, y), ...], ...],
+    # e.g. closed ways, or the ways of a multipolygon forming its rings
+    inside = False
+    for points in polylines:
+        x1, y1 = points[0]
+        for x2, y2 in points[1:]:
+            if (y1 > y) != (y2 > y):
+                if x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+            x1, y1 = x2, y2
+    return inside
+
+
+def closedPolylines(polylines):
+    # whether polylines enclose an area: each one is a closed ring, or, like
+    # the ways of a multipolygon, their open ends join into rings
+    ends = {}
+    for points in polylines:
+        if len(points) > 3 and points[0] == points[-1]:
+            continue
+        elif len(points) < 2 or points[0] == points[-1]:
+            return False
+        for point in (points[0], points[-1]):
+            ends[point] = ends.get(point, 0) + 1
+    return all(count % 2 == 0 for count in ends.values())
+
+
+def distanceToPolylines(x, y, polylines):
+    # shortest distance from x, y to the segments of polylines
+    best = float('inf')
+    for points in polylines:
+        x1, y1 = points[0]
+        if len(points) == 1:
+            best = min(best, math.hypot(x - x1, y - y1))
+        for x2, y2 in points[1:]:
+            dx, dy = x2 - x1, y2 - y1
+            length = dx * dx + dy * dy
+            t = ((x - x1) * dx + (y - y1) * dy) / length if length else 0.0
+            t = min(max(t, 0.0), 1.0)
+            best = min(best, math.hypot(x - x1 - t * dx, y - y1 - t * dy))
+            x1, y1 = x2, y2
+    return best
 
 
 class OsmXmlFileParser(object):
+    """Read nodes, ways and relations of an .osm xml file.
 
+    Three backends produce the same nodes, ways and relations:
 
-    def __init__(self, fileloc=None, options={}, progress=None):
+        'dotnet' -- System.Xml.XmlReader, inside Rhino (IronPython).
+        'expat' -- Streaming xml.parsers.expat, e.g. CPython outside Rhino.
+                   No element tree is built, memory holds only the
+                   retained entities.
+        'pbf' -- .osm.pbf files, see decodePbfBlob(). Blocks are decoded
+                 in this process, or by `workers` processes (CPython) if
+                 more than one is asked for; None uses all cores.
+
+    The default backend is 'pbf' for .pbf files, otherwise 'dotnet' where
+    .NET is available, else 'expat'.
+
+    The options 'bbox', 'polygon', 'tag_filter' and 'ids' load only a
+    selection of the file, see Selection. By default the file is read once
+    and the entities the selection does not retain are dropped afterwards.
+    With 'selection_passes' the ids to retain are collected in passes over
+    the file first, so memory is proportional to the selection, at the
+    cost of reading the file two or more times.
+    """
+
+    backends = ('dotnet', 'expat', 'pbf')
+    chunk_size = 1 << 20 # bytes fed to expat at once
+    check_interval = 10000 # elements between escape key and progress checks
+
+
+    def __init__(self, fileloc=None, options={}, progress=None, backend=None,
+                 workers=1):
         self.file_location = fileloc
         self.bounds = self.Bounds()
-        self.nodes = {}
+        self.nodes = self.NodeStore()
         self.ways = {}
         self.relations = {}
         self.options = {'load_nodes': True, # <node>
@@ -39,160 +163,324 @@ class OsmXmlFileParser(object):
                         'load_changeset_attr': False,
                         'load_timestamp_attr': False,
                         'load_user_attr': False,
-                        'load_uid_attr': False
+                        'load_uid_attr': False,
+                        # selective loading, see Selection
+                        'bbox': None, # (minlat, minlon, maxlat, maxlon)
+                        'polygon': None, # [(lat, lon), ...]
+                        'tag_filter': None, # {key: True or [values]}
+                        'ids': None, # {'node'|'way'|'relation': [ids]}
+                        'selection_passes': False # low memory, slower
                         }
         self.options.update(options)
         self.progress = progress
+        self.workers = workers # pbf only; 1 no processes, None all cores
+        if backend is None and fileloc and fileloc.lower().endswith('.pbf'):
+            backend = 'pbf'
+        elif backend is None:
+            backend = 'dotnet' if XmlReader is not None else 'expat'
+        if backend not in self.backends:
+            raise ValueError('unknown backend {}'.format(backend))
+        self.backend = backend
+        self.aborted = False
         self.__read()
 
 
-    def __readAttr(self, xml, attr_name):
-        if xml.HasAttributes and xml.MoveToAttribute(attr_name):
-            attr_value = xml.Value
-            xml.MoveToElement()
-            return attr_value
+    def __escapePressed(self):
+        if scriptcontext is None:
+            return False
+        elif scriptcontext.id == 1:
+            return _rhinopythonhost.EscapePressed(reset=True)
+        elif scriptcontext.id == 2:
+            return Grasshopper.Kernel.GH_Document.IsEscapeKeyDown()
+        return False
 
 
-    def __readOsmSubtreeEntities(self, xml):
-        way_nodes = [] # list datatype to keep order of osm nodes
-        rel_members = [] # list datatype to keep order of osm members
-        tags = {}
+    def __readOsmEntities(self, xml, handler):
+        # single forward pass over all elements, no subtree readers
+        start, end, wanted = handler.start, handler.end, handler.wanted
+        element, end_element = XmlNodeType.Element, XmlNodeType.EndElement
+        interval = self.check_interval
+        count = 0
 
-        inner = xml.ReadSubtree()
-        while inner.Read():
-            if inner.Name in ('nd', 'member', 'tag') and \
-                    inner.NodeType == XmlNodeType.Element:
+        while xml.Read():
+            node_type = xml.NodeType
+
+            if node_type == element:
+                name = xml.Name
+                # attributes are read once, and only for retained elements
+                if handler.entity is not None or name in wanted:
+                    attrs = {}
+                    if xml.MoveToFirstAttribute():
+                        attrs[xml.Name] = xml.Value
+                        while xml.MoveToNextAttribute():
+                            attrs[xml.Name] = xml.Value
+                        xml.MoveToElement()
+                    start(name, attrs)
+                    if xml.IsEmptyElement:
+                        end(name)
+
+                # escape key and progress only every check_interval elements
+                count += 1
+                if count % interval == 0:
+                    if self.__escapePressed():
+                        print('loading aborted')
+                        self.__dispose()
+                        return
+                    if self.progress:
+                        self.progress.updateFromFilestream()
+
+            elif node_type == end_element:
+                end(xml.Name)
 
-                if inner.Name == 'nd':
-                    ref_id = int(self.__readAttr(xml, 'ref'))
-                    way_nodes.append(ref_id)
+        if self.progress:
+            self.progress.updateFromFilestream()
 
-                elif inner.Name == 'member':
-                    typ = self.__readAttr(xml, 'type')
-                    ref_id = int(self.__readAttr(xml, 'ref'))
-                    role = self.__readAttr(xml, 'role')
-                    rel_members.append(self.RelationMember(typ, ref_id, role))
 
-                elif inner.Name == 'tag':
-                    key = self.__readAttr(xml, 'k')
-                    value = self.__readAttr(xml, 'v')
-                    tags[key] = value
-        inner.Close()
+    def __readExpat(self, handler):
+        from xml.parsers import expat
 
-        if xml.Name == 'node':
-            return {}, tags
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = handler.start
+        parser.EndElementHandler = handler.end
 
-        elif xml.Name == 'way':
-            return way_nodes, tags
+        with open(self.file_location, 'rb') as filestream:
+            size = os.fstat(filestream.fileno()).st_size
+            while handler.valid is not False:
+                chunk = filestream.read(self.chunk_size)
+                parser.Parse(chunk, not chunk)
+                if not chunk:
+                    break
+                if self.progress:
+                    self.progress.update(100.0 * filestream.tell() / max(size, 1))
 
-        elif xml.Name == 'relation':
-            return rel_members, tags
+        if not handler.valid:
+            print('Osm file is not valid. No <osm> element found.\n')
+            self.nodes.clear()
+            self.ways.clear()
+            self.relations.clear()
 
 
-    def __readOsmEntities(self, xml):
+    def __read(self):
         # self.load_nodes looks better than self.options['load_nodes']
-        for key, value in self.options.iteritems():
+        for key, value in iteritems(self.options):
             setattr(self, key, value)
 
-        # read xml element; bounds
-        while xml.Read():
-            if xml.IsStartElement('bounds'):
-                self.bounds = self.Bounds(
-                    minlat=float(self.__readAttr(xml, 'minlat')),
-                    minlon=float(self.__readAttr(xml, 'minlon')),
-                    maxlat=float(self.__readAttr(xml, 'maxlat')),
-                    maxlon=float(self.__readAttr(xml, 'maxlon'))
-                )
-            break # bounds element exist only once.
+        keep = None
+        selective = any(getattr(self, key) is not None
+                        for key in self.Selection.options)
+        # without tags and members the loaded entities can't be selected
+        subtrees = self.load_node_subtree and self.load_way_subtree and \
+            self.load_relation_subtree
+        if selective and (self.selection_passes or not subtrees):
+            keep = self.__select(self.__readSelection)
+            if keep is None:
+                return
 
-        # read xml elements; node, way, relation
-        while xml.Read():
+        if self.backend == 'pbf':
+            self.__readPbf(lambda block: self.__addPbfBlock(block, keep),
+                           self.options)
+        else:
+            self.__readXml(self.EntityHandler(self, keep))
+
+        if selective and keep is None and not self.aborted:
+            keep = self.__select(self.__selectLoaded)
+            self.__retain(keep)
+
+        if keep is not None and keep.bbox is not None and not self.aborted:
+            self.bounds = self.Bounds(*keep.bbox)
+
+
+    def __select(self, selectionPass):
+        # selection passes until the ids to retain are resolved
+        selection = self.Selection(self.bbox, self.polygon, self.tag_filter,
+                                   self.ids)
+        while True:
+            selectionPass(selection)
+            if self.aborted:
+                return None
+            if selection.resolve():
+                return selection
+
+
+    def __readSelection(self, selection):
+        # a selection pass over the file, after the first one only missing
+        # ways and relation members are read again
+        options = dict(self.options, load_node_subtree=True,
+                       load_way_subtree=True, load_relation_subtree=True,
+                       load_additional_attr=False)
+        if selection.resolving:
+            options.update(load_nodes=False,
+                           load_ways=bool(selection.missing_ways),
+                           load_relations=bool(selection.missing_relations))
+        if self.backend == 'pbf':
+            self.__readPbf(selection.addBlock, options)
+        else:
+            self.__readXml(self.SelectionHandler(self, selection))
+
+
+    def __selectLoaded(self, selection):
+        # a selection pass over the loaded entities instead of the file
+        ways, relations = self.ways, self.relations
+        if selection.resolving:
+            ways = dict((way_id, ways[way_id])
+                        for way_id in selection.missing_ways if way_id in ways)
+            relations = dict((rel_id, relations[rel_id])
+                             for rel_id in selection.missing_relations
+                             if rel_id in relations)
+        else:
+            ids, lats, lons = self.nodes.arrays()
+            get, node, empty = self.nodes.tags.get, selection.node, {}
+            for i, node_id in enumerate(ids):
+                node(node_id, lats[i], lons[i], get(node_id, empty))
+        for way_id, way in iteritems(ways):
+            selection.way(way_id, way.node_refs, way.tags)
+        for relation_id, relation in iteritems(relations):
+            selection.relation(relation_id, [(m.typ, m.ref_id)
+                                             for m in relation.members],
+                               relation.tags)
+
+
+    def __retain(self, keep):
+        # drop the loaded entities keep does not retain
+        nodes, wanted = self.nodes, keep.nodes
+        ids, lats, lons = nodes.arrays()
+        index = [i for i, node_id in enumerate(ids) if node_id in wanted]
+        self.nodes = self.NodeStore()
+        self.nodes.extend(array(ID_TYPECODE, [ids[i] for i in index]),
+                          array('d', [lats[i] for i in index]),
+                          array('d', [lons[i] for i in index]),
+                          dict((k, v) for k, v in iteritems(nodes.tags)
+                               if k in wanted),
+                          dict((k, v) for k, v in iteritems(nodes.attributes)
+                               if k in wanted))
+        self.ways = dict((k, v) for k, v in iteritems(self.ways)
+                         if k in keep.ways)
+        self.relations = dict((k, v) for k, v in iteritems(self.relations)
+                              if k in keep.relations)
+
+
+    def __readXml(self, handler):
+        if self.backend == 'expat':
+            self.__readExpat(handler)
+        else:
+            self.__readDotNet(handler)
 
-            if scriptcontext.id == 1 and _rhinopythonhost.EscapePressed(reset=True):
-                print('loading aborted')
-                self.__dispose()
-                break
-            elif scriptcontext.id == 2 and Grasshopper.Kernel.GH_Document.IsEscapeKeyDown():
-                print('loading aborted')
-                self.__dispose()
-                break
 
-            for entity in ['node', 'way', 'relation']:
-                if xml.IsStartElement(entity):
-
-                    # --- attributes for all entities; node, way, relation ---
-
-                    if self.load_additional_attr:
-                        attr = self.Attributes()
-
-                        if self.load_visible_attr:
-                            attr.visible = self.__readAttr(xml, 'visible')
-                        if self.load_version_attr:
-                            attr.version = self.__readAttr(xml, 'version')
-                        if self.load_changeset_attr:
-                            attr.changeset = self.__readAttr(xml, 'changeset')
-                        if self.load_timestamp_attr:
-                            attr.timestamp = self.__readAttr(xml, 'timestamp')
-                        if self.load_user_attr:
-                            attr.user = self.__readAttr(xml, 'user')
-                        if self.load_uid_attr:
-                            attr.uid = self.__readAttr(xml, 'uid')
+    def __readPbfBlobs(self, filestream):
+        # fileblocks: length (4 byte, big endian), BlobHeader, Blob
+        while True:
+            length = filestream.read(4)
+            if len(length) < 4:
+                break
+            header = bytearray(filestream.read(struct.unpack('!I', length)[0]))
+            blob_type, datasize = None, 0
+            for field, _, value in pbfFields(header, 0, len(header)):
+                if field == 1:
+                    blob_type = header[value[0]:value[1]].decode('utf-8')
+                elif field == 3:
+                    datasize = value
+            yield blob_type, filestream.read(datasize)
+
+
+    def __addPbfBlock(self, block, keep=None):
+        # keep: Selection of the entities to retain, None retains all
+        bounds, nodes, ways, relations = block
+        Attributes, RelationMember = self.Attributes, self.RelationMember
+        if bounds:
+            self.bounds = self.Bounds(*bounds)
+        if nodes:
+            ids, lats, lons, tags, attrs, ascending = nodes
+            if keep is not None:
+                wanted = keep.nodes
+                index = [i for i, node_id in enumerate(ids) if node_id in wanted]
+                ids = array(ID_TYPECODE, [ids[i] for i in index])
+                lats = array('d', [lats[i] for i in index])
+                lons = array('d', [lons[i] for i in index])
+                tags = dict((k, v) for k, v in iteritems(tags) if k in wanted)
+                attrs = dict((k, v) for k, v in iteritems(attrs) if k in wanted)
+            attrs = dict((k, Attributes(*v)) for k, v in iteritems(attrs))
+            self.nodes.extend(ids, lats, lons, tags, attrs, ascending)
+        for way_id, refs, tags, attr in ways:
+            if keep is not None and way_id not in keep.ways:
+                continue
+            attr = Attributes(*attr) if attr else None
+            self.ways[way_id] = self.Way(refs, attr, tags)
+        for relation_id, members, tags, attr in relations:
+            if keep is not None and relation_id not in keep.relations:
+                continue
+            attr = Attributes(*attr) if attr else None
+            if members:
+                members = [RelationMember(*m) for m in members]
+            self.relations[relation_id] = self.Relation(members, attr, tags)
+
+
+    def __readPbf(self, addBlock, options):
+        # blocks are decoded in worker processes and passed to addBlock here
+        # in file order
+        options = dict((k, v) for k, v in iteritems(options)
+                       if k.startswith('load_'))
+        pool = None
+        workers = 1
+        if self.workers != 1:
+            # processes are opt-in: inside Rhino they would relaunch Rhino
+            try:
+                import multiprocessing
+                workers = self.workers or multiprocessing.cpu_count()
+                if workers > 1:
+                    pool = multiprocessing.Pool(workers)
+            except (ImportError, NotImplementedError, OSError):
+                workers = 1 # IronPython: decode in this process
+        window = 2 * max(workers, 1) # blocks in flight
+
+        with open(self.file_location, 'rb') as filestream:
+            size = os.fstat(filestream.fileno()).st_size
+            pending = deque()
+            count = 0
+            try:
+                for blob_type, blob in self.__readPbfBlobs(filestream):
+                    task = (blob_type, blob, options)
+                    if pool:
+                        pending.append(pool.apply_async(decodePbfBlob, (task,)))
                     else:
-                        attr = None
-
-                    # --- entities node, way, relation ---
-
-                    if entity == 'node':
-                        if self.load_nodes:
-                            element_id = int(self.__readAttr(xml, 'id'))
-                            lat = float(self.__readAttr(xml, 'lat'))
-                            lon = float(self.__readAttr(xml, 'lon'))
-                            if self.load_node_subtree:
-                                _, tags = self.__readOsmSubtreeEntities(xml)
-                                node = self.Node(lat, lon, attr, tags)
-                                self.nodes[element_id] = node
-                            else:
-                                node = self.Node(lat, lon, attr, {})
-                                self.nodes[element_id] = node
-
-                    elif entity == 'way':
-                        if self.load_ways:
-                            element_id = int(self.__readAttr(xml, 'id'))
-                            if self.load_way_subtree:
-                                way_nodes, tags = \
-                                    self.__readOsmSubtreeEntities(xml)
-                                way = self.Way(way_nodes, attr, tags)
-                                self.ways[element_id] = way
-                            else:
-                                self.ways[element_id] = self.Way({}, attr, {})
-
-                    elif entity == 'relation':
-                        if self.load_relations:
-                            element_id = int(self.__readAttr(xml, 'id'))
-                            if self.load_relation_subtree:
-                                rel_members, tags = \
-                                    self.__readOsmSubtreeEntities(xml)
-                                relation = self.Relation(
-                                                        rel_members, attr, tags)
-                                self.relations[element_id] = relation
-                            else:
-                                relation = self.Relation({}, attr, {})
-                                self.relations[element_id] = relation
-
-            self.progress.updateFromFilestream() if self.progress else None
+                        pending.append(decodePbfBlob(task))
+                    while len(pending) > window or (pending and not pool):
+                        block = pending.popleft()
+                        addBlock(block.get() if pool else block)
+
+                    count += 1
+                    if self.__escapePressed():
+                        print('loading aborted')
+                        self.__dispose()
+                        return
+                    if self.progress and count % 10 == 0:
+                        self.progress.update(100.0 * filestream.tell() / max(size, 1))
+                while pending:
+                    addBlock(pending.popleft().get())
+            finally:
+                if pool:
+                    pool.terminate()
+                    pool.join()
 
+        if self.progress:
+            self.progress.update(100)
 
-    def __read(self):
+
+    def __readDotNet(self, handler):
         try:
             filestream = File.OpenRead(self.file_location)
-            xml = XmlReader.Create(filestream)
+            settings = XmlReaderSettings()
+            settings.IgnoreWhitespace = True
+            settings.IgnoreComments = True
+            settings.IgnoreProcessingInstructions = True
+            xml = XmlReader.Create(filestream, settings)
             if self.progress:
                 self.progress.filestream = filestream
         except IOError as e:
             raise e
         else:
             if xml.IsStartElement('osm'):
-                self.__readOsmEntities(xml)
+                handler.valid = True
+                self.__readOsmEntities(xml, handler)
             else:
                 print('Osm file is not valid. No <osm> element found.\n')
         finally:
@@ -202,7 +490,8 @@ class OsmXmlFileParser(object):
 
 
     def __dispose(self):
-        self.nodes = {}
+        self.aborted = True
+        self.nodes = self.NodeStore()
         self.ways = {}
         self.relations = {}
         if self.progress:
@@ -219,6 +508,356 @@ class OsmXmlFileParser(object):
             .format(len(self.nodes), len(self.ways), len(self.relations)))
 
 
+    class EntityHandler(object):
+        """Build nodes, ways and relations from the element events of a
+        backend: start(name, attrs) for every start tag and end(name) for
+        every end tag, including those of empty elements."""
+
+        def __init__(self, osmxml, keep=None):
+            self.osmxml = osmxml
+            # Selection of the ids to retain, None retains everything
+            self.keep = None if keep is None else {'node': keep.nodes,
+                                                   'way': keep.ways,
+                                                   'relation': keep.relations}
+            self.load = {'node': osmxml.load_nodes,
+                         'way': osmxml.load_ways,
+                         'relation': osmxml.load_relations}
+            self.subtree = {'node': osmxml.load_node_subtree,
+                            'way': osmxml.load_way_subtree,
+                            'relation': osmxml.load_relation_subtree}
+            # elements with attributes to read outside of an entity
+            self.wanted = set(k for k, v in iteritems(self.load) if v)
+            self.wanted.add('bounds')
+            # entity being read: [name, id, attr, lat, lon, node_refs or
+            # members, tags], children are skipped while it is None
+            self.entity = None
+            self.valid = None # root element is <osm>
+
+
+        def start(self, name, attrs):
+            entity = self.entity
+            if entity is not None:
+                if name == 'tag':
+                    entity[6][attrs.get('k')] = attrs.get('v')
+                elif name == 'nd':
+                    entity[5].append(int(attrs['ref']))
+                elif name == 'member':
+                    entity[5].append(self.osmxml.RelationMember(
+                        attrs.get('type'), int(attrs['ref']), attrs.get('role')))
+
+            elif name in self.load:
+                if self.load[name]:
+                    if self.keep is not None and \
+                            int(attrs['id']) not in self.keep[name]:
+                        return # children are skipped, entity is None
+                    osmxml = self.osmxml
+                    attr = self.attributes(attrs.get) \
+                        if osmxml.load_additional_attr else None
+                    if name == 'node':
+                        lat, lon = float(attrs['lat']), float(attrs['lon'])
+                    else:
+                        lat = lon = None
+                    if self.subtree[name]:
+                        self.entity = [name, int(attrs['id']), attr, lat, lon,
+                                       [], {}]
+                    else:
+                        self.add(name, int(attrs['id']), attr, lat, lon, {}, {})
+
+            elif name == 'bounds':
+                self.osmxml.bounds = self.osmxml.Bounds(
+                    minlat=float(attrs['minlat']),
+                    minlon=float(attrs['minlon']),
+                    maxlat=float(attrs['maxlat']),
+                    maxlon=float(attrs['maxlon'])
+                )
+
+            elif self.valid is None:
+                self.valid = name == 'osm'
+
+
+        def end(self, name):
+            entity = self.entity
+            if entity is not None and name == entity[0]:
+                self.entity = None
+                self.add(*entity)
+
+
+        def attributes(self, get):
+            # optional attributes of node, way, relation; get(name) -> value
+            osmxml = self.osmxml
+            attr = osmxml.Attributes()
+            if osmxml.load_visible_attr:
+                attr.visible = get('visible')
+            if osmxml.load_version_attr:
+                attr.version = get('version')
+            if osmxml.load_changeset_attr:
+                attr.changeset = get('changeset')
+            if osmxml.load_timestamp_attr:
+                attr.timestamp = get('timestamp')
+            if osmxml.load_user_attr:
+                attr.user = get('user')
+            if osmxml.load_uid_attr:
+                attr.uid = get('uid')
+            return attr
+
+
+        def add(self, name, element_id, attr, lat, lon, children, tags):
+            osmxml = self.osmxml
+            if name == 'node':
+                osmxml.nodes.add(element_id, lat, lon, attr, tags)
+            elif name == 'way':
+                osmxml.ways[element_id] = osmxml.Way(children, attr, tags)
+            else:
+                osmxml.relations[element_id] = \
+                    osmxml.Relation(children, attr, tags)
+
+
+    class SelectionHandler(EntityHandler):
+        """Pass the entities of a selection pass to a Selection instead of
+        retaining them."""
+
+        def __init__(self, osmxml, selection):
+            OsmXmlFileParser.EntityHandler.__init__(self, osmxml)
+            self.selection = selection
+            self.subtree = dict.fromkeys(self.subtree, True)
+            if selection.resolving:
+                # later passes only read missing ways and relation members
+                self.load['node'] = False
+                self.load['way'] = bool(selection.missing_ways)
+                self.load['relation'] = bool(selection.missing_relations)
+                self.wanted = set(k for k, v in iteritems(self.load) if v)
+                self.wanted.add('bounds')
+
+
+        def attributes(self, get):
+            return None
+
+
+        def add(self, name, element_id, attr, lat, lon, children, tags):
+            selection = self.selection
+            if name == 'node':
+                selection.node(element_id, lat, lon, tags)
+            elif name == 'way':
+                selection.way(element_id, children, tags)
+            else:
+                selection.relation(element_id,
+                                   [(m.typ, m.ref_id) for m in children], tags)
+
+
+    class Selection(object):
+        """Ids of the entities to retain, found in passes over the file.
+
+        An entity is selected if it passes all given filters:
+
+            bbox -- (minlat, minlon, maxlat, maxlon).
+            polygon -- [(lat, lon), ...], a clip area.
+            tag_filter -- {key: True or [values]}, any key with any or one
+                          of the values matches, e.g. {'building': True,
+                          'highway': True}. Or a function tags -> bool.
+            ids -- {'node'|'way'|'relation': [ids]}, a whitelist.
+
+        A node is in the area if it lies in bbox and polygon, a way if one
+        of its nodes is, a relation if one of its members is. Retained are
+        the selected entities and everything they reference: member
+        relations, member ways and all nodes of retained ways, also those
+        outside of the area.
+
+        The first pass records the area and tag matches and the references
+        of possibly retained entities only. Ways and relation members that
+        turn out to be needed later (members of relations selected through
+        the area or member relations) are read in further passes. Members
+        missing from the file are looked for once.
+        """
+
+        options = ('bbox', 'polygon', 'tag_filter', 'ids')
+
+        def __init__(self, bbox=None, polygon=None, tag_filter=None, ids=None):
+            if polygon is not None:
+                polygon = [(float(lat), float(lon)) for lat, lon in polygon]
+                lats, lons = [p[0] for p in polygon], [p[1] for p in polygon]
+                box = (min(lats), min(lons), max(lats), max(lons))
+                if bbox is not None: # intersection
+                    box = (max(box[0], bbox[0]), max(box[1], bbox[1]),
+                           min(box[2], bbox[2]), min(box[3], bbox[3]))
+                bbox = box
+            self.bbox = tuple(float(v) for v in bbox) if bbox else None
+            self.polygon = polygon
+            self.spatial = self.bbox is not None
+
+            if isinstance(tag_filter, dict):
+                wanted = dict((k, None if v is True else set(v))
+                              for k, v in iteritems(tag_filter))
+
+                def tag_filter(tags):
+                    for key, values in iteritems(wanted):
+                        value = tags.get(key)
+                        if value is not None and (values is None or
+                                                  value in values):
+                            return True
+                    return False
+
+            self.matches = tag_filter
+            self.whitelist = None if ids is None else \
+                dict((k, set(v)) for k, v in iteritems(ids))
+
+            # first pass
+            self.inside_nodes = set()
+            self.inside_ways = set()
+            self.inside_relations = set()
+            self.selected_nodes = set()
+            self.selected_ways = set()
+            self.candidates = set() # relations selected unless by the area
+            self.children = {} # relation id -> member relation ids
+            self.refs = {} # way id -> node ids, of possibly retained ways
+            self.members = {} # relation id -> [(type, ref)]
+            # further passes
+            self.resolving = False
+            self.missing_ways = set()
+            self.missing_relations = set()
+            self.searched = set() # (type, id) read for once already
+            # resolved ids to retain
+            self.nodes = self.ways = self.relations = None
+
+
+        def inside(self, lat, lon):
+            minlat, minlon, maxlat, maxlon = self.bbox
+            if not (minlat <= lat <= maxlat and minlon <= lon <= maxlon):
+                return False
+            return self.polygon is None or pointInPolygon(lat, lon, self.polygon)
+
+
+        def selects(self, name, entity_id, tags):
+            if self.whitelist is not None and \
+                    entity_id not in self.whitelist.get(name, ()):
+                return False
+            return self.matches is None or self.matches(tags)
+
+
+        def node(self, node_id, lat, lon, tags):
+            if self.spatial:
+                if not self.inside(lat, lon):
+                    return
+                self.inside_nodes.add(node_id)
+            if self.selects('node', node_id, tags):
+                self.selected_nodes.add(node_id)
+
+
+        def way(self, way_id, refs, tags):
+            if self.resolving:
+                if way_id in self.missing_ways:
+                    self.refs[way_id] = refs
+                return
+            if self.spatial:
+                inside_nodes = self.inside_nodes
+                for ref in refs:
+                    if ref in inside_nodes:
+                        break
+                else:
+                    return
+                self.inside_ways.add(way_id)
+            if self.selects('way', way_id, tags):
+                self.selected_ways.add(way_id)
+                self.refs[way_id] = refs
+            elif self.spatial:
+                self.refs[way_id] = refs # may be a member of a relation
+
+
+        def relation(self, relation_id, members, tags):
+            if self.resolving:
+                if relation_id in self.missing_relations:
+                    self.members[relation_id] = members
+                return
+            children = [ref for typ, ref in members if typ == 'relation']
+            if children:
+                self.children[relation_id] = children
+            inside = False
+            if self.spatial:
+                for typ, ref in members:
+                    if (typ == 'way' and ref in self.inside_ways) or \
+                            (typ == 'node' and ref in self.inside_nodes):
+                        self.inside_relations.add(relation_id)
+                        inside = True
+                        break
+            if self.selects('relation', relation_id, tags):
+                self.candidates.add(relation_id)
+                if inside or children or not self.spatial:
+                    self.members[relation_id] = members
+
+
+        def addBlock(self, block):
+            # a decoded pbf block, see decodePbfBlob
+            _, nodes, ways, relations = block
+            if nodes:
+                ids, lats, lons, tags, _, _ = nodes
+                get, node, empty = tags.get, self.node, {}
+                for i, node_id in enumerate(ids):
+                    node(node_id, lats[i], lons[i], get(node_id, empty))
+            for way_id, refs, tags, _ in ways:
+                self.way(way_id, refs, tags)
+            for relation_id, members, tags, _ in relations:
+                self.relation(relation_id, [(t, r) for t, r, _ in members], tags)
+
+
+        def resolve(self):
+            """Resolve the ids to retain, False if another pass is needed."""
+
+            selected = self.candidates
+            if self.spatial:
+                # relations are in the area if a member relation is
+                inside, changed = self.inside_relations, True
+                while changed:
+                    changed = False
+                    for parent, children in iteritems(self.children):
+                        if parent not in inside and \
+                                any(child in inside for child in children):
+                            inside.add(parent)
+                            changed = True
+                selected = selected & inside
+
+            relations, stack = set(), list(selected)
+            while stack:
+                relation_id = stack.pop()
+                if relation_id not in relations:
+                    relations.add(relation_id)
+                    stack.extend(self.children.get(relation_id, ()))
+
+            ways, nodes = set(self.selected_ways), set(self.selected_nodes)
+            self.missing_relations = set()
+            for relation_id in relations:
+                members = self.members.get(relation_id)
+                if members is None:
+                    if ('relation', relation_id) not in self.searched:
+                        self.missing_relations.add(relation_id)
+                    continue
+                for typ, ref in members:
+                    if typ == 'way':
+                        ways.add(ref)
+                    elif typ == 'node':
+                        nodes.add(ref)
+
+            self.missing_ways = set()
+            for way_id in ways:
+                refs = self.refs.get(way_id)
+                if refs is None:
+                    if ('way', way_id) not in self.searched:
+                        self.missing_ways.add(way_id)
+                else:
+                    nodes.update(refs)
+
+            self.resolving = True
+            if self.missing_ways or self.missing_relations:
+                self.searched.update(('way', i) for i in self.missing_ways)
+                self.searched.update(('relation', i)
+                                     for i in self.missing_relations)
+                return False
+            self.nodes, self.ways, self.relations = nodes, ways, relations
+            # free the first pass
+            self.inside_nodes = self.inside_ways = self.refs = None
+            self.members = self.children = None
+            self.searched = None
+            return True
+
+
     class Bounds(object):
 
         def __init__(self, minlat=0, minlon=0, maxlat=0, maxlon=0):
@@ -247,10 +886,172 @@ class OsmXmlFileParser(object):
 
         def __repr__(self):
             class_vars = vars(self)
-            att = dict((k,v) for k,v in class_vars.iteritems() if v is not None)
+            att = dict((k,v) for k,v in iteritems(class_vars) if v is not None)
             return 'Attributes({})'.format(att)
 
 
+    class NodeStore(object):
+        """Nodes in parallel arrays of ids, latitudes and longitudes.
+
+        About 24 bytes per node instead of a Node object in a dict. Ids are
+        looked up by binary search, a file with unsorted ids is sorted once
+        on the first lookup. Tags and additional attributes are kept only
+        for the nodes that have them. The dict-like access (get, [], in,
+        iteritems) creates Node objects on demand and keeps them, so later
+        lookups return the same object and attributes set on it persist.
+        Way geometry reads the arrays, assign a Node (store[id] = node) to
+        change the location of a node.
+        """
+
+        def __init__(self):
+            self.ids = array(ID_TYPECODE)
+            self.latitudes = array('d')
+            self.longitudes = array('d')
+            self.tags = {} # node id -> tags, tagged nodes only
+            self.attributes = {} # node id -> Attributes
+            self.objects = {} # node id -> Node, the ones handed out
+            self.sorted = True
+
+
+        def add(self, node_id, lat, lon, attributes=None, tags=None):
+            ids = self.ids
+            if ids and node_id <= ids[-1]:
+                self.sorted = False
+            ids.append(node_id)
+            self.latitudes.append(lat)
+            self.longitudes.append(lon)
+            if tags:
+                self.tags[node_id] = tags
+            if attributes is not None:
+                self.attributes[node_id] = attributes
+            if self.objects:
+                self.objects.pop(node_id, None) # replaced node
+
+
+        def extend(self, ids, latitudes, longitudes, tags=None,
+                   attributes=None, ascending=True):
+            # append arrays of nodes, ascending if ids increase within them
+            if not len(ids):
+                return
+            if not ascending or (self.ids and ids[0] <= self.ids[-1]):
+                self.sorted = False
+            self.ids.extend(ids)
+            self.latitudes.extend(latitudes)
+            self.longitudes.extend(longitudes)
+            if tags:
+                self.tags.update(tags)
+            if attributes:
+                self.attributes.update(attributes)
+            if self.objects:
+                for node_id in ids:
+                    self.objects.pop(node_id, None) # replaced nodes
+
+
+        def __sort(self):
+            # stable sort, of duplicate ids the last one wins like in a dict
+            ids = self.ids
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            order = [i for n, i in enumerate(order)
+                     if n + 1 == len(order) or ids[order[n + 1]] != ids[i]]
+            self.ids = array(ID_TYPECODE, [ids[i] for i in order])
+            self.latitudes = array('d', [self.latitudes[i] for i in order])
+            self.longitudes = array('d', [self.longitudes[i] for i in order])
+            self.sorted = True
+
+
+        def index(self, node_id):
+            # position of node_id in the arrays, -1 if not found
+            if not self.sorted:
+                self.__sort()
+            ids = self.ids
+            i = bisect_left(ids, node_id)
+            if i < len(ids) and ids[i] == node_id:
+                return i
+            return -1
+
+
+        def location(self, node_id):
+            # (lat, lon) without creating a Node, None if not found; inlined
+            # index(), this is the lookup of every node ref of every way
+            if not self.sorted:
+                self.__sort()
+            ids = self.ids
+            i = bisect_left(ids, node_id)
+            if i < len(ids) and ids[i] == node_id:
+                return self.latitudes[i], self.longitudes[i]
+
+
+        def arrays(self):
+            # ids, latitudes, longitudes sorted by id; index() positions
+            if not self.sorted:
+                self.__sort()
+            return self.ids, self.latitudes, self.longitudes
+
+
+        def node(self, i):
+            node_id = int(self.ids[i])
+            node = self.objects.get(node_id)
+            if node is None:
+                node = OsmXmlFileParser.Node(self.latitudes[i],
+                                             self.longitudes[i],
+                                             self.attributes.get(node_id),
+                                             self.tags.get(node_id, {}))
+                node.id = node_id
+                self.objects[node_id] = node
+            return node
+
+
+        def get(self, node_id, default=None):
+            i = self.index(node_id)
+            return self.node(i) if i >= 0 else default
+
+
+        def __getitem__(self, node_id):
+            i = self.index(node_id)
+            if i < 0:
+                raise KeyError(node_id)
+            return self.node(i)
+
+
+        def __setitem__(self, node_id, node):
+            self.add(node_id, node.latitude, node.longitude, node.attributes,
+                     node.tags)
+            self.objects[node_id] = node
+
+
+        def __contains__(self, node_id):
+            return self.index(node_id) >= 0
+
+
+        def __len__(self):
+            if not self.sorted:
+                self.__sort()
+            return len(self.ids)
+
+
+        def __iter__(self):
+            if not self.sorted:
+                self.__sort()
+            return (int(node_id) for node_id in self.ids)
+
+
+        def keys(self):
+            return list(self)
+
+
+        def iteritems(self):
+            if not self.sorted:
+                self.__sort()
+            return ((int(self.ids[i]), self.node(i))
+                    for i in range(len(self.ids)))
+
+        items = iteritems
+
+
+        def clear(self):
+            self.__init__()
+
+
     class Node(object):
 
         def __init__(self, latitude, longitude, attributes, tags):
@@ -294,6 +1095,8 @@ class OsmXmlFileParser(object):
 
     class RelationMember(object):
 
+        __slots__ = ('typ', 'ref_id', 'role')
+
         def __init__(self, typ, ref_id, role):
             self.typ = typ
             self.ref_id = ref_id
@@ -305,64 +1108,420 @@ class OsmXmlFileParser(object):
                 .format(self.typ, self.ref_id, self.role)
 
 
+# --- .osm.pbf decoding (protobuf without dependencies) ---
+# https://wiki.openstreetmap.org/wiki/PBF_Format
+# All functions work on bytearray data and return plain, picklable values,
+# so blocks can be decoded in worker processes.
+
+PBF_MEMBER_TYPES = ('node', 'way', 'relation')
+PBF_NO_INFO = (None,) * 6 # attributes of entities without Info
+
+
+def pbfVarint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def pbfInt64(value):
+    # int64 fields are varints of the two's complement
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def pbfFields(data, start, end):
+    # [(field number, wire type, value)], length delimited values are
+    # (start, end) positions in data
+    fields = []
+    pos = start
+    while pos < end:
+        key = data[pos] # field numbers below 16 are a single byte
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = pbfVarint(data, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = pbfVarint(data, pos)
+        elif wire == 2:
+            length = data[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = pbfVarint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('unsupported protobuf wire type {}'.format(wire))
+        fields.append((field, wire, value))
+    return fields
+
+
+def pbfPacked(data, start, end):
+    # packed varints, most of them are single bytes
+    values = []
+    append = values.append
+    pos = start
+    while pos < end:
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            append(b)
+            continue
+        result, shift = b & 0x7f, 7
+        while True:
+            b = data[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values
+
+
+def pbfDelta(data, start, end, signed=True):
+    # packed (zigzag encoded) delta coded values
+    values = []
+    append = values.append
+    current = 0
+    for value in pbfPacked(data, start, end):
+        if signed:
+            value = (value >> 1) ^ -(value & 1)
+        current += value
+        append(current)
+    return values
+
+
+def pbfTags(data, keys, vals, strings):
+    keys = pbfPacked(data, *keys) if keys else []
+    vals = pbfPacked(data, *vals) if vals else []
+    return dict((strings[k], strings[v]) for k, v in zip(keys, vals))
+
+
+def pbfAttributes(options, visible, version, changeset, timestamp, user, uid):
+    # values as strings like in the xml, None if not loaded
+    def load(name, value, convert=str):
+        if options['load_{}_attr'.format(name)] and value is not None:
+            return convert(value)
+
+    return (load('visible', visible, lambda v: 'true' if v else 'false'),
+            load('version', version), load('changeset', changeset),
+            load('timestamp', timestamp, lambda v: time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(v))),
+            load('user', user), load('uid', uid))
+
+
+def pbfInfo(data, info, strings, date_granularity, options):
+    values = {}
+    for field, _, value in pbfFields(data, *info):
+        values[field] = value
+    timestamp = values.get(2)
+    if timestamp is not None:
+        timestamp = pbfInt64(timestamp) * date_granularity // 1000
+    user = values.get(5)
+    return pbfAttributes(options, values.get(6), values.get(1),
+                         values.get(3), timestamp,
+                         strings[user] if user is not None else None,
+                         values.get(4))
+
+
+def pbfDenseNodes(data, dense, block, options):
+    strings, granularity, lat_offset, lon_offset, date_granularity = block
+    ids, lats, lons, keys_vals, info = [], [], [], None, None
+    for field, _, value in pbfFields(data, *dense):
+        if field == 1:
+            ids = pbfDelta(data, *value)
+        elif field == 8:
+            lats = pbfDelta(data, *value)
+        elif field == 9:
+            lons = pbfDelta(data, *value)
+        elif field == 10 and options['load_node_subtree']:
+            keys_vals = pbfPacked(data, *value)
+        elif field == 5 and options['load_additional_attr']:
+            info = value
+
+    # division, not multiplication by 1e-9, rounds like parsing the xml
+    lats = array('d', [(lat_offset + granularity * v) / 1e9 for v in lats])
+    lons = array('d', [(lon_offset + granularity * v) / 1e9 for v in lons])
+    ascending = all(a < b for a, b in zip(ids, ids[1:]))
+
+    tags = {}
+    if keys_vals:
+        i = 0
+        for node_id in ids:
+            if keys_vals[i]:
+                node_tags = {}
+                while keys_vals[i]:
+                    node_tags[strings[keys_vals[i]]] = strings[keys_vals[i + 1]]
+                    i += 2
+                tags[node_id] = node_tags
+            i += 1
+
+    attrs = {}
+    if options['load_additional_attr'] and not info:
+        attrs = dict.fromkeys(ids, PBF_NO_INFO)
+    elif info:
+        columns = {}
+        for field, _, value in pbfFields(data, *info):
+            if field in (2, 3, 4, 5):
+                columns[field] = pbfDelta(data, *value)
+            else:
+                columns[field] = pbfPacked(data, *value)
+        n = len(ids)
+        version, timestamp, changeset, uid, user, visible = [
+            columns.get(f, [None] * n) for f in (1, 2, 3, 4, 5, 6)]
+        for i, node_id in enumerate(ids):
+            t = timestamp[i]
+            attrs[node_id] = pbfAttributes(
+                options, visible[i], version[i], changeset[i],
+                t * date_granularity // 1000 if t is not None else None,
+                strings[user[i]] if user[i] is not None else None, uid[i])
+
+    return array(ID_TYPECODE, ids), lats, lons, tags, attrs, ascending
+
+
+def pbfPrimitiveBlock(data, options):
+    strings, groups = [], []
+    granularity, lat_offset, lon_offset, date_granularity = 100, 0, 0, 1000
+    for field, _, value in pbfFields(data, 0, len(data)):
+        if field == 1:
+            strings = [data[s:e].decode('utf-8') for f, _, (s, e)
+                       in pbfFields(data, *value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 18:
+            date_granularity = value
+        elif field == 19:
+            lat_offset = pbfInt64(value)
+        elif field == 20:
+            lon_offset = pbfInt64(value)
+    block = (strings, granularity, lat_offset, lon_offset, date_granularity)
+    additional = options['load_additional_attr']
+
+    nodes, ways, relations = [], [], []
+    for group in groups:
+        for field, _, value in pbfFields(data, *group):
+
+            if field == 2 and options['load_nodes']:
+                nodes.append(pbfDenseNodes(data, value, block, options))
+
+            elif field == 1 and options['load_nodes']:
+                # plain nodes, rare
+                values = dict((f, v) for f, _, v in pbfFields(data, *value))
+                node_id = (values[1] >> 1) ^ -(values[1] & 1)
+                lat = (lat_offset + granularity * ((values[8] >> 1) ^
+                                                   -(values[8] & 1))) / 1e9
+                lon = (lon_offset + granularity * ((values[9] >> 1) ^
+                                                   -(values[9] & 1))) / 1e9
+                tags = pbfTags(data, values.get(2), values.get(3), strings) \
+                    if options['load_node_subtree'] else {}
+                attrs = {}
+                if additional:
+                    attrs[node_id] = pbfInfo(data, values[4], strings,
+                                             date_granularity, options) \
+                        if 4 in values else PBF_NO_INFO
+                nodes.append((array(ID_TYPECODE, [node_id]), array('d', [lat]),
+                              array('d', [lon]), {node_id: tags} if tags else {},
+                              attrs, True))
+
+            elif field == 3 and options['load_ways']:
+                values = dict((f, v) for f, _, v in pbfFields(data, *value))
+                attr = None
+                if additional:
+                    attr = pbfInfo(data, values[4], strings, date_granularity,
+                                   options) if 4 in values else PBF_NO_INFO
+                if options['load_way_subtree']:
+                    refs = pbfDelta(data, *values[8]) if 8 in values else []
+                    tags = pbfTags(data, values.get(2), values.get(3), strings)
+                else:
+                    refs, tags = {}, {}
+                ways.append((pbfInt64(values[1]), refs, tags, attr))
+
+            elif field == 4 and options['load_relations']:
+                values = dict((f, v) for f, _, v in pbfFields(data, *value))
+                attr = None
+                if additional:
+                    attr = pbfInfo(data, values[4], strings, date_granularity,
+                                   options) if 4 in values else PBF_NO_INFO
+                if options['load_relation_subtree']:
+                    roles = pbfPacked(data, *values[8]) if 8 in values else []
+                    refs = pbfDelta(data, *values[9]) if 9 in values else []
+                    types = pbfPacked(data, *values[10]) if 10 in values else []
+                    members = [(PBF_MEMBER_TYPES[t], ref, strings[role])
+                               for t, ref, role in zip(types, refs, roles)]
+                    tags = pbfTags(data, values.get(2), values.get(3), strings)
+                else:
+                    members, tags = {}, {}
+                relations.append((pbfInt64(values[1]), members, tags, attr))
+
+    if len(nodes) > 1:
+        merged = [array(ID_TYPECODE), array('d'), array('d'), {}, {}, True]
+        for ids, lats, lons, tags, attrs, ascending in nodes:
+            merged[5] = merged[5] and ascending and not (
+                len(merged[0]) and len(ids) and ids[0] <= merged[0][-1])
+            merged[0].extend(ids)
+            merged[1].extend(lats)
+            merged[2].extend(lons)
+            merged[3].update(tags)
+            merged[4].update(attrs)
+        nodes = tuple(merged)
+    else:
+        nodes = nodes[0] if nodes else None
+
+    return None, nodes, ways, relations
+
+
+def pbfHeaderBlock(data):
+    for field, _, value in pbfFields(data, 0, len(data)):
+        if field == 1: # bbox in nanodegrees
+            bbox = dict((f, (v >> 1) ^ -(v & 1))
+                        for f, _, v in pbfFields(data, *value))
+            return (bbox.get(4, 0) / 1e9, bbox.get(1, 0) / 1e9,
+                    bbox.get(3, 0) / 1e9, bbox.get(2, 0) / 1e9)
+
+
+def decodePbfBlob(task):
+    """Decode one fileblock of an .osm.pbf file.
+
+    task is (blob type, Blob bytes, parser options). Returns (bounds,
+    nodes, ways, relations) of plain values, see
+    OsmXmlFileParser.__addPbfBlock. Options decide what is decoded at all.
+    """
+
+    blob_type, blob, options = task
+    blob = bytearray(blob)
+    raw = None
+    for field, _, value in pbfFields(blob, 0, len(blob)):
+        if field == 1:
+            raw = blob[value[0]:value[1]]
+        elif field == 3:
+            raw = bytearray(zlib.decompress(bytes(blob[value[0]:value[1]])))
+        elif field in (4, 5, 6, 7):
+            raise ValueError('unsupported pbf compression (field {})'
+                             .format(field))
+
+    if blob_type == 'OSMHeader':
+        return pbfHeaderBlock(raw), None, [], []
+    elif blob_type == 'OSMData':
+        return pbfPrimitiveBlock(raw, options)
+    return None, None, [], [] # unknown blob types are skipped
+
+
 class OsmObjects(object):
 
 
     def __init__(self, osmxml):
         self.osmxml = osmxml
-        self.__recursive_relation_ids = []
-        self.__used_way_ids = []
-        self.__used_node_ids = []
+        self.__nested_relation_ids = set()
+        self.__used_way_ids = set()
+        self.__used_node_ids = set()
+        self.__segments = {} # relation id -> flattened membership, see below
         self.relations = self.__readRelations(osmxml)
         self.ways = self.__readWays(osmxml)
         self.nodes = self.__readNodes(osmxml)
 
 
-    def __recursiveMembers(self, relation):
-        stack = [relation]
-        members = []
-        recursive_relations = set()
-        recursive_relation_ids = []
-
-        while stack:
-            current_relation = stack.pop(0)
-
-            while stack and current_relation in recursive_relations:
-                current_relation = stack.pop(0) # avoid endless loop, pop item
-                # raise Exception('recursion loop in relation')
-            recursive_relations.add(current_relation)
-
-            for member in current_relation.members:
-                if member.typ == 'relation':
-                    if self.osmxml.relations.get(member.ref_id):
-                        recursive_relation_ids.append(member.ref_id)
-                        stack.append(self.osmxml.relations.get(member.ref_id))
-                    else:
-                        # 'relation {} not found in xml'.format(member.ref_id)
-                        pass
+    def __children(self, relation):
+        # ids of the relations inside a relation, in member order
+        relations = self.osmxml.relations
+        children = []
+        for member in relation.members:
+            if member.typ == 'relation':
+                if member.ref_id in relations:
+                    children.append(member.ref_id)
                 else:
-                    members.append(member)
-
-        return recursive_relation_ids, members
+                    # 'relation {} not found in xml'.format(member.ref_id)
+                    pass
+        return children
+
+
+    def __flatten(self, relation_id):
+        # memoizes [(relation id, node and way members)] of the relation
+        # and of all relations inside it, each relation once, so relations
+        # shared by several parents are expanded once. relations in a loop
+        # (strongly connected components, Tarjan) share their membership.
+        # index: visit order of the relations, stack: unfinished relations,
+        # work: [relation id, children, next child] of the relations being
+        # visited, an explicit stack so deep nesting can't hit the
+        # recursion limit
+        relations = self.osmxml.relations
+        index = {relation_id: 0}
+        low = {relation_id: 0}
+        stack = [relation_id]
+        work = [[relation_id, self.__children(relations[relation_id]), 0]]
+
+        while work:
+            frame = work[-1]
+            rel_id, children, i = frame
+            if i < len(children):
+                frame[2] = i + 1
+                child_id = children[i]
+                self.__nested_relation_ids.add(child_id)
+                if child_id in self.__segments:
+                    continue
+                elif child_id not in index:
+                    index[child_id] = low[child_id] = len(index)
+                    stack.append(child_id)
+                    work.append([child_id,
+                                 self.__children(relations[child_id]), 0])
+                else: # visited and unfinished, so on the stack
+                    low[rel_id] = min(low[rel_id], index[child_id])
+                continue
+
+            # all children done
+            work.pop()
+            if low[rel_id] == index[rel_id]:
+                component = [stack.pop()]
+                while component[-1] != rel_id:
+                    component.append(stack.pop())
+                component.reverse()
+                segments = [(r, [m for m in relations[r].members
+                                 if m.typ != 'relation']) for r in component]
+                seen = set(component)
+                for r in component:
+                    for child_id in self.__children(relations[r]):
+                        for segment in self.__segments.get(child_id, ()):
+                            if segment[0] not in seen:
+                                seen.add(segment[0])
+                                segments.append(segment)
+                for r in component:
+                    self.__segments[r] = segments
+            if work:
+                parent_id = work[-1][0]
+                low[parent_id] = min(low[parent_id], low[rel_id])
 
 
     def __readRelations(self, osmxml):
         relations = []
-        for rel_id, relation in osmxml.relations.iteritems():
+        for rel_id, relation in iteritems(osmxml.relations):
+            # recursively collect all members within a relation
+            if rel_id not in self.__segments:
+                self.__flatten(rel_id)
+            members = []
+            for _, direct in self.__segments[rel_id]:
+                members.extend(direct)
             relation.id = rel_id
             relation.ways = []
             relation.nodes = []
-
-            # recursively collect all members within a relation
-            recursive_relation_ids, members = self.__recursiveMembers(relation)
-            self.__recursive_relation_ids.extend(recursive_relation_ids)
             relation.members = members
-            
+
             for member in relation.members:
                 if member.typ == 'node':
                     node = osmxml.nodes.get(member.ref_id)
-                    if member.ref_id not in self.__used_node_ids:
-                        self.__used_node_ids.append(member.ref_id)
+                    self.__used_node_ids.add(member.ref_id)
                     if node:
                         node.id = member.ref_id
                         relation.nodes.append(node)
@@ -372,10 +1531,9 @@ class OsmObjects(object):
 
                 elif member.typ == 'way':
                     way = osmxml.ways.get(member.ref_id)
-                    if member.ref_id not in self.__used_way_ids:
-                        self.__used_way_ids.append(member.ref_id)
+                    self.__used_way_ids.add(member.ref_id)
                     if way:
-                        self.__used_node_ids.extend(way.node_refs)
+                        self.__used_node_ids.update(way.node_refs)
                         way.id = member.ref_id
                         way.role = member.role
                         relation.ways.append(way)
@@ -383,10 +1541,6 @@ class OsmObjects(object):
                         # 'way {} not found in xml'.format(member.ref_id)
                         pass
 
-                elif member.typ == 'relation':
-                    # 'not possible | recursively collected all members'
-                    pass
-
                 else:
                     # 'unknown member.typ | is not node, way, relation'
                     pass
@@ -396,17 +1550,18 @@ class OsmObjects(object):
                 relations.append(relation)
 
         # no duplicates. take only relation not relations inside a relation.
-        r = [r for r in relations if r.id not in self.__recursive_relation_ids]
+        nested = self.__nested_relation_ids
+        self.__segments = {}
+        r = [r for r in relations if r.id not in nested]
 
         return r
 
 
     def __readWays(self, osmxml):
         ways = []
-        self.__used_way_ids = set(self.__used_way_ids)
-        for way_id, way in osmxml.ways.iteritems():
+        for way_id, way in iteritems(osmxml.ways):
             if way_id not in self.__used_way_ids:
-                self.__used_node_ids.extend(way.node_refs)
+                self.__used_node_ids.update(way.node_refs)
                 way.id = way_id
                 # append way only if it contains at least 2 node_refs (line)
                 if len(way.node_refs) >= 2:
@@ -419,17 +1574,15 @@ class OsmObjects(object):
 
 
     def __readNodes(self, osmxml):
+        # Node objects only for the nodes not used by a relation, the others
+        # stay in the arrays of the NodeStore
         nodes = []
-        self.__used_node_ids = set(self.__used_node_ids)
-        for node_id, node in osmxml.nodes.iteritems():
-            if node_id not in self.__used_node_ids:
-                node.id = node_id
-                # append node only if it contains lat/lon location
-                if node.latitude and node.longitude:
-                    nodes.append(node)
-            else:
-                # '{} node already used by a relation'.format(node_id)
-                pass
+        store, used = osmxml.nodes, self.__used_node_ids
+        ids, latitudes, longitudes = store.arrays()
+        for i, node_id in enumerate(ids):
+            # append node only if it contains lat/lon location
+            if node_id not in used and latitudes[i] and longitudes[i]:
+                nodes.append(store.node(i))
 
         return nodes
 
@@ -439,63 +1592,267 @@ class OsmObjects(object):
             .format(len(self.nodes), len(self.ways), len(self.relations)))
 
 
+@contextmanager
+def frozenGc():
+    # objects alive on entry (the parsed entities) are left out of the
+    # collections while many objects are built at once, each one would
+    # traverse all of them. new garbage is still collected, also that of
+    # the host. python 3.7+, a no-op elsewhere or if the host froze objects
+    if not hasattr(gc, 'freeze') or gc.get_freeze_count():
+        yield
+        return
+    gc.freeze()
+    try:
+        yield
+    finally:
+        gc.unfreeze()
+
+
+# the MultiPolygon of a way by building tag and geometry attributes, and the
+# tags extrusionHeight needs in meter
+GEOMETRY_CLASSES = ('buildings2d', 'buildings3d', 'objects2d', 'objects3d')
+GEOMETRY_HEIGHTS = ('min_height', 'height', 'min_level', 'levels',
+                    'roof_height')
+GEOMETRY_TAGS = frozenset(['height', 'min_height', 'levels', 'min_level',
+                           'building:height', 'building:min_height',
+                           'building:levels', 'building:min_level',
+                           'roof:height', 'roof:shape'])
+
+
+def geometryAttributes(tags):
+    attr = {}
+    if GEOMETRY_TAGS.isdisjoint(tags): # most ways
+        return attr
+
+    ##### heights and levels
+    for item in ['height', 'min_height', 'levels', 'min_level']:
+        value = tags.get(item)
+        if value:
+            attr[item] = value
+
+        item = 'building:' + item
+        value = tags.get(item)
+        if value:
+            attr[item] = value
+
+    ##### roof
+    for item in ['height', 'shape']:
+        item = 'roof:' + item
+        value = tags.get(item)
+        if value:
+            attr[item] = value
+
+    return attr
+
+
+def keyOrValueInTags(tags, search_str=''):
+    # <tag k="building" v="yes"/> or <tag k="type" v="building"/>
+    for k, v in iteritems(tags):
+        if search_str in k or search_str == v:
+            return True
+    return False
+
+
+def geometryHeights(geom_attr):
+    # meter values of GEOMETRY_HEIGHTS, plain or building: tags, 0 if none
+    if not geom_attr:
+        return (0,) * len(GEOMETRY_HEIGHTS)
+    heights = []
+    for item in GEOMETRY_HEIGHTS:
+        value_str = geom_attr.get(item) or geom_attr.get('building:' + item)
+        heights.append(unitToMeter(value_str) if value_str else 0)
+    return tuple(heights)
+
+
+# ON_ZERO_TOLERANCE and ON_RELATIVE_TOLERANCE, see pointsCoincide
+ZERO_TOLERANCE = 2.0 ** -32
+RELATIVE_TOLERANCE = 2.0 ** -42
+
+
+def pointsCoincide(x0, y0, x1, y1):
+    # whether Rhino takes two points for the same (ON_PointsAreCoincident)
+    for a, b in ((x0, x1), (y0, y1)):
+        tolerance = max((abs(a) + abs(b)) * RELATIVE_TOLERANCE, ZERO_TOLERANCE)
+        if abs(a - b) > tolerance:
+            return False
+    return True
+
+
+def polylineClosed(coordinates, first=0, last=None):
+    # Curve.IsClosed of the curve getCurve makes of the points x0, y0, x1,
+    # y1, ... in coordinates[first:last] (degree 1, uniform knots): the
+    # ends coincide, the points a third and two thirds along do not
+    if last is None:
+        last = len(coordinates)
+    count = (last - first) // 2
+    if count < 2:
+        return False
+    x0, y0 = coordinates[first], coordinates[first + 1]
+    x1, y1 = coordinates[last - 2], coordinates[last - 1]
+    if not pointsCoincide(x0, y0, x1, y1):
+        return False
+    for fraction in (1.0 / 3.0, 2.0 / 3.0):
+        t = fraction * (count - 1)
+        i = min(int(t), count - 2)
+        t -= i
+        j = first + 2 * i
+        x = (1 - t) * coordinates[j] + t * coordinates[j + 2]
+        y = (1 - t) * coordinates[j + 1] + t * coordinates[j + 3]
+        if pointsCoincide(x0, y0, x, y) or pointsCoincide(x1, y1, x, y):
+            return False
+    return True
+
+
+def geometryData(ids, xs, ys, node_refs, tags, relation_tags):
+    """Pure-data phase of OsmGeometry, no Rhino.
+
+    ids are the sorted node ids, xs, ys their projected coordinates, and
+    node_refs, tags and relation_tags (None for ways outside a relation)
+    lists with one item per way.
+    Returns (classes, attributes, heights, coordinates, ends, closed):
+    GEOMETRY_CLASSES indexes, geometry attributes and geometryHeights by
+    position of the ways tagged with any, coordinates x0, y0, x1, y1, ... of
+    the nodes found of all ways, ends the end of each way in it, closed
+    whether their curve is closed, see polylineClosed.
+    """
+
+    count = len(ids)
+    ends = array('l')
+    if numpy is not None:
+        # all node refs of the ways are looked up at once
+        ids, xs, ys = (numpy.frombuffer(a, dtype=a.typecode)
+                       for a in (ids, xs, ys))
+        lengths = [len(refs) for refs in node_refs]
+        refs = numpy.fromiter(chain.from_iterable(node_refs), dtype=ids.dtype,
+                              count=sum(lengths))
+        index = numpy.minimum(numpy.searchsorted(ids, refs), max(count - 1, 0))
+        found = ids[index] == refs if count else numpy.zeros(len(refs), bool)
+        points = numpy.empty((int(found.sum()), 2))
+        points[:, 0] = xs[index[found]]
+        points[:, 1] = ys[index[found]]
+        coordinates = _doubles(points.ravel())
+        # coordinates found up to the last ref of each way
+        found = numpy.concatenate(([0], numpy.cumsum(found)))
+        ends.extend((2 * found[numpy.cumsum(lengths)]).tolist())
+    else:
+        coordinates = array('d')
+        for refs in node_refs:
+            for node_id in refs:
+                j = bisect_left(ids, node_id)
+                if j < count and ids[j] == node_id:
+                    coordinates.append(xs[j])
+                    coordinates.append(ys[j])
+            ends.append(len(coordinates))
+
+    classes, closed = array('b'), array('b')
+    attributes, heights = {}, {}
+    first = 0
+    for i, way_tags, parent_tags, last in zip(
+            range(len(node_refs)), tags, relation_tags, ends):
+        closed.append(polylineClosed(coordinates, first, last))
+        first = last
+
+        if parent_tags is None:
+            geom_attr = geometryAttributes(way_tags)
+            building = keyOrValueInTags(way_tags, search_str='building')
+        else:
+            geom_attr = geometryAttributes(parent_tags)
+            geom_attr.update(geometryAttributes(way_tags))
+            building = keyOrValueInTags(way_tags, search_str='building') \
+                or keyOrValueInTags(parent_tags, search_str='building')
+        # buildings2d, buildings3d, objects2d, objects3d
+        classes.append((0 if building else 2) + (1 if geom_attr else 0))
+        if geom_attr:
+            attributes[i] = geom_attr
+            heights[i] = geometryHeights(geom_attr)
+
+    return classes, attributes, heights, coordinates, ends, closed
+
+
+def prepareGeometry(osmxml, osmobj, xs, ys):
+    # geometryData of osmobj.ways, then of the ways of each relation;
+    # [(way, relation or None, (class index, geometry attributes, heights,
+    # coordinates, closed))]
+    entries = [(way, None) for way in osmobj.ways]
+    entries.extend((way, relation) for relation in osmobj.relations
+                   for way in relation.ways)
+    return prepareWays(osmxml, entries, xs, ys)
+
+
+def prepareWays(osmxml, entries, xs, ys):
+    # prepareGeometry of [(way, relation or None)]
+    classes, attributes, heights, coordinates, ends, closed = geometryData(
+        osmxml.nodes.arrays()[0], xs, ys,
+        [way.node_refs for way, _ in entries],
+        [way.tags for way, _ in entries],
+        [relation.tags if relation is not None else None
+         for _, relation in entries])
+
+    no_heights = (0,) * len(GEOMETRY_HEIGHTS)
+    prepared = []
+    for i, (way, relation), c, first, last, k in zip(
+            range(len(entries)), entries, classes, chain((0,), ends), ends,
+            closed):
+        prepared.append((way, relation, (
+            c, attributes.get(i, {}), heights.get(i, no_heights),
+            coordinates[first:last], k == 1)))
+    return prepared
+
+
 class OsmGeometry(object):
 
 
-    def __init__(self, osmxml, osmobj):
+    def __init__(self, osmxml, osmobj, projection=None):
         self.osmxml = osmxml
         self.osmobj = osmobj
-        self.nodes = self.points(osmobj)
-        self.ways = self.polygon(osmobj)
-        self.relations = self.multipolygon(osmobj)
+        # Mercator (EPSG:3857 meters), LocalMercator or TransverseMercator
+        self.projection = projection or Mercator
+        # all nodes projected once, points are gathered by NodeStore index
+        _, latitudes, longitudes = osmxml.nodes.arrays()
+        self.xs, self.ys = self.projection.degreesToMeterArrays(latitudes,
+                                                                longitudes)
+        # classification, heights and coordinates as plain data first, then
+        # Rhino objects (points, curves, extrusions)
+        with frozenGc():
+            prepared = prepareGeometry(osmxml, osmobj, self.xs, self.ys)
+            self.nodes = self.points(osmobj)
+            self.ways = self.polygon(osmobj, prepared[:len(osmobj.ways)])
+            self.relations = self.multipolygon(osmobj,
+                                               prepared[len(osmobj.ways):])
         
 
     def geometryAttributes(self, osm_entity):
-        attr = {}
-
-        ##### heights and levels
-        for item in ['height', 'min_height', 'levels', 'min_level']:
-            value = osm_entity.tags.get(item)
-            if value:
-                attr[item] = value
-
-            item = 'building:' + item
-            value = osm_entity.tags.get(item)
-            if value:
-                attr[item] = value
-
-        ##### roof
-        for item in ['height', 'shape']:
-            item = 'roof:' + item
-            value = osm_entity.tags.get(item)
-            if value:
-                attr[item] = value
-
-        return attr
+        return geometryAttributes(osm_entity.tags)
 
 
     def keyOrValueInTags(self, tags, search_str=''):
-        # <tag k="building" v="yes"/> or <tag k="type" v="building"/>
-        for k, v in tags.iteritems():
-            if search_str in k or search_str == v:
-                return True
-        return False
+        return keyOrValueInTags(tags, search_str)
 
 
     def getNodePoint(self, node_id):
-        node = self.osmxml.nodes.get(node_id)
-        if node:
-            lat, lon = node.latitude, node.longitude
-            x, y = Mercator.degreesToMeter(lat, lon)
-            return Rhino.Geometry.Point3d(x, y, 0)
+        i = self.osmxml.nodes.index(node_id)
+        if i >= 0:
+            return Rhino.Geometry.Point3d(self.xs[i], self.ys[i], 0)
 
 
-    def getWayPoints(self, way_id):
+    def getWayCoordinates(self, way_id):
+        # projected (x, y) of the nodes of a way, missing nodes are skipped
         way = self.osmxml.ways.get(way_id)
-        points = []
+        coordinates = getattr(way, 'coordinates', None)
+        if coordinates is not None: # from prepareGeometry
+            return list(zip(coordinates[0::2], coordinates[1::2]))
+        index, xs, ys = self.osmxml.nodes.index, self.xs, self.ys
+        coordinates = []
         for node_id in way.node_refs:
-            pt = self.getNodePoint(node_id)
-            points.append(pt) if pt else None
+            i = index(node_id)
+            if i >= 0:
+                coordinates.append((xs[i], ys[i]))
+        return coordinates
+
+
+    def getWayPoints(self, way_id):
+        Point3d = Rhino.Geometry.Point3d
+        points = [Point3d(x, y, 0) for x, y in self.getWayCoordinates(way_id)]
 
         if len(points) >= 2: # at least a line
             return points
@@ -511,22 +1868,10 @@ class OsmGeometry(object):
     def extrusionHeight(self, way, floor2floor=3.8):
         f2f = floor2floor # floor-to-floor height in meter
 
-        def geom_unit(item):
-            value_str = way.geom_attr.get(item) 
-            if not value_str:
-                value_str = way.geom_attr.get('building:'+item)
-
-            if value_str:
-                value_meter = self.OsmUnit(value_str).get()
-                return value_meter
-            else:
-                return 0
-
-        min_height = geom_unit('min_height')
-        height = geom_unit('height')
-        min_level = geom_unit('min_level')
-        levels = geom_unit('levels')
-        roof_height = geom_unit('roof_height')
+        heights = getattr(way, 'heights', None) # from prepareGeometry
+        if heights is None:
+            heights = geometryHeights(way.geom_attr)
+        min_height, height, min_level, levels, roof_height = heights
 
         if height and min_height:
             if height - (min_height + roof_height) == 0:
@@ -557,7 +1902,20 @@ class OsmGeometry(object):
         return ext_start, ext_height
 
 
-    def multipolygon(self, osmobj):
+    def __setData(self, way, data):
+        geometry_class, way.geom_attr, way.heights, way.coordinates, \
+            way.closed = data
+        return GEOMETRY_CLASSES[geometry_class]
+
+
+    def multipolygon(self, osmobj, prepared=None):
+        # prepared: prepareGeometry of the ways of osmobj.relations, made
+        # here if not given
+        if prepared is None:
+            prepared = prepareWays(self.osmxml, [
+                (way, relation) for relation in osmobj.relations
+                for way in relation.ways], self.xs, self.ys)
+        prepared = iter(prepared)
         for relation in osmobj.relations:
             relation.buildings2d = self.MultiPolygon(self) # no height attr
             relation.buildings3d = self.MultiPolygon(self)
@@ -565,37 +1923,14 @@ class OsmGeometry(object):
             relation.objects3d = self.MultiPolygon(self)
 
             for way in relation.ways:
-                geom_attr = self.geometryAttributes(relation)
-                geom_attr.update(self.geometryAttributes(way))
-                way.geom_attr = geom_attr
-
-                if self.keyOrValueInTags(way.tags, search_str='building') \
-                or self.keyOrValueInTags(relation.tags, search_str='building'):
-                    
-                    if geom_attr: # 3d building
-                        if way.role == 'inner':
-                            relation.buildings3d.inner_ways.append(way)
-                        else:
-                            relation.buildings3d.outer_ways.append(way)
-                    
-                    else:  # 2d multipolygon building
-                        if way.role == 'inner':
-                            relation.buildings2d.inner_ways.append(way)
-                        else:
-                            relation.buildings2d.outer_ways.append(way)
-                else: 
-                    
-                    if geom_attr: # 3d objects e.g. fountain, wall, ...
-                        if way.role == 'inner':
-                            relation.objects3d.inner_ways.append(way)
-                        else:
-                            relation.objects3d.outer_ways.append(way)
-                    
-                    else: # 2d multipolygon
-                        if way.role == 'inner':
-                            relation.objects2d.inner_ways.append(way)
-                        else:
-                            relation.objects2d.outer_ways.append(way)
+                # buildings3d, buildings2d (multipolygon building),
+                # objects3d (e.g. fountain, wall, ...) or objects2d
+                _, _, data = next(prepared)
+                multipolygon = getattr(relation, self.__setData(way, data))
+                if way.role == 'inner':
+                    multipolygon.inner_ways.append(way)
+                else:
+                    multipolygon.outer_ways.append(way)
 
             for node in relation.nodes:
                 node.point = self.getNodePoint(node.id)
@@ -603,26 +1938,21 @@ class OsmGeometry(object):
         return osmobj.relations
 
 
-    def polygon(self, osmobj):
-        for way in osmobj.ways:
+    def polygon(self, osmobj, prepared=None):
+        # prepared: prepareGeometry of osmobj.ways, made here if not given
+        if prepared is None:
+            prepared = prepareWays(self.osmxml,
+                                   [(way, None) for way in osmobj.ways],
+                                   self.xs, self.ys)
+        for way, _, data in prepared:
             way.buildings2d = self.MultiPolygon(self) # no height attr
             way.buildings3d = self.MultiPolygon(self)
             way.objects2d = self.MultiPolygon(self) # no height attr
             way.objects3d = self.MultiPolygon(self)
-            
-            geom_attr = self.geometryAttributes(way)
-            way.geom_attr = geom_attr
-
-            if self.keyOrValueInTags(way.tags, search_str='building'):
-                if geom_attr: # 3d building
-                    way.buildings3d.outer_ways.append(way)
-                else:  # 2d polygon building
-                    way.buildings2d.outer_ways.append(way)
-            else: 
-                if geom_attr: # 3d objects e.g. fountain, wall, ...
-                    way.objects3d.outer_ways.append(way)
-                else: # 2d polygon
-                    way.objects2d.outer_ways.append(way)
+
+            # buildings3d, buildings2d (polygon building), objects3d (e.g.
+            # fountain, wall, ...) or objects2d
+            getattr(way, self.__setData(way, data)).outer_ways.append(way)
 
         return osmobj.ways
 
@@ -636,87 +1966,15 @@ class OsmGeometry(object):
 
 
     class OsmUnit(object):
-
-
-        units = {'m': 1, 'km': 1000, 'mi': 1609.344, 'nmi': 1852,
-                        'feet': 0.3048, 'inch': 0.0254}
+        # value of a height, length, ... tag in meter, see unitToMeter
 
 
         def __init__(self, txt):
             self.txt = str(txt)
 
 
-        def regex_match(self, regex):
-            match = re.search(regex, self.txt)
-            return match.groups() if match else None
-
-
-        def unit_prefix(self):
-            if "'" in self.txt and '"' in self.txt:
-                return 'feet'
-            elif "'" in self.txt:
-                return 'feet'
-            elif '"' in self.txt:
-                return 'inch'
-            else:
-                match = self.regex_match(r'([A-Za-z]{1,3})')
-                if match and match[0] in self.units:
-                    key = match[0]
-                    value = self.units[key]
-                    return key
-            return ''
-
-
-        def unit_conversion(self, value, unit):
-            if unit in self.units:
-                fac = self.units[unit]
-                value_meter = value * fac
-                return value_meter
-            else:
-                # 'unit not definded'
-                return value
-
-
-        def txt_2_float(self, unit):
-            if unit == 'feet' or unit ==  'inches':
-                match = self.regex_match(r'(\d{0,})\'?\"?(\d{0,})')
-
-                if match[0] and match[1]:
-                    ft = float(match[0])
-                    inches = float(match[1])
-                    ft = ft + inches * 1.0 / 12.0
-                    return ft
-
-                elif match[0]:
-                    ft = float(match[0])
-                    return ft
-
-                elif match[1]:
-                    inches = float(match[1])
-                    ft = inches * 1.0 / 12.0
-                    return ft
-
-                else:
-                    return 0.0
-
-            else:
-                chars = re.findall(r'[A-Za-z]', self.txt)
-                chars.extend(["'", "''", '"', ' '])
-                for c in chars:
-                    self.txt = self.txt.replace(c, '')
-                self.txt = self.txt.replace(',', '.')
-
-                try:
-                    return float(self.txt)
-                except:
-                    return 0.0
-
-
         def get(self):
-            unit = self.unit_prefix() # feet, inch, m, ...
-            value = self.txt_2_float(unit)
-            value_meter = self.unit_conversion(value, unit)
-            return value_meter
+            return unitToMeter(self.txt)
 
 
 
@@ -780,7 +2038,8 @@ class OsmGeometry(object):
             rh_extrusions = []
             if self.outer_ways and self.inner_ways:
 
-                if len(self.outer_ways) == 1:
+                if len(self.outer_ways) == 1 and self.outer_ways[0].closed:
+                    # open rings are skipped before any curve is created
                     way = self.outer_ways[0]
                     outer_crv = self.osmgeo.getCurve(way.id)
 
@@ -788,6 +2047,7 @@ class OsmGeometry(object):
                         # inner-crvs in outer-crv check
                         inner_crvs = [self.osmgeo.getCurve(way.id) 
                                       for way in self.inner_ways
+                                      if way.closed
                                      ]
                         inner_crvs = [
                             crv for crv in inner_crvs if crv.IsClosed and 
@@ -801,7 +2061,7 @@ class OsmGeometry(object):
                         if rh_ex:
                             rh_extrusions.append(rh_ex)
 
-                else:
+                elif len(self.outer_ways) > 1:
                     # TODO sort multiple outer_ways and inner_ways
                     # raise NotImplementedError()
                     pass
@@ -810,6 +2070,8 @@ class OsmGeometry(object):
                 
                 for ways in [self.outer_ways, self.inner_ways]:
                     for way in ways:
+                        if not way.closed:
+                            continue
                         crv = self.osmgeo.getCurve(way.id)
 
                         if crv.IsClosed:
@@ -822,6 +2084,13 @@ class OsmGeometry(object):
             return  rh_extrusions
 
 
+def _doubles(values):
+    # numpy array to array('d'), which indexes faster from python
+    doubles = array('d')
+    doubles.frombytes(numpy.ascontiguousarray(values, dtype=float).tobytes())
+    return doubles
+
+
 class Mercator(object):
     # Pseudo-Web-Mercator
     # http://wiki.openstreetmap.org/wiki/Mercator#Python
@@ -869,6 +2138,474 @@ class Mercator(object):
         return x, y
 
 
+    @staticmethod
+    def degreesToMeterArrays(latitudes, longitudes):
+        # sequences of lat, lon to x, y arrays ('d'), numpy vectorized where
+        # available, with the same clamp as latToY
+        if numpy is None:
+            return (array('d', map(Mercator.lonToX, longitudes)),
+                    array('d', map(Mercator.latToY, latitudes)))
+        lat = numpy.clip(numpy.asarray(latitudes, dtype=float), -89.5, 89.5)
+        x = numpy.radians(numpy.asarray(longitudes, dtype=float))
+        x *= Mercator.earth_radius
+        y = numpy.log(numpy.tan(math.pi/4.0 + numpy.radians(lat)/2.0))
+        y *= Mercator.earth_radius
+        return _doubles(x), _doubles(y)
+
+
+    @staticmethod
+    def meterToDegreesArrays(xs, ys):
+        # inverse of degreesToMeterArrays, x, y arrays to lat, lon arrays
+        if numpy is None:
+            return (array('d', map(Mercator.yToLat, ys)),
+                    array('d', map(Mercator.xToLon, xs)))
+        y = numpy.asarray(ys, dtype=float) / Mercator.earth_radius
+        lat = numpy.degrees(numpy.arctan(numpy.exp(y))*2.0 - math.pi/2.0)
+        lon = numpy.degrees(numpy.asarray(xs, dtype=float)
+                            / Mercator.earth_radius)
+        return _doubles(lat), _doubles(lon)
+
+
+class SpatialIndex(object):
+    """Static R-tree (sort-tile-recursive packed) over bounding boxes.
+
+    Built once over the ways and relations of OsmObjects in projected
+    coordinates, e.g. with fromGeometry(osmgeo), or over any items and
+    (minx, miny, maxx, maxy) boxes. Needs no Rhino.
+
+        inBox(minx, miny, maxx, maxy) -- Items whose box intersects.
+        inBoxes(boxes) -- The same for many boxes, e.g. all parcels.
+        atPoint(x, y) -- Items containing the point, boxes as candidates,
+                         then the even-odd rule on their geometry if it
+                         is closed, see closedPolylines().
+        nearest(x, y, k, where) -- The k nearest items [(distance, item)]
+                                   passing where(item), by distance to
+                                   their geometry, e.g. the nearest road.
+
+    polylines(item) -> [[(x, y), ...], ...] is the geometry of an item for
+    the exact queries; without it, its box is used.
+    """
+
+    node_capacity = 16
+
+
+    def __init__(self, items, boxes, polylines=None):
+        self.polylines = polylines
+        minx, miny, maxx, maxy = (array('d'), array('d'), array('d'),
+                                  array('d'))
+        for box in boxes:
+            minx.append(box[0])
+            miny.append(box[1])
+            maxx.append(box[2])
+            maxy.append(box[3])
+
+        # entries in tile order, every node_capacity consecutive entries
+        # share a leaf; the same for the nodes of every level above
+        items = list(items)
+        order = self.__tileOrder(minx, miny, maxx, maxy)
+        self.items = [items[i] for i in order]
+        self.boxes = tuple(array('d', [a[i] for i in order])
+                           for a in (minx, miny, maxx, maxy))
+
+        self.levels = [] # top down: (minx, miny, maxx, maxy, start, end)
+        boxes, count = self.boxes, len(order)
+        while count > 1 or not self.levels and count:
+            level = self.__parents(boxes, count)
+            order = self.__tileOrder(*level[:4])
+            level = tuple(array(a.typecode, [a[i] for i in order])
+                          for a in level)
+            self.levels.insert(0, level)
+            boxes, count = level[:4], len(order)
+
+
+    @classmethod
+    def fromGeometry(cls, osmgeo):
+        return cls.fromCoordinates(osmgeo.osmxml, osmgeo.osmobj, osmgeo.xs,
+                                   osmgeo.ys)
+
+
+    @classmethod
+    def fromOsm(cls, osmxml, osmobj, projection=None):
+        # without OsmGeometry, nodes projected like OsmGeometry does
+        _, latitudes, longitudes = osmxml.nodes.arrays()
+        xs, ys = (projection or Mercator).degreesToMeterArrays(latitudes,
+                                                               longitudes)
+        return cls.fromCoordinates(osmxml, osmobj, xs, ys)
+
+
+    @classmethod
+    def fromCoordinates(cls, osmxml, osmobj, xs, ys):
+        # ways and relations of osmobj, xs, ys projected NodeStore arrays
+        index = osmxml.nodes.index
+        Relation = OsmXmlFileParser.Relation
+
+        def polyline(way):
+            points = []
+            for node_id in way.node_refs:
+                i = index(node_id)
+                if i >= 0:
+                    points.append((xs[i], ys[i]))
+            return points
+
+        def polylines(entity):
+            ways = entity.ways if isinstance(entity, Relation) else [entity]
+            return [points for points in map(polyline, ways) if points]
+
+        items, boxes = [], []
+        for entity in chain(osmobj.ways, osmobj.relations):
+            points = [p for line in polylines(entity) for p in line]
+            if points:
+                x, y = [p[0] for p in points], [p[1] for p in points]
+                items.append(entity)
+                boxes.append((min(x), min(y), max(x), max(y)))
+        return cls(items, boxes, polylines)
+
+
+    def __tileOrder(self, minx, miny, maxx, maxy):
+        # sort by x into vertical slices of whole nodes, each slice by y
+        count, capacity = len(minx), self.node_capacity
+        nodes = -(-count // capacity)
+        slice_size = max(int(math.ceil(math.sqrt(nodes))), 1) * capacity
+        order = sorted(range(count), key=lambda i: minx[i] + maxx[i])
+        tiled = []
+        for start in range(0, count, slice_size):
+            tiled.extend(sorted(order[start:start + slice_size],
+                                key=lambda i: miny[i] + maxy[i]))
+        return tiled
+
+
+    def __parents(self, boxes, count):
+        # boxes and child ranges of the nodes over every node_capacity
+        minx, miny, maxx, maxy = boxes
+        level = (array('d'), array('d'), array('d'), array('d'),
+                 array('l'), array('l'))
+        for start in range(0, count, self.node_capacity):
+            end = min(start + self.node_capacity, count)
+            level[0].append(min(minx[start:end]))
+            level[1].append(min(miny[start:end]))
+            level[2].append(max(maxx[start:end]))
+            level[3].append(max(maxy[start:end]))
+            level[4].append(start)
+            level[5].append(end)
+        return level
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def inBox(self, minx, miny, maxx, maxy):
+        nodes = [0] if self.levels else []
+        for lminx, lminy, lmaxx, lmaxy, start, end in self.levels:
+            children = []
+            for i in nodes:
+                if lminx[i] <= maxx and lmaxx[i] >= minx and \
+                        lminy[i] <= maxy and lmaxy[i] >= miny:
+                    children.extend(range(start[i], end[i]))
+            nodes = children
+        eminx, eminy, emaxx, emaxy = self.boxes
+        items = self.items
+        return [items[i] for i in nodes if eminx[i] <= maxx and
+                emaxx[i] >= minx and eminy[i] <= maxy and emaxy[i] >= miny]
+
+
+    def inBoxes(self, boxes):
+        inBox = self.inBox
+        return [inBox(*box) for box in boxes]
+
+
+    def atPoint(self, x, y, exact=True):
+        candidates = self.inBox(x, y, x, y)
+        if not exact or self.polylines is None:
+            return candidates
+        found = []
+        for item in candidates:
+            lines = self.polylines(item)
+            if closedPolylines(lines) and pointInPolylines(x, y, lines):
+                found.append(item)
+        return found
+
+
+    def __boxDistance(self, boxes, i, x, y):
+        minx, miny, maxx, maxy = boxes
+        dx = max(minx[i] - x, 0.0, x - maxx[i])
+        dy = max(miny[i] - y, 0.0, y - maxy[i])
+        return math.hypot(dx, dy)
+
+
+    def __distance(self, item, x, y):
+        # 0 inside closed geometry, else to the nearest segment
+        lines = self.polylines(item)
+        if not lines:
+            return float('inf')
+        if closedPolylines(lines) and pointInPolylines(x, y, lines):
+            return 0.0
+        return distanceToPolylines(x, y, lines)
+
+
+    def nearest(self, x, y, k=1, where=None):
+        # best first: boxes are lower bounds of the distance of everything
+        # in them, items are pushed again with their geometry distance
+        if not self.levels:
+            return []
+        depth_entries = len(self.levels)
+        heap = [(self.__boxDistance(self.levels[0][:4], 0, x, y), 0, 0, 0,
+                 False)]
+        counter, found = 1, []
+        while heap and len(found) < k:
+            distance, _, depth, i, exact = heapq.heappop(heap)
+            if depth < depth_entries:
+                level = self.levels[depth]
+                boxes = self.levels[depth + 1][:4] \
+                    if depth + 1 < depth_entries else self.boxes
+                for child in range(level[4][i], level[5][i]):
+                    heapq.heappush(heap, (self.__boxDistance(boxes, child, x, y),
+                                          counter, depth + 1, child, False))
+                    counter += 1
+            elif exact:
+                found.append((distance, self.items[i]))
+            elif where is None or where(self.items[i]):
+                if self.polylines is not None:
+                    distance = self.__distance(self.items[i], x, y)
+                heapq.heappush(heap, (distance, counter, depth, i, True))
+                counter += 1
+        return found
+
+
+UNIT_FACTORS = {'m': 1, 'km': 1000, 'mi': 1609.344, 'nmi': 1852,
+                'feet': 0.3048, 'inch': 0.0254}
+UNIT_PREFIX = re.compile(r'([A-Za-z]{1,3})')
+FEET_INCHES = re.compile(r'(\d{0,})\'?\"?(\d{0,})')
+NOT_A_NUMBER = re.compile(r'[A-Za-z\'" ]')
+
+
+def parseUnit(txt):
+    # tag value like '10', '10 m', '7,5', "12'6\"" in meter; the first 1 to
+    # 3 letters are the unit, ' is feet, " is inch, no or unknown units
+    # are meter. Unparsable values are 0.0
+    txt = str(txt)
+    if "'" in txt:
+        unit = 'feet'
+    elif '"' in txt:
+        unit = 'inch'
+    else:
+        match = UNIT_PREFIX.search(txt)
+        unit = match.group(1) if match else ''
+
+    if unit == 'feet':
+        feet, inches = FEET_INCHES.search(txt).groups()
+        if feet and inches:
+            value = float(feet) + float(inches) * 1.0 / 12.0
+        elif feet:
+            value = float(feet)
+        elif inches:
+            value = float(inches) * 1.0 / 12.0
+        else:
+            value = 0.0
+    else:
+        try:
+            value = float(NOT_A_NUMBER.sub('', txt).replace(',', '.'))
+        except ValueError:
+            value = 0.0
+
+    if unit in UNIT_FACTORS:
+        return value * UNIT_FACTORS[unit]
+    return value
+
+
+def memoize(function, maxsize=4096):
+    # functools.lru_cache on python 3, else a dict cleared when full
+    try:
+        from functools import lru_cache
+        return lru_cache(maxsize)(function)
+    except ImportError:
+        cache = {}
+
+        def memoized(arg):
+            try:
+                return cache[arg]
+            except KeyError:
+                if len(cache) >= maxsize:
+                    cache.clear()
+                value = cache[arg] = function(arg)
+                return value
+        return memoized
+
+
+# a city has few distinct height strings, they are parsed once
+unitToMeter = memoize(parseUnit)
+
+
+class LocalMercator(object):
+    # Pseudo-Web-Mercator moved to a local origin, e.g. the center of the
+    # bounds, so coordinates stay small and precise in Rhino. Same scale as
+    # Mercator, x + x0, y + y0 are the EPSG:3857 meters
+
+
+    def __init__(self, lat0=0.0, lon0=0.0):
+        self.lat0, self.lon0 = lat0, lon0
+        self.x0, self.y0 = Mercator.degreesToMeter(lat0, lon0)
+
+
+    @classmethod
+    def fromBounds(cls, bounds):
+        return cls(*boundsCenter(bounds))
+
+
+    def degreesToMeter(self, lat, lon):
+        x, y = Mercator.degreesToMeter(lat, lon)
+        return x - self.x0, y - self.y0
+
+
+    def meterToDegrees(self, x, y):
+        return Mercator.meterToDegrees(x + self.x0, y + self.y0)
+
+
+    def degreesToMeterArrays(self, latitudes, longitudes):
+        xs, ys = Mercator.degreesToMeterArrays(latitudes, longitudes)
+        return _offset(xs, -self.x0), _offset(ys, -self.y0)
+
+
+    def meterToDegreesArrays(self, xs, ys):
+        return Mercator.meterToDegreesArrays(_offset(xs, self.x0),
+                                             _offset(ys, self.y0))
+
+
+class TransverseMercator(object):
+    # Transverse Mercator on the WGS84 ellipsoid, Krueger series to n**3
+    # (about a millimeter within the 6 degrees of an UTM zone)
+    # https://en.wikipedia.org/wiki/Universal_Transverse_Mercator_coordinate_system
+    # by default (lat0, lon0) is at 0, 0 and meters are true to scale near
+    # it, utm() gives the coordinates of an UTM zone
+
+    a = 6378137.0
+    f = 1 / 298.257223563
+
+
+    def __init__(self, lat0=0.0, lon0=0.0, k0=1.0, false_easting=0.0,
+                 false_northing=0.0):
+        self.lat0, self.lon0 = lat0, lon0
+        n = self.f / (2 - self.f)
+        self.n = n
+        self.k0A = k0 * self.a / (1 + n) * (1 + n**2/4.0 + n**4/64.0)
+        self.alpha = (n/2.0 - 2*n**2/3.0 + 5*n**3/16.0,
+                      13*n**2/48.0 - 3*n**3/5.0,
+                      61*n**3/240.0)
+        self.beta = (n/2.0 - 2*n**2/3.0 + 37*n**3/96.0,
+                     n**2/48.0 + n**3/15.0,
+                     17*n**3/480.0)
+        self.delta = (2*n - 2*n**2/3.0 - 2*n**3,
+                      7*n**2/3.0 - 8*n**3/5.0,
+                      56*n**3/15.0)
+        self.false_easting = false_easting
+        self.false_northing = 0.0
+        # northing of the origin latitude, so (lat0, lon0) is at the false
+        # easting and northing
+        self.false_northing = false_northing - self.degreesToMeter(lat0, lon0)[1]
+
+
+    @classmethod
+    def fromBounds(cls, bounds):
+        return cls(*boundsCenter(bounds))
+
+
+    @classmethod
+    def utm(cls, zone, south=False):
+        return cls(0.0, zone * 6 - 183, 0.9996, 500000.0,
+                   10000000.0 if south else 0.0)
+
+
+    @staticmethod
+    def utmZone(lon):
+        return int((lon + 180) // 6) % 60 + 1
+
+
+    def __forward(self, lat, lon, m):
+        # m: math for numbers, NumpyMath for arrays
+        c = 2 * math.sqrt(self.n) / (1 + self.n)
+        sin_lat = m.sin(m.radians(lat))
+        t = m.sinh(m.atanh(sin_lat) - c * m.atanh(c * sin_lat))
+        dlon = m.radians(lon) - math.radians(self.lon0)
+        xi = m.atan2(t, m.cos(dlon))
+        eta = m.atanh(m.sin(dlon) / m.sqrt(1 + t * t))
+        x, y = eta, xi
+        for j, alpha in enumerate(self.alpha, 1):
+            x = x + alpha * m.cos(2*j*xi) * m.sinh(2*j*eta)
+            y = y + alpha * m.sin(2*j*xi) * m.cosh(2*j*eta)
+        return (self.false_easting + self.k0A * x,
+                self.false_northing + self.k0A * y)
+
+
+    def __inverse(self, x, y, m):
+        xi = (y - self.false_northing) / self.k0A
+        eta = (x - self.false_easting) / self.k0A
+        xi_, eta_ = xi, eta
+        for j, beta in enumerate(self.beta, 1):
+            xi_ = xi_ - beta * m.sin(2*j*xi) * m.cosh(2*j*eta)
+            eta_ = eta_ - beta * m.cos(2*j*xi) * m.sinh(2*j*eta)
+        chi = m.asin(m.sin(xi_) / m.cosh(eta_))
+        lat = chi
+        for j, delta in enumerate(self.delta, 1):
+            lat = lat + delta * m.sin(2*j*chi)
+        lon = m.radians(self.lon0) + m.atan2(m.sinh(eta_), m.cos(xi_))
+        return m.degrees(lat), m.degrees(lon)
+
+
+    def degreesToMeter(self, lat, lon):
+        return self.__forward(lat, lon, math)
+
+
+    def meterToDegrees(self, x, y):
+        return self.__inverse(x, y, math)
+
+
+    def degreesToMeterArrays(self, latitudes, longitudes):
+        if numpy is None:
+            xs, ys = array('d'), array('d')
+            for lat, lon in zip(latitudes, longitudes):
+                x, y = self.__forward(lat, lon, math)
+                xs.append(x)
+                ys.append(y)
+            return xs, ys
+        x, y = self.__forward(numpy.asarray(latitudes, dtype=float),
+                              numpy.asarray(longitudes, dtype=float), NumpyMath)
+        return _doubles(x), _doubles(y)
+
+
+    def meterToDegreesArrays(self, xs, ys):
+        if numpy is None:
+            lats, lons = array('d'), array('d')
+            for x, y in zip(xs, ys):
+                lat, lon = self.__inverse(x, y, math)
+                lats.append(lat)
+                lons.append(lon)
+            return lats, lons
+        lat, lon = self.__inverse(numpy.asarray(xs, dtype=float),
+                                  numpy.asarray(ys, dtype=float), NumpyMath)
+        return _doubles(lat), _doubles(lon)
+
+
+class NumpyMath(object):
+    # the math functions of the projections, for numpy arrays
+    if numpy is not None:
+        sin, cos, sinh, cosh = numpy.sin, numpy.cos, numpy.sinh, numpy.cosh
+        sqrt, asin, atanh = numpy.sqrt, numpy.arcsin, numpy.arctanh
+        atan2, radians, degrees = numpy.arctan2, numpy.radians, numpy.degrees
+
+
+def boundsCenter(bounds):
+    # (lat, lon) of the center of OsmXmlFileParser.Bounds
+    return ((float(bounds.minlat) + float(bounds.maxlat)) / 2.0,
+            (float(bounds.minlon) + float(bounds.maxlon)) / 2.0)
+
+
+def _offset(values, offset):
+    # array('d') of values + offset
+    if numpy is None:
+        return array('d', [v + offset for v in values])
+    return _doubles(numpy.asarray(values, dtype=float) + offset)
+
+
 class ProgressBar(object):
 
 